@@ -1,4 +1,7 @@
-from parser import Gedcom, GedcomParseError
+from parser import Gedcom, GedcomParseError, FeedParser, iter_records
 from element import Element
+from writer import write_records
+from metrics import ParseMetrics
 
-__all__ = ["Gedcom", "Element", "GedcomParseError"]
+__all__ = ["Gedcom", "Element", "GedcomParseError", "FeedParser",
+           "iter_records", "write_records", "ParseMetrics"]
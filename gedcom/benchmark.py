@@ -0,0 +1,246 @@
+#
+# Gedcom 6.0 Parser
+#
+# Copyright (C) 2015 The Museum of the Jewish People
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+from __future__ import unicode_literals
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import timeit
+from parser import Gedcom, detect_encoding, DETECT_PREFIX
+from relations import RelationshipIndex
+from synthetic import TreeSpec, generate
+import chardet
+
+# Version of the results format.
+RESULTS_VERSION = 1
+
+# Tree sizes benchmarked by default. Sizes up to 1000000 can be given,
+# but need several GB of memory.
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+# Number of individuals ancestors and paths are looked up for.
+SAMPLE_SIZE = 100
+
+# Criteria of the criteria_match and query benchmarks.
+CRITERIA = "surname=Cohen:birthrange=1750-1800"
+
+# Slowdown above which compare reports a regression.
+TOLERANCE = 1.2
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, repeat=3, seed=0, directory=None,
+                   label=None, **options):
+    """ Benchmark the parser on synthetic trees of the given sizes
+
+    For each size a tree is generated with the TreeSpec options and
+    `seed` into `directory`, a temporary directory by default, and each
+    benchmark is run `repeat` times keeping the fastest. Returns the
+    results as a JSON-serializable dict, see write_results.
+    """
+    temporary = directory is None
+    if temporary:
+        directory = tempfile.mkdtemp(prefix="gedcom-bench-")
+    try:
+        runs = []
+        for size in sizes:
+            spec = TreeSpec(individuals=size, seed=seed, **options)
+            path = os.path.join(directory, "synthetic-{}.ged".format(size))
+            with open(path, 'wb') as fd:
+                generate(fd, spec)
+            runs.append(benchmark_tree(path, size, repeat, seed))
+    finally:
+        if temporary:
+            shutil.rmtree(directory, ignore_errors=True)
+    return {
+        "version": RESULTS_VERSION,
+        "label": label,
+        "created": datetime.datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "seed": seed,
+        "options": options,
+        "runs": runs,
+    }
+
+
+def benchmark_tree(path, size, repeat, seed):
+    """ Run the benchmarks on one generated tree """
+    with open(path, 'rb') as fd:
+        data = fd.read()
+    results = {}
+
+    def measure(name, function, count, setup=None):
+        results[name] = measure_best(function, count, repeat, setup)
+
+    gedcom = Gedcom(path, detect="header")
+    lines = len(gedcom.as_list)
+    individuals = [e for e in gedcom.as_list if e.is_individual]
+    measure("parse", lambda: Gedcom(path, detect="header"), lines)
+    measure("detect_header", lambda: detect_encoding(data), 1)
+    measure("detect_chardet", lambda: chardet.detect(data[:DETECT_PREFIX]), 1)
+
+    def reset_properties():
+        for individual in individuals:
+            individual._summary = None
+            individual._tag_index = None
+
+    def read_properties():
+        for individual in individuals:
+            individual.name, individual.gender, individual.deceased
+            individual.birth_year, individual.death_year
+
+    measure("properties", read_properties, len(individuals), reset_properties)
+    measure("relationship_index", lambda: RelationshipIndex(gedcom), 1)
+
+    sample = random.Random(seed).sample(individuals[len(individuals) // 2:],
+                                        min(SAMPLE_SIZE, len(individuals) // 2))
+    measure("get_ancestors",
+            lambda: [gedcom.get_ancestors(e) for e in sample], len(sample))
+    # Each individual and its furthest natural ancestor.
+    pairs = []
+    for individual in sample:
+        ancestors = gedcom.get_ancestors(individual, "NAT")
+        if ancestors:
+            pairs.append((individual, ancestors[-1]))
+    measure("find_path_to_anc",
+            lambda: [gedcom.find_path_to_anc(a, b) for a, b in pairs],
+            len(pairs))
+    measure("criteria_match",
+            lambda: [e.criteria_match(CRITERIA) for e in individuals],
+            len(individuals))
+    measure("query", lambda: list(gedcom.query(CRITERIA)), 1,
+            lambda: setattr(gedcom, '_query_index', None))
+    return {
+        "individuals": size,
+        "lines": lines,
+        "bytes": len(data),
+        "benchmarks": results,
+    }
+
+
+def measure_best(function, count, repeat, setup=None):
+    """ Return the fastest of `repeat` runs of a function doing `count`
+    operations, as a dict of seconds and operations per second. `setup`
+    is called untimed before each run.
+    """
+    best = None
+    for n in range(repeat):
+        if setup is not None:
+            setup()
+        started = timeit.default_timer()
+        function()
+        seconds = timeit.default_timer() - started
+        if best is None or seconds < best:
+            best = seconds
+    return {
+        "seconds": best,
+        "count": count,
+        "per_second": count / best if best else None,
+    }
+
+
+def write_results(results, fd):
+    """ Write benchmark results as JSON to a text file object
+
+    The results hold the format version, the label, date, Python version
+    and platform of the run, and for each tree size its number of lines
+    and bytes and, per benchmark, the best time in seconds, the number of
+    operations timed and their rate.
+    """
+    json.dump(results, fd, indent=2, sort_keys=True)
+
+
+def read_results(fd):
+    """ Read results written by write_results """
+    results = json.load(fd)
+    if results.get("version") != RESULTS_VERSION:
+        raise ValueError("Unsupported benchmark results version")
+    return results
+
+
+def compare(old, new, tolerance=TOLERANCE):
+    """ Compare two benchmark results
+
+    Returns (individuals, benchmark, old seconds, new seconds, ratio)
+    tuples for the benchmarks run on the same tree sizes in both, and the
+    list of those that got slower by more than `tolerance` times.
+    """
+    old_runs = dict((run["individuals"], run) for run in old["runs"])
+    rows = []
+    for run in new["runs"]:
+        previous = old_runs.get(run["individuals"])
+        if previous is None:
+            continue
+        for name, result in sorted(run["benchmarks"].items()):
+            before = previous["benchmarks"].get(name)
+            if before is None:
+                continue
+            ratio = result["seconds"] / max(before["seconds"], 1e-9)
+            rows.append((run["individuals"], name, before["seconds"],
+                         result["seconds"], ratio))
+    regressions = [row for row in rows if row[4] > tolerance]
+    return rows, regressions
+
+
+def main(argv=None):
+    """ Command line entry point of gedcom-bench """
+    parser = argparse.ArgumentParser(
+        prog="gedcom-bench",
+        description="Benchmark the GEDCOM parser on synthetic trees.")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="comma separated numbers of individuals")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", default=None,
+                        help="name of the version benchmarked")
+    parser.add_argument("--keep", metavar="DIR", default=None,
+                        help="write the generated trees to DIR and keep them")
+    parser.add_argument("-o", "--output", metavar="FILE", default=None,
+                        help="write the results as JSON to FILE")
+    parser.add_argument("--compare", metavar="FILE", default=None,
+                        help="compare with results from FILE")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    if args.keep and not os.path.isdir(args.keep):
+        os.makedirs(args.keep)
+    results = run_benchmarks(sizes, args.repeat, args.seed, args.keep,
+                             args.label)
+    for run in results["runs"]:
+        print("{} individuals, {} lines, {:.1f} MB".format(
+            run["individuals"], run["lines"], run["bytes"] / 1e6))
+        for name, result in sorted(run["benchmarks"].items()):
+            print("  {:<20} {:10.4f}s {:14.1f}/s".format(
+                name, result["seconds"], result["per_second"] or 0))
+    if args.output:
+        with open(args.output, 'w') as fd:
+            write_results(results, fd)
+    if args.compare:
+        with open(args.compare) as fd:
+            old = read_results(fd)
+        rows, regressions = compare(old, results, args.tolerance)
+        for individuals, name, before, after, ratio in rows:
+            mark = " REGRESSION" if ratio > args.tolerance else ""
+            print("{:>8} {:<20} {:10.4f}s -> {:10.4f}s x{:.2f}{}".format(
+                individuals, name, before, after, ratio, mark))
+        return 1 if regressions else 0
+    return 0
@@ -0,0 +1,346 @@
+#
+# Gedcom 6.0 Parser
+#
+# Copyright (C) 2015 The Museum of the Jewish People
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+from __future__ import unicode_literals
+import collections
+import sqlite3
+from element import Element
+from parser import DETECT_PREFIX, detect_encoding, iter_records, link_element
+from relations import NATURAL_PARENT, LRUCache, breadth_first
+
+# Rows inserted by one executemany call, and between commits, when loading.
+BATCH_SIZE = 10000
+TRANSACTION_SIZE = 1000000
+
+# Records kept built as Elements by a GedcomDatabase.
+CACHE_SIZE = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+-- One row per line, numbered in file order, with the number of the last
+-- line of its subtree.
+CREATE TABLE IF NOT EXISTS elements (
+    id INTEGER PRIMARY KEY,
+    parent INTEGER,
+    level INTEGER NOT NULL,
+    pointer TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    value TEXT NOT NULL,
+    last INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pointers (
+    pointer TEXT PRIMARY KEY,
+    id INTEGER NOT NULL,
+    tag TEXT NOT NULL
+);
+-- FAMS and FAMC lines of individuals and HUSB, WIFE and CHIL lines of
+-- families, with the position of the natural parent qualifiers of CHIL
+-- lines among their children, 0 if absent.
+CREATE TABLE IF NOT EXISTS family_edges (
+    record INTEGER NOT NULL,
+    tag TEXT NOT NULL,
+    target TEXT NOT NULL,
+    frel INTEGER NOT NULL,
+    mrel INTEGER NOT NULL
+);
+-- Parents of individuals, derived from family_edges once loaded, in the
+-- order of Gedcom.get_parents. `family` orders the FAMC families of the
+-- child, and natural parents have the position of their qualifier as
+-- `is_natural`.
+CREATE TABLE IF NOT EXISTS parents (
+    child INTEGER NOT NULL,
+    parent INTEGER NOT NULL,
+    family INTEGER NOT NULL,
+    is_natural INTEGER NOT NULL
+);
+"""
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS elements_tag ON elements (tag);
+CREATE INDEX IF NOT EXISTS elements_parent ON elements (parent);
+CREATE INDEX IF NOT EXISTS family_edges_record ON family_edges (record, tag);
+CREATE INDEX IF NOT EXISTS parents_child ON parents (child);
+"""
+
+# Natural parents follow the _FREL/_MREL qualifiers like RelationshipIndex.
+PARENTS_QUERY = """
+INSERT INTO parents (child, parent, family, is_natural)
+SELECT famc.record, spouse.id, famc.rowid,
+       MAX(COALESCE(CASE edge.tag WHEN '{frel}' THEN chil.frel
+                                  WHEN '{mrel}' THEN chil.mrel END, 0))
+FROM family_edges AS famc
+JOIN pointers AS family ON family.pointer = famc.target AND family.tag = 'FAM'
+JOIN family_edges AS edge ON edge.record = family.id
+                         AND edge.tag IN ('HUSB', 'WIFE')
+JOIN pointers AS spouse ON spouse.pointer = edge.target
+JOIN elements AS child ON child.id = famc.record
+LEFT JOIN family_edges AS chil ON chil.record = family.id AND chil.tag = 'CHIL'
+                              AND chil.target = child.pointer
+WHERE famc.tag = 'FAMC'
+GROUP BY famc.rowid, edge.rowid
+ORDER BY famc.rowid, edge.rowid
+""".format(frel=NATURAL_PARENT["_FREL"], mrel=NATURAL_PARENT["_MREL"])
+
+# Tables emptied by load before filling them, and the indexes dropped
+# while it inserts rows.
+TABLES = ("meta", "elements", "pointers", "family_edges", "parents")
+DROP_INDEXES = """
+DROP INDEX IF EXISTS elements_tag;
+DROP INDEX IF EXISTS elements_parent;
+DROP INDEX IF EXISTS family_edges_record;
+DROP INDEX IF EXISTS parents_child;
+"""
+
+# Parents of an individual in the order of Gedcom.get_parents, all of
+# them or only the natural ones.
+PARENTS_ORDER = {
+    "ALL": "SELECT parent FROM parents WHERE child = ? ORDER BY rowid",
+    "NAT": ("SELECT parent FROM parents WHERE child = ? "
+            "AND is_natural > 0 ORDER BY family, is_natural, rowid"),
+}
+
+
+class GedcomDatabase(object):
+    """ A GEDCOM file loaded into an SQLite database
+
+    Offers the read API of Gedcom without holding the file in memory:
+    `as_dict` maps pointers to records built as Elements when looked up,
+    and `families`, `get_parents` and `get_ancestors` are answered by
+    queries. A bounded number of built records is kept.
+    """
+
+    def __init__(self, path, cache_size=CACHE_SIZE):
+        """ Open a database made by load """
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+        self.records = LRUCache(cache_size)
+        self.as_dict = RecordDict(self)
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = 'encoding'").fetchone()
+        self.encoding = row[0] if row else None
+
+    @classmethod
+    def load(cls, source, path, encoding=None, batch_size=BATCH_SIZE,
+             transaction_size=TRANSACTION_SIZE):
+        """ Load a GEDCOM file, given by name or as a binary file object,
+        into a database at `path` and return it. A database already at
+        `path` is emptied first, so that it only holds the new file.
+
+        The file is streamed with iter_records and its lines inserted in
+        batches of `batch_size`, committing every `transaction_size` lines.
+        Indexes and the parents table are built at the end.
+        """
+        if not encoding and not hasattr(source, 'read'):
+            with open(source, 'rb') as f:
+                encoding = detect_encoding(f.read(DETECT_PREFIX))[0]
+        database = cls(path)
+        connection = database.connection
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.execute("PRAGMA journal_mode = MEMORY")
+        connection.executescript(DROP_INDEXES)
+        for table in TABLES:
+            connection.execute("DELETE FROM " + table)
+        connection.execute("INSERT OR REPLACE INTO meta VALUES ('encoding', ?)",
+                           (encoding,))
+        loader = Loader(connection, batch_size, transaction_size)
+        for record in iter_records(source, encoding):
+            loader.add(record)
+        loader.flush()
+        connection.executescript(INDEXES)
+        connection.execute(PARENTS_QUERY)
+        connection.commit()
+        connection.execute("PRAGMA synchronous = FULL")
+        database.encoding = encoding
+        return database
+
+    def close(self):
+        """ Close the database connection """
+        self.connection.close()
+
+    def number(self, pointer):
+        """ Return the line number of the record with a pointer, or None """
+        row = self.connection.execute(
+            "SELECT id FROM pointers WHERE pointer = ?", (pointer,)).fetchone()
+        return row[0] if row else None
+
+    def element(self, n):
+        """ Return the element of line n, with its subtree """
+        return self.records.get(n, lambda: self.build_element(n))
+
+    def build_element(self, n):
+        """ Build the element of line n and its subtree from their rows """
+        rows = self.connection.execute(
+            "SELECT level, pointer, tag, value FROM elements "
+            "WHERE id BETWEEN ? AND (SELECT last FROM elements WHERE id = ?) "
+            "ORDER BY id", (n, n))
+        top = None
+        for line_num, fields in enumerate(rows, n):
+            element = Element(*fields)
+            if top is None:
+                top = last_elem = Element(element.level - 1, "", "TOP", "")
+            link_element(line_num, element, last_elem)
+            last_elem = element
+        if top is None:
+            raise KeyError(n)
+        return top.children[0]
+
+    def elements(self, rows):
+        """ Return the elements of the line numbers in query result rows """
+        return [self.element(row[0]) for row in rows]
+
+    def families(self, individual, family_type="FAMS"):
+        """ Return family elements listed for an individual, as
+        Gedcom.families does.
+        """
+        if not individual.is_individual:
+            raise ValueError("Operation only valid for elements with INDI tag.")
+        return self.elements(self.connection.execute(
+            "SELECT family.id FROM family_edges AS edge "
+            "JOIN pointers AS family ON family.pointer = edge.target "
+            "AND family.tag = 'FAM' "
+            "WHERE edge.record = ? AND edge.tag = ? ORDER BY edge.rowid",
+            (self.number(individual.pointer), family_type)))
+
+    def get_parents(self, indi, parent_type="ALL"):
+        """ Return elements corresponding to parents of an individual, as
+        Gedcom.get_parents does.
+        """
+        if not indi.is_individual:
+            raise ValueError("Operation only valid for elements with INDI tag.")
+        return [self.element(n) for n in
+                self.parents_of(self.number(indi.pointer), parent_type)]
+
+    def get_ancestors(self, indi, anc_type="ALL", max_generations=None):
+        """ Return elements corresponding to ancestors of an individual
+
+        As Gedcom.get_ancestors, each ancestor is returned once, nearest
+        generations first and in the same order, walking up with one
+        indexed query per ancestor.
+        """
+        if not indi.is_individual:
+            raise ValueError("Operation only valid for elements with INDI tag.")
+        found = breadth_first(self.number(indi.pointer),
+                              lambda n: self.parents_of(n, anc_type),
+                              max_generations)
+        return [self.element(n) for n, generation in found]
+
+    def parents_of(self, n, parent_type="ALL"):
+        """ Return the line numbers of the parents of individual line n """
+        query = PARENTS_ORDER["NAT" if parent_type == "NAT" else "ALL"]
+        return [row[0] for row in self.connection.execute(query, (n,))]
+
+
+class Loader(object):
+    """ Batches the rows of records for GedcomDatabase.load """
+
+    def __init__(self, connection, batch_size, transaction_size):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.transaction_size = transaction_size
+        self.next_id = 1
+        self.uncommitted = 0
+        self.elements = []
+        self.pointers = []
+        self.edges = []
+
+    def add(self, record):
+        """ Number the lines of a record and queue its rows """
+        first = self.next_id
+        rows = []
+        stack = [(record, None)]
+        while stack:
+            element, parent = stack.pop()
+            n = first + len(rows)
+            rows.append([n, parent, element.level, element.pointer,
+                         element.tag, element.value, n])
+            if element.pointer:
+                self.pointers.append((element.pointer, n, element.tag))
+            stack.extend((child, n) for child in reversed(element.children))
+        # Rows are in file order, so a subtree ends where its last
+        # descendant does.
+        for row in reversed(rows[1:]):
+            parent = rows[row[1] - first]
+            parent[6] = max(parent[6], row[6])
+        self.elements.extend(rows)
+        self.edges.extend(family_edges(first, record))
+        self.next_id += len(rows)
+        if len(self.elements) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """ Insert the queued rows, committing if enough are pending """
+        cursor = self.connection.cursor()
+        cursor.executemany("INSERT INTO elements VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           self.elements)
+        cursor.executemany("INSERT OR REPLACE INTO pointers VALUES (?, ?, ?)",
+                           self.pointers)
+        cursor.executemany("INSERT INTO family_edges VALUES (?, ?, ?, ?, ?)",
+                           self.edges)
+        self.uncommitted += len(self.elements)
+        if self.uncommitted >= self.transaction_size:
+            self.connection.commit()
+            self.uncommitted = 0
+        self.elements = []
+        self.pointers = []
+        self.edges = []
+
+
+def family_edges(n, record):
+    """ Return the family_edges rows of record number n """
+    if record.is_individual:
+        tags = ("FAMS", "FAMC")
+    elif record.is_family:
+        tags = ("HUSB", "WIFE", "CHIL")
+    else:
+        return []
+    edges = []
+    for child in record.children:
+        if child.tag in tags:
+            # Position of the _FREL and _MREL qualifiers, 0 if absent.
+            natural = {"_FREL": 0, "_MREL": 0}
+            for position, rec in enumerate(child.children, 1):
+                if rec.value == "Natural" and rec.tag in natural:
+                    natural[rec.tag] = natural[rec.tag] or position
+            edges.append((n, child.tag, child.value,
+                          natural["_FREL"], natural["_MREL"]))
+    return edges
+
+
+class RecordDict(collections.Mapping):
+    """ Read-only mapping from pointers to the records of a GedcomDatabase """
+
+    def __init__(self, database):
+        self.database = database
+
+    def __getitem__(self, pointer):
+        n = self.database.number(pointer)
+        if n is None:
+            raise KeyError(pointer)
+        return self.database.element(n)
+
+    def __contains__(self, pointer):
+        return self.database.number(pointer) is not None
+
+    def __iter__(self):
+        for row in self.database.connection.execute(
+                "SELECT pointer FROM pointers ORDER BY id"):
+            yield row[0]
+
+    def __len__(self):
+        return self.database.connection.execute(
+            "SELECT COUNT(*) FROM pointers").fetchone()[0]
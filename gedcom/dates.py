@@ -0,0 +1,419 @@
+#
+# Gedcom 6.0 Parser
+#
+# Copyright (C) 2015 The Museum of the Jewish People
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+from __future__ import unicode_literals
+import collections
+import re
+
+# A date as the range of days it may be: the first and last day as
+# ordinals of the proleptic Gregorian calendar, day 1 being 1 January of
+# year 1 as for datetime.date.toordinal, the qualifier of the date ("" or
+# ABT, CAL, EST, INT, BEF, AFT, BET, FROM, TO or "phrase") and the
+# Gregorian year it is taken to be in, 0 being 1 B.C.
+DateRange = collections.namedtuple("DateRange", ["low", "high", "qualifier", "year"])
+
+# Bounds of ranges open on one side, such as BEF and AFT dates. They fit
+# in 32 bits, far beyond any real date.
+OPEN_START = -(1 << 31)
+OPEN_END = (1 << 31) - 1
+
+# Number of distinct date strings kept parsed by parse_date.
+DATE_CACHE_SIZE = 1 << 16
+
+GREGORIAN_MONTHS = ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG",
+                    "SEP", "OCT", "NOV", "DEC"]
+# Hebrew months in the order of the civil year, starting with Tishri.
+HEBREW_MONTHS = ["TSH", "CSH", "KSL", "TVT", "SHV", "ADR", "ADS", "NSN",
+                 "IYR", "SVN", "TMZ", "AAV", "ELL"]
+FRENCH_MONTHS = ["VEND", "BRUM", "FRIM", "NIVO", "PLUV", "VENT", "GERM",
+                 "FLOR", "PRAI", "MESS", "THER", "FRUC", "COMP"]
+
+# Ordinal of 1 Tishri of Hebrew year 1, in 3761 BCE.
+HEBREW_EPOCH = -1373427
+# Ordinal of 1 Vendemiaire of year I of the French republican calendar,
+# 22 September 1792.
+FRENCH_EPOCH = 654415
+
+# Plain years above this are taken as Hebrew years when no calendar is
+# given, as files often leave out the @#DHEBREW@ escape.
+HEBREW_YEARS = 3000
+
+token_re = re.compile(r'@#D[^@]*@|[^\s]+')
+year_re = re.compile(r'^(\d{1,4})(?:/(\d{1,2}))?$')
+iso_re = re.compile(r'^(\d{4})-(\d{1,2})-(\d{1,2})$')
+# Four digits on their own, so that ages and counts such as "(age 102)"
+# are not taken for years.
+loose_year_re = re.compile(r'(?<!\d)\d{4}(?!\d)')
+
+_cache = {}
+
+
+def parse_date(text):
+    """ Return the DateRange of a GEDCOM date, or None if it has none
+
+    Handles plain dates of a day, month or year, in the Gregorian (the
+    default), Julian, Hebrew and French calendars given by an @#D...@
+    escape, with B.C. years and dual years like 1699/00; approximate
+    dates (ABT, CAL, EST), interpreted dates (INT ... (phrase)), and the
+    BEF, AFT, BET ... AND ..., FROM ... TO ... ranges. Keywords are
+    matched in any case and with or without a trailing dot.
+
+    A date that does not parse but holds a number of four digits is
+    taken as that year, with the qualifier "phrase". Results are
+    memoized on the text, as the same dates repeat throughout a tree.
+    """
+    result = _cache.get(text, _cache)
+    if result is _cache:
+        if len(_cache) >= DATE_CACHE_SIZE:
+            _cache.clear()
+        result = _cache[text] = compile_date(text)
+    return result
+
+
+def date_year(text):
+    """ Return the Gregorian year of a GEDCOM date, or None """
+    date = parse_date(text)
+    return date.year if date is not None else None
+
+
+def compile_date(text):
+    """ Parse a GEDCOM date, without memoizing, see parse_date """
+    tokens = token_re.findall(text)
+    words = [keyword(token) for token in tokens]
+    if not tokens or tokens[0].startswith("("):
+        return loose_date(text)
+    qualifier = words[0]
+    if qualifier in ("ABT", "CAL", "EST", "INT", "BEF", "AFT", "TO"):
+        rest = tokens[1:]
+        if qualifier == "INT":
+            # Drop the phrase interpreting the date.
+            rest = rest[:phrase_start(rest)]
+        span = date_span(rest)
+        if span is None:
+            return loose_date(text)
+        low, high = span
+        year = span_year(low, high)
+        if qualifier == "BEF":
+            low, high = OPEN_START, low - 1
+        elif qualifier == "AFT":
+            low, high = high + 1, OPEN_END
+        elif qualifier == "TO":
+            low = OPEN_START
+        return DateRange(low, high, qualifier, year)
+    if qualifier in ("BET", "FROM"):
+        separator = "AND" if qualifier == "BET" else "TO"
+        if separator in words:
+            split = words.index(separator)
+            first = date_span(tokens[1:split])
+            last = date_span(tokens[split + 1:])
+            if first is None or last is None:
+                return loose_date(text)
+            low, high = first[0], last[1]
+            return DateRange(low, high, qualifier, span_year(low, high))
+        if qualifier == "BET":
+            return loose_date(text)
+        span = date_span(tokens[1:])
+        if span is None:
+            return loose_date(text)
+        return DateRange(span[0], OPEN_END, qualifier, span_year(*span))
+    span = date_span(tokens)
+    if span is None:
+        return loose_date(text)
+    return DateRange(span[0], span[1], "", span_year(*span))
+
+
+def keyword(token):
+    """ Return a token in upper case without a trailing dot """
+    return token.upper().rstrip(".")
+
+
+def phrase_start(tokens):
+    """ Return where a phrase in parentheses starts in a list of tokens """
+    for n, token in enumerate(tokens):
+        if "(" in token:
+            return n
+    return len(tokens)
+
+
+def loose_date(text):
+    """ Return the year of an unparsed date as a DateRange, or None """
+    found = loose_year_re.search(text)
+    if found is None:
+        return None
+    year = int(found.group())
+    if year > HEBREW_YEARS:
+        low, high = hebrew_span(year, None, None)
+    else:
+        low, high = gregorian_span(year, None, None)
+    return DateRange(low, high, "phrase", span_year(low, high))
+
+
+def date_span(tokens):
+    """ Return the (low, high) ordinals of a plain date given as tokens
+    with an optional calendar escape, or None if it is not one.
+    """
+    calendar = "@#DGREGORIAN@"
+    if tokens and tokens[0].startswith("@#D"):
+        calendar = tokens[0].upper()
+        tokens = tokens[1:]
+    bce = False
+    if tokens and keyword(tokens[-1]).replace(".", "") in ("BC", "BCE"):
+        bce = True
+        tokens = tokens[:-1]
+    if len(tokens) == 1 and calendar == "@#DGREGORIAN@":
+        iso = iso_re.match(tokens[0])
+        if iso:
+            year, month, day = [int(part) for part in iso.groups()]
+            if 1 <= month <= 12 and 1 <= day <= month_days(year, month):
+                day = fixed_from_gregorian(year, month, day)
+                return day, day
+            return None
+    if not 1 <= len(tokens) <= 3:
+        return None
+    found = year_re.match(tokens[-1])
+    if not found:
+        return None
+    year = int(found.group(1))
+    if found.group(2) is not None:
+        # A dual year such as 1699/00 is the later one.
+        year += 1
+    month = day = None
+    if len(tokens) >= 2:
+        month = keyword(tokens[-2])
+    if len(tokens) == 3:
+        if not tokens[0].isdigit():
+            return None
+        day = int(tokens[0])
+
+    try:
+        if calendar == "@#DGREGORIAN@":
+            if year > HEBREW_YEARS and not bce:
+                if month not in HEBREW_MONTHS:
+                    month = day = None
+                return hebrew_span(year, month, day)
+            if bce:
+                year = 1 - year
+            return gregorian_span(year, month, day)
+        if calendar == "@#DJULIAN@":
+            return julian_span(-year if bce else year, month, day)
+        if calendar == "@#DHEBREW@" and not bce:
+            return hebrew_span(year, month, day)
+        if calendar == "@#DFRENCH R@" and not bce:
+            return french_span(year, month, day)
+    except ValueError:
+        return None
+    return None
+
+
+def span_year(low, high):
+    """ Return the Gregorian year of the middle of a range of ordinals """
+    return gregorian_year(low + (high - low) // 2)
+
+
+def gregorian_leap(year):
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+
+def month_days(year, month):
+    """ Return the number of days of a Gregorian month """
+    if month == 2:
+        return 29 if gregorian_leap(year) else 28
+    return 30 if month in (4, 6, 9, 11) else 31
+
+
+def fixed_from_gregorian(year, month, day):
+    """ Return the ordinal of a proleptic Gregorian date, with year 0
+    for 1 BCE.
+    """
+    if month <= 2:
+        correction = 0
+    elif gregorian_leap(year):
+        correction = -1
+    else:
+        correction = -2
+    return (365 * (year - 1) + (year - 1) // 4 - (year - 1) // 100 +
+            (year - 1) // 400 + (367 * month - 362) // 12 + correction + day)
+
+
+def gregorian_year(ordinal):
+    """ Return the proleptic Gregorian year of an ordinal """
+    n400, days = divmod(ordinal - 1, 146097)
+    n100, days = divmod(days, 36524)
+    n4, days = divmod(days, 1461)
+    n1 = days // 365
+    year = 400 * n400 + 100 * n100 + 4 * n4 + n1
+    if n100 == 4 or n1 == 4:
+        return year
+    return year + 1
+
+
+def gregorian_span(year, month, day):
+    """ Return the (low, high) ordinals of a Gregorian day, month or year """
+    if month is None:
+        return fixed_from_gregorian(year, 1, 1), fixed_from_gregorian(year, 12, 31)
+    if month not in GREGORIAN_MONTHS:
+        raise ValueError("Unknown month")
+    number = GREGORIAN_MONTHS.index(month) + 1
+    last = month_days(year, number)
+    if day is None:
+        return (fixed_from_gregorian(year, number, 1),
+                fixed_from_gregorian(year, number, last))
+    if not 1 <= day <= last:
+        raise ValueError("Day out of range")
+    day = fixed_from_gregorian(year, number, day)
+    return day, day
+
+
+def fixed_from_julian(year, month, day):
+    """ Return the ordinal of a Julian date, with negative years BCE """
+    if year < 0:
+        year += 1
+    leap = year % 4 == 0
+    if month <= 2:
+        correction = 0
+    elif leap:
+        correction = -1
+    else:
+        correction = -2
+    return (-2 + 365 * (year - 1) + (year - 1) // 4 +
+            (367 * month - 362) // 12 + correction + day)
+
+
+def julian_span(year, month, day):
+    """ Return the (low, high) ordinals of a Julian day, month or year """
+    if year == 0:
+        raise ValueError("There is no year 0")
+    if month is None:
+        return fixed_from_julian(year, 1, 1), fixed_from_julian(year, 12, 31)
+    if month not in GREGORIAN_MONTHS:
+        raise ValueError("Unknown month")
+    number = GREGORIAN_MONTHS.index(month) + 1
+    leap = (year + 1 if year < 0 else year) % 4 == 0
+    if number == 2:
+        last = 29 if leap else 28
+    else:
+        last = 30 if number in (4, 6, 9, 11) else 31
+    if day is None:
+        return (fixed_from_julian(year, number, 1),
+                fixed_from_julian(year, number, last))
+    if not 1 <= day <= last:
+        raise ValueError("Day out of range")
+    day = fixed_from_julian(year, number, day)
+    return day, day
+
+
+def hebrew_leap(year):
+    return (7 * year + 1) % 19 < 7
+
+
+def hebrew_elapsed_days(year):
+    """ Return the days from the epoch to the molad of Tishri of a year,
+    moved by the dehiyyot that keep Rosh Hashanah off some weekdays.
+    """
+    months = (235 * year - 234) // 19
+    parts = 12084 + 13753 * months
+    day = 29 * months + parts // 25920
+    if (3 * (day + 1)) % 7 < 3:
+        day += 1
+    return day
+
+
+def hebrew_new_year(year):
+    """ Return the ordinal of 1 Tishri of a Hebrew year """
+    this = hebrew_elapsed_days(year)
+    following = hebrew_elapsed_days(year + 1)
+    # Keep years within their allowed lengths.
+    if following - this == 356:
+        this += 2
+    elif this - hebrew_elapsed_days(year - 1) == 382:
+        this += 1
+    return HEBREW_EPOCH + this
+
+
+def hebrew_month_lengths(year):
+    """ Return the lengths of the months of a Hebrew year, in the order
+    of HEBREW_MONTHS; ADR is Adar I in leap years and ADS is Adar in
+    common years, when ADR has no days.
+    """
+    length = hebrew_new_year(year + 1) - hebrew_new_year(year)
+    cheshvan = 30 if length % 10 == 5 else 29
+    kislev = 29 if length % 10 == 3 else 30
+    adar = 30 if hebrew_leap(year) else 0
+    return [30, cheshvan, kislev, 29, 30, adar, 29, 30, 29, 30, 29, 30, 29]
+
+
+def hebrew_span(year, month, day):
+    """ Return the (low, high) ordinals of a Hebrew day, month or year """
+    if year < 1:
+        raise ValueError("Year before the Hebrew epoch")
+    start = hebrew_new_year(year)
+    if month is None:
+        return start, hebrew_new_year(year + 1) - 1
+    if month not in HEBREW_MONTHS:
+        raise ValueError("Unknown month")
+    lengths = hebrew_month_lengths(year)
+    number = HEBREW_MONTHS.index(month)
+    if month == "ADR" and not lengths[number]:
+        # Adar of a common year, given as ADR.
+        number += 1
+    first = start + sum(lengths[:number])
+    if day is None:
+        return first, first + lengths[number] - 1
+    if not 1 <= day <= lengths[number]:
+        raise ValueError("Day out of range")
+    return first + day - 1, first + day - 1
+
+
+def french_span(year, month, day):
+    """ Return the (low, high) ordinals of a French republican day, month
+    or year, with years III, VII and XI (and every fourth year from
+    there) leap years as in the calendar's use.
+    """
+    if year < 1:
+        raise ValueError("Year before the French republican epoch")
+    start = FRENCH_EPOCH + 365 * (year - 1) + year // 4
+    length = 366 if year % 4 == 3 else 365
+    if month is None:
+        return start, start + length - 1
+    if month not in FRENCH_MONTHS:
+        raise ValueError("Unknown month")
+    number = FRENCH_MONTHS.index(month)
+    first = start + 30 * number
+    days = length - 360 if month == "COMP" else 30
+    if day is None:
+        return first, first + days - 1
+    if not 1 <= day <= days:
+        raise ValueError("Day out of range")
+    return first + day - 1, first + day - 1
+
+
+def date_arrays(dates):
+    """ Return NumPy arrays of the low and high ordinals of an iterable
+    of date strings, for filtering many dates at once. Missing and
+    unparsed dates span from OPEN_START to OPEN_END.
+    """
+    # NumPy is only needed by this batch mode.
+    import numpy
+    lows = []
+    highs = []
+    for text in dates:
+        date = parse_date(text) if text else None
+        if date is None:
+            lows.append(OPEN_START)
+            highs.append(OPEN_END)
+        else:
+            lows.append(date.low)
+            highs.append(date.high)
+    return numpy.array(lows, dtype=numpy.int64), numpy.array(highs, dtype=numpy.int64)
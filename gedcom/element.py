@@ -17,49 +17,23 @@
 # GNU General Public License for more details.
 #
 from __future__ import unicode_literals
-import re
+import collections
+from dates import date_year
+from query import Query, compile_term, parse_criteria
 
+# The data of an individual gathered by ElementBase.summary.
+Summary = collections.namedtuple("Summary", [
+    "name", "gender", "birth", "birth_year", "death", "death_year",
+    "burial", "deceased"])
 
-class Element:
-    """ Gedcom element
-
-    Each line in a Gedcom file is an element with the format
-
-    level [pointer] tag [value]
 
-    where level and tag are required, and pointer and value are
-    optional.  Elements are arranged hierarchically according to their
-    level, and elements with a level of zero are at the top level.
-    Elements with a level greater than zero are children of their
-    parent.
-
-    A pointer has the format @pname@, where pname is any sequence of
-    characters and numbers.  The pointer identifies the object being
-    pointed to, so that any pointer included as the value of any
-    element points back to the original object.  For example, an
-    element may have a FAMS tag whose value is @F1@, meaning that this
-    element points to the family record in which the associated person
-    is a spouse.  Likewise, an element with a tag of FAMC has a value
-    that points to a family record in which the associated person is a
-    child.
-    See a Gedcom file for examples of tags and their values.
+class ElementBase(object):
+    """ Accessors shared by the Gedcom element classes
 
+    Subclasses provide the `level`, `pointer`, `tag`, `value`, `children`
+    and `parent` attributes.
     """
-    year_re = re.compile("[\d]{4}")
-
-    def __init__(self, level, pointer, tag, value):
-        """ Initialize an element.
-        You must include a level, pointer, tag, and value. Normally
-        initialized by the Gedcom parser, not by a user.
-        """
-        # basic element info
-        self.level = level
-        self.pointer = pointer
-        self.tag = tag
-        self.value = value
-        # structuring
-        self.children = []
-        self.parent = None
+    __slots__ = ()
 
     @property
     def is_individual(self):
@@ -72,40 +46,102 @@ class Element:
         return self.tag == "FAM"
 
     @property
-    def name(self):
-        """ Return a person's names as a tuple: (first,last) """
+    def tag_index(self):
+        """ Children of this element grouped by tag, as a dict of lists """
+        return self._build_tag_index()
+
+    @property
+    def summary(self):
+        """ The data of an individual read by the person accessors
+
+        A Summary of name, gender, birth, birth_year, death, death_year,
+        burial and deceased, gathered in one pass over the individual's
+        records.
+        """
+        return self._build_summary()
+
+    def children_with_tag(self, tag):
+        """ Return the children of this element with the given tag """
+        return self.tag_index.get(tag, [])
+
+    def _build_tag_index(self):
+        index = {}
+        for child in self.children:
+            tag = child.tag
+            if tag in index:
+                index[tag].append(child)
+            else:
+                index[tag] = [child]
+        return index
+
+    def _build_summary(self):
+        index = self.tag_index
+
         first = ""
         last = ""
+        for e in index.get("NAME", ()):
+            # some older Gedcom files don't use child tags but instead
+            # place the name in the value of the NAME tag
+            if e.value != "":
+                name = e.value.split('/')
+                if len(name) > 0:
+                    first = name[0].strip()
+                    if len(name) > 1:
+                        last = name[1].strip()
+            else:
+                for c in e.children:
+                    if c.tag == "GIVN":
+                        first = c.value
+                    if c.tag == "SURN":
+                        last = c.value
+
+        gender = ""
+        if "SEX" in index:
+            gender = index["SEX"][-1].value
+
+        birth, birth_year = self._event(index.get("BIRT"))
+        death, death_year = self._event(index.get("DEAT"))
+        burial = self._event(index.get("BURI"))[0]
+        return Summary((first, last), gender, birth, birth_year,
+                       death, death_year, burial, "DEAT" in index)
+
+    def _event(self, events):
+        """ Return the (date, place, source) tuple of a list of event
+        elements and the year of their date.
+        """
+        if not events:
+            return ("", "", ()), None
+        date = ""
+        place = ""
+        source = ()
+        year = None
+        for e in events:
+            dated = False
+            for c in e.children:
+                if c.tag == "DATE":
+                    date = c.value
+                    if not dated:
+                        year = date_year(c.value)
+                        dated = True
+                if c.tag == "PLAC":
+                    place = c.value
+                if c.tag == "SOUR":
+                    source = source + (c.value,)
+        return (date, place, source), year
+
+    @property
+    def name(self):
+        """ Return a person's names as a tuple: (first,last) """
         if not self.is_individual:
-            return (first, last)
-        for e in self.children:
-            if e.tag == "NAME":
-                # some older Gedcom files don't use child tags but instead
-                # place the name in the value of the NAME tag
-                if e.value != "":
-                    name = e.value.split('/')
-                    if len(name) > 0:
-                        first = name[0].strip()
-                        if len(name) > 1:
-                            last = name[1].strip()
-                else:
-                    for c in e.children:
-                        if c.tag == "GIVN":
-                            first = c.value
-                        if c.tag == "SURN":
-                            last = c.value
-        return (first, last)
+            return ("", "")
+        return self.summary.name
 
     @property
     def gender(self):
         """ The gender of a person in string format """
-        gender = ""
         if not self.is_individual:
-            return gender
-        for e in self.children:
-            if e.tag == "SEX":
-                gender = e.value
-        return gender
+            return ""
+        return self.summary.gender
 
     @property
     def private(self):
@@ -113,94 +149,39 @@ class Element:
         private = False
         if not self.is_individual:
             return False
-        for e in self.children:
-            if e.tag == "PRIV":
-                private = e.value
-                if private == 'Y':
-                    private = True
+        for e in self.children_with_tag("PRIV"):
+            private = e.value
+            if private == 'Y':
+                private = True
         return private
 
     @property
     def birth(self):
         """ Return the birth tuple of a person as (date,place) """
-        date = ""
-        place = ""
-        source = ()
         if not self.is_individual:
-            return (date, place, source)
-        for e in self.children:
-            if e.tag == "BIRT":
-                for c in e.children:
-                    if c.tag == "DATE":
-                        date = c.value
-                    if c.tag == "PLAC":
-                        place = c.value
-                    if c.tag == "SOUR":
-                        source = source + (c.value,)
-        return (date, place, source)
+            return ("", "", ())
+        return self.summary.birth
 
     @property
     def birth_year(self):
         """ Return the birth year of a person in integer format """
-        date = ""
         if not self.is_individual:
-            return date
-        for e in self.children:
-            if e.tag == "BIRT":
-                for c in e.children:
-                    if c.tag == "DATE":
-                        years = self.year_re.findall(c.value)
-                        break;
-        try:
-            year = int(years[0])
-        except:
-            return None
-
-        if year > 3000:
-            year -= 3760
-
-        return year
+            return ""
+        return self.summary.birth_year
 
     @property
     def death(self):
         """ Return the death tuple of a person as (date,place) """
-        date = ""
-        place = ""
-        source = ()
         if not self.is_individual:
-            return (date, place)
-        for e in self.children:
-            if e.tag == "DEAT":
-                for c in e.children:
-                    if c.tag == "DATE":
-                        date = c.value
-                    if c.tag == "PLAC":
-                        place = c.value
-                    if c.tag == "SOUR":
-                        source = source + (c.value,)
-        return (date, place, source)
+            return ("", "")
+        return self.summary.death
 
     @property
     def death_year(self):
         """ The death year of a person in integer format """
-        date = ""
         if not self.is_individual:
-            return date
-        for e in self.children:
-            if e.tag == "DEAT":
-                for c in e.children:
-                    if c.tag == "DATE":
-                        years = self.year_re.findall(c.value)
-                        break;
-        try:
-            year = int(years[0])
-        except:
-            return None
-
-        if year > 3000:
-            year -= 3760
-
-        return year
+            return ""
+        return self.summary.death_year
 
     @property
     def marriage_years(self):
@@ -208,37 +189,20 @@ class Element:
         ret = []
         if not self.is_individual:
             return ret
-        for e in self.children:
-            if e.tag == "MARR":
-                for c in e.children:
-                    if c.tag == "DATE":
-                        year = self.year_re.findall(c.value)
-                        try:
-                            year = int(year[0])
-                        except:
-                            continue
-                        if year > 3000:
-                            year -= 3760
+        for e in self.children_with_tag("MARR"):
+            for c in e.children:
+                if c.tag == "DATE":
+                    year = date_year(c.value)
+                    if year is not None:
                         ret.append(year)
+        return ret
 
     @property
     def burial(self):
         """ The burial tuple of a person as (date,place) """
-        date = ""
-        place = ""
-        source = ()
         if not self.is_individual:
-            return (date, place)
-        for e in self.children:
-            if e.tag == "BURI":
-                for c in e.children:
-                    if c.tag == "DATE":
-                        date = c.value
-                    if c.tag == "PLAC":
-                        place = c.value
-                    if c.tag == "SOUR":
-                        source = source + (c.value,)
-        return (date, place, source)
+            return ("", "")
+        return self.summary.burial
 
     @property
     def census(self):
@@ -246,19 +210,18 @@ class Element:
         census = []
         if not self.is_individual:
             raise ValueError("Operation only valid for elements with INDI tag")
-        for pdata in self.children:
-            if pdata.tag == "CENS":
-                date = ''
-                place = ''
-                source = ''
-                for indivdata in pdata.children:
-                    if indivdata.tag == "DATE":
-                        date = indivdata.value
-                    if indivdata.tag == "PLAC":
-                        place = indivdata.value
-                    if indivdata.tag == "SOUR":
-                        source = source + (indivdata.value,)
-                census.append((date, place, source))
+        for pdata in self.children_with_tag("CENS"):
+            date = ''
+            place = ''
+            source = ''
+            for indivdata in pdata.children:
+                if indivdata.tag == "DATE":
+                    date = indivdata.value
+                if indivdata.tag == "PLAC":
+                    place = indivdata.value
+                if indivdata.tag == "SOUR":
+                    source = source + (indivdata.value,)
+            census.append((date, place, source))
         return census
 
     @property
@@ -267,21 +230,18 @@ class Element:
         date = ""
         if not self.is_individual:
             return (date)
-        for e in self.children:
-            if e.tag == "CHAN":
-                for c in e.children:
-                    if c.tag == "DATE":
-                        date = c.value
+        for e in self.children_with_tag("CHAN"):
+            for c in e.children:
+                if c.tag == "DATE":
+                    date = c.value
         return (date)
 
     @property
     def occupation(self):
         """ Return the occupation of a person as (date) """
         occupation = ""
-        if self.is_individual:
-            for e in self.children:
-                if e.tag == "OCCU":
-                    occupation = e.value
+        if self.is_individual and "OCCU" in self.tag_index:
+            occupation = self.tag_index["OCCU"][-1].value
         return occupation
 
     @property
@@ -289,18 +249,7 @@ class Element:
         """ Whether a person is deceased """
         if not self.is_individual:
             return False
-        for e in self.children:
-            if e.tag == "DEAT":
-                return True
-        return False
-
-    def add_child(self, element):
-        """ Add a child element to this element """
-        self.children.append(element)
-
-    def add_parent(self, element):
-        """ Add a parent element to this element """
-        self.parent = element
+        return self.summary.deceased
 
     def criteria_match(self, criteria):
         """ Check in this element matches all of the given criteria.
@@ -321,53 +270,13 @@ class Element:
         deathrange=[year1-year2]
         """
 
-        # error checking on the criteria
+        # Empty or malformed criteria match nothing.
         try:
-            for crit in criteria.split(':'):
-                key, value = crit.split('=')
-        except:
+            query = Query([compile_term(key, value)
+                           for key, value in parse_criteria(criteria)])
+        except ValueError:
             return False
-        match = True
-        for crit in criteria.split(':'):
-            key, value = crit.split('=')
-            if key == "surname" and self.name[1].find(name) == -1:
-                match = False
-            elif key == "name" and self.name[0].find(name) == -1:
-                match = False
-            elif key == "birth":
-                try:
-                    year = int(value)
-                    if not self.birth_year == year:
-                        match = False
-                except:
-                    match = False
-            elif key == "birthrange":
-                try:
-                    year1, year2 = value.split('-')
-                    year1 = int(year1)
-                    year2 = int(year2)
-                    if year1 <= self.birth_year <= year2:
-                        match = False
-                except:
-                    match = False
-            elif key == "death":
-                try:
-                    year = int(value)
-                    if not self.death_year == year:
-                        match = False
-                except:
-                    match = False
-            elif key == "deathrange":
-                try:
-                    year1, year2 = value.split('-')
-                    year1 = int(year1)
-                    year2 = int(year2)
-                    if year1 <= self.death_year <= year2:
-                        match = False
-                except:
-                    match = False
-
-        return match
+        return query.matches(self)
 
     def __unicode__(self):
         """ Format this element as its original string """
@@ -378,3 +287,142 @@ class Element:
         if self.value != "":
             result += ' ' + self.value
         return result
+
+
+class Element(ElementBase):
+    """ Gedcom element
+
+    Each line in a Gedcom file is an element with the format
+
+    level [pointer] tag [value]
+
+    where level and tag are required, and pointer and value are
+    optional.  Elements are arranged hierarchically according to their
+    level, and elements with a level of zero are at the top level.
+    Elements with a level greater than zero are children of their
+    parent.
+
+    A pointer has the format @pname@, where pname is any sequence of
+    characters and numbers.  The pointer identifies the object being
+    pointed to, so that any pointer included as the value of any
+    element points back to the original object.  For example, an
+    element may have a FAMS tag whose value is @F1@, meaning that this
+    element points to the family record in which the associated person
+    is a spouse.  Likewise, an element with a tag of FAMC has a value
+    that points to a family record in which the associated person is a
+    child.
+    See a Gedcom file for examples of tags and their values.
+
+    """
+
+    def __init__(self, level, pointer, tag, value):
+        """ Initialize an element.
+        You must include a level, pointer, tag, and value. Normally
+        initialized by the Gedcom parser, not by a user.
+        """
+        # basic element info
+        self.level = level
+        self.pointer = pointer
+        self.tag = tag
+        self.value = value
+        # structuring
+        self.children = []
+        self.parent = None
+
+    # Built on first use, reset when the children change.
+    _tag_index = None
+    _summary = None
+
+    @property
+    def tag_index(self):
+        """ Children of this element grouped by tag, as a dict of lists """
+        if self._tag_index is None:
+            self._tag_index = self._build_tag_index()
+        return self._tag_index
+
+    @property
+    def summary(self):
+        """ The memoized data of an individual, see ElementBase.summary """
+        summary = self._summary
+        if summary is None:
+            summary = self._summary = self._build_summary()
+        return summary
+
+    def add_child(self, element):
+        """ Add a child element to this element
+
+        This builds trees before they are added to a Gedcom. Elements of
+        a parsed Gedcom are edited with Gedcom.add, remove, move and
+        replace, which keep its `as_list`, `as_dict` and indexes up to
+        date.
+        """
+        self.children.append(element)
+        self.children_changed()
+
+    def insert_child(self, index, element):
+        """ Insert a child element before child number `index` """
+        self.children.insert(index, element)
+        self.children_changed()
+
+    def remove_child(self, element):
+        """ Remove a child element from this element """
+        self.children.remove(element)
+        self.children_changed()
+
+    def children_changed(self):
+        """ Reset what was built from the children of this element """
+        if self._tag_index is not None:
+            self._tag_index = None
+        # Summaries are built from whole subtrees.
+        ancestor = self
+        while ancestor is not None:
+            if ancestor._summary is not None:
+                ancestor._summary = None
+            ancestor = ancestor.parent
+
+    def add_parent(self, element):
+        """ Add a parent element to this element """
+        self.parent = element
+
+
+class LazyValue(object):
+    """ Descriptor decoding a MappedElement's value on first access
+
+    The decoded value is stored on the instance, where it hides this
+    descriptor, so later reads and assignments are plain attribute access.
+    """
+
+    def __get__(self, element, owner):
+        if element is None:
+            return self
+        buf, encoding = element._source
+        if element._start < 0:
+            value = ''
+        else:
+            value = buf[element._start:element._end].decode(
+                encoding, 'replace').lstrip(' ')
+        element.value = value
+        return value
+
+
+class MappedElement(Element):
+    """ Gedcom element whose value stays undecoded in the source buffer
+
+    `source` is a (buffer, encoding) tuple shared by all elements of a
+    file, and `start` and `end` delimit the raw value (starting at its
+    leading space, -1 if there is none). The value is decoded only when
+    first accessed.
+    """
+    value = LazyValue()
+
+    def __init__(self, level, pointer, tag, source, start, end):
+        """ Initialize an element from a span of the source buffer. """
+        self.level = level
+        self.pointer = pointer
+        self.tag = tag
+        self._source = source
+        self._start = start
+        self._end = end
+        # structuring
+        self.children = []
+        self.parent = None
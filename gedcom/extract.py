@@ -0,0 +1,93 @@
+#
+# Gedcom 6.0 Parser
+#
+# Copyright (C) 2015 The Museum of the Jewish People
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+from __future__ import unicode_literals
+import collections
+from element import Element
+from references import is_pointer
+
+# Records only written when selected; any other record is written when a
+# written line points to it.
+SELECTED_TAGS = ("INDI", "FAM")
+
+
+class Extract(object):
+    """ The part of a Gedcom holding a set of individuals
+
+    It is made of the HEAD record, the individuals, the families they are
+    spouses or children in, and the records, such as SOUR, NOTE, OBJE,
+    REPO or SUBM, that the lines written point to, found as they are
+    written. Lines pointing to individuals or families left out, or to
+    missing records, are pruned with their subtrees, so that the extract
+    is self-contained.
+    """
+
+    def __init__(self, gedcom, individuals):
+        self.gedcom = gedcom
+        index = gedcom.relationships
+        self.individuals = list(collections.OrderedDict.fromkeys(
+            gedcom.individual_number(individual) for individual in individuals))
+        families = []
+        for n in self.individuals:
+            families.extend(index.spouse_families.get(n, ()))
+            families.extend(index.child_families.get(n, ()))
+        self.families = list(collections.OrderedDict.fromkeys(families))
+        self.selected = set(index.records[n].pointer
+                            for n in self.individuals + self.families)
+        # Other records to write, and their pointers.
+        self.pending = collections.deque()
+        self.found = set()
+
+    def records(self):
+        """ Yield the records of the extract, ending with TRLR, while
+        they are written with keep.
+        """
+        index = self.gedcom.relationships
+        head = self.head()
+        if head is not None:
+            yield head
+        for n in self.individuals + self.families:
+            yield index.records[n]
+        while self.pending:
+            yield self.pending.popleft()
+        yield Element(0, "", "TRLR", "")
+
+    def head(self):
+        """ Return the HEAD record of the Gedcom, or None """
+        gedcom = self.gedcom
+        if getattr(gedcom, "record_index", None) is not None:
+            if len(gedcom.record_index) and gedcom.record_index.tag(0) == "HEAD":
+                return gedcom.record(0)
+            return None
+        for record in gedcom.top_element.children[:1]:
+            if record.tag == "HEAD":
+                return record
+        return None
+
+    def keep(self, element):
+        """ Return whether to write a line of a record and its subtree,
+        queueing the records it points to that are not yet written.
+        """
+        value = element.value
+        if not is_pointer(value) or element.level == 0:
+            return True
+        if value in self.selected or value in self.found:
+            return True
+        record = self.gedcom.as_dict.get(value)
+        if record is None or record.tag in SELECTED_TAGS:
+            return False
+        self.found.add(value)
+        self.pending.append(record)
+        return True
@@ -0,0 +1,204 @@
+#
+# Gedcom 6.0 Parser
+#
+# Copyright (C) 2015 The Museum of the Jewish People
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+from __future__ import unicode_literals
+import argparse
+import collections
+import itertools
+import multiprocessing
+import os
+import time
+from parser import Gedcom
+
+# The outcome of parsing one file: its size in bytes, the seconds it took,
+# the detected encoding and counts of lines, individuals and families,
+# what the `process` function returned, and the error message if parsing
+# failed.
+IngestResult = collections.namedtuple("IngestResult", [
+    "path", "size", "seconds", "encoding", "lines", "individuals",
+    "families", "value", "error"])
+
+# Seconds to wait for a task to finish before checking the others again.
+POLL_SECONDS = 0.05
+
+
+def ingest_many(paths, workers=None, max_in_flight=None, process=None,
+                stats=None, **options):
+    """ Parse many GEDCOM files in a process pool
+
+    Yields an IngestResult for each file as soon as it is parsed, so not
+    in the order of `paths`. Errors are caught per file and reported in
+    the result's `error` instead of stopping the batch.
+
+    `workers` defaults to the number of CPUs; with 1 the files are parsed
+    in this process. At most `max_in_flight` files, by default twice the
+    number of workers, are being parsed or waiting to be read back at a
+    time, which bounds memory use. If given, `process` is called as
+    process(gedcom, path) in the worker and its return value, which must
+    be picklable, is returned as the result's `value`. Other keyword
+    arguments are passed to Gedcom. An IngestStats given as `stats` is
+    updated with every result.
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if max_in_flight is None:
+        max_in_flight = 2 * workers
+    tasks = ((path, process, options) for path in paths)
+    if workers == 1:
+        results = itertools.imap(ingest_file, tasks)
+    else:
+        results = run_bounded(tasks, workers, max_in_flight)
+    for result in results:
+        if stats is not None:
+            stats.add(result)
+        yield result
+
+
+def run_bounded(tasks, workers, max_in_flight):
+    """ Yield the results of ingest_file over tasks from a process pool,
+    in completion order, with at most max_in_flight tasks submitted.
+
+    A task whose arguments or result cannot be sent between processes,
+    such as one with a lambda as `process`, gives a failed result: Python
+    2 pools report this through the task's AsyncResult, never calling a
+    callback.
+    """
+    pool = multiprocessing.Pool(workers)
+    try:
+        in_flight = []
+
+        def submit(count):
+            for task in itertools.islice(tasks, count):
+                in_flight.append(
+                    (task, pool.apply_async(ingest_file, (task,))))
+        submit(max_in_flight)
+        while in_flight:
+            done = [item for item in in_flight if item[1].ready()]
+            if not done:
+                in_flight[0][1].wait(POLL_SECONDS)
+                continue
+            for item in done:
+                in_flight.remove(item)
+            submit(len(done))
+            for task, result in done:
+                try:
+                    yield result.get()
+                except Exception as e:
+                    yield failed_result(task[0], 0, time.time(), e)
+    finally:
+        pool.terminate()
+
+
+def ingest_file(task):
+    """ Parse one file for ingest_many and return its IngestResult
+
+    Any error is caught and reported in the result, since an exception
+    lost in a worker process would leave the batch waiting for it.
+    """
+    path, process, options = task
+    started = time.time()
+    size = 0
+    try:
+        size = os.path.getsize(path)
+        gedcom = Gedcom(path, **options)
+        individuals = 0
+        families = 0
+        for element in gedcom.as_list:
+            if element.level != 0:
+                continue
+            if element.is_individual:
+                individuals += 1
+            elif element.is_family:
+                families += 1
+        value = process(gedcom, path) if process else None
+        return IngestResult(path, size, time.time() - started,
+                            gedcom.encoding, len(gedcom.as_list),
+                            individuals, families, value, None)
+    except Exception as e:
+        return failed_result(path, size, started, e)
+
+
+def failed_result(path, size, started, error):
+    """ Return the IngestResult of a file whose parse raised an error """
+    error = "{}: {}".format(type(error).__name__, error)
+    return IngestResult(path, size, time.time() - started,
+                        None, 0, 0, 0, None, error)
+
+
+class IngestStats(object):
+    """ Aggregate counts and throughput of a batch of IngestResults """
+
+    def __init__(self):
+        self.started = time.time()
+        self.files = 0
+        self.failed = 0
+        self.bytes = 0
+
+    def add(self, result):
+        """ Count an IngestResult """
+        self.files += 1
+        self.bytes += result.size
+        if result.error:
+            self.failed += 1
+
+    @property
+    def elapsed(self):
+        """ Seconds since the batch started """
+        return time.time() - self.started
+
+    @property
+    def files_per_second(self):
+        """ Files parsed per second """
+        return self.files / max(self.elapsed, 1e-9)
+
+    @property
+    def mb_per_second(self):
+        """ Megabytes parsed per second """
+        return self.bytes / 1e6 / max(self.elapsed, 1e-9)
+
+    def __unicode__(self):
+        return ("{} files ({} failed), {:.1f} MB in {:.2f}s: "
+                "{:.1f} files/s, {:.2f} MB/s".format(
+                    self.files, self.failed, self.bytes / 1e6, self.elapsed,
+                    self.files_per_second, self.mb_per_second))
+
+
+def main(argv=None):
+    """ Command line entry point of gedcom-ingest """
+    parser = argparse.ArgumentParser(
+        prog="gedcom-ingest",
+        description="Parse GEDCOM files in parallel and report throughput.")
+    parser.add_argument("paths", nargs="+", metavar="FILE")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="worker processes (default: number of CPUs)")
+    parser.add_argument("--in-flight", type=int, default=None,
+                        help="files submitted at a time (default: 2 per worker)")
+    parser.add_argument("--encoding", default=None)
+    parser.add_argument("--detect", choices=("full", "header"), default="header")
+    args = parser.parse_args(argv)
+
+    stats = IngestStats()
+    for result in ingest_many(args.paths, args.workers, args.in_flight,
+                              stats=stats, encoding=args.encoding,
+                              detect=args.detect):
+        if result.error:
+            line = "{}: failed: {}".format(result.path, result.error)
+        else:
+            line = "{}: {} lines, {} individuals, {} families ({:.2f}s)".format(
+                result.path, result.lines, result.individuals,
+                result.families, result.seconds)
+        print(line)
+    print(unicode(stats))
+    return 1 if stats.failed else 0
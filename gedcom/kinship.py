@@ -0,0 +1,130 @@
+#
+# Gedcom 6.0 Parser
+#
+# Copyright (C) 2015 The Museum of the Jewish People
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+from __future__ import unicode_literals
+import numpy
+
+# Memory allowed for the block of gene contributions computed at a time.
+BLOCK_BYTES = 64 << 20
+
+
+def kinship_matrix(gedcom, individuals, block_bytes=BLOCK_BYTES):
+    """ Return the matrix of kinship coefficients of a list of individuals
+
+    The kinship coefficient of two individuals is the probability that
+    alleles taken at random from each are identical by descent; that of
+    an individual with itself is (1 + F) / 2, where F is its inbreeding
+    coefficient. Only natural parents, as given by the _FREL/_MREL
+    qualifiers used by Gedcom.get_parents(indi, "NAT"), are followed.
+
+    The individuals and their ancestors are put in topological generation
+    order. With T the matrix of gene contributions of ancestors to
+    descendants and D the Mendelian sampling variances, the relationship
+    matrix is T D T' (Henderson, 1976). It is accumulated for a block of
+    ancestors at a time, so memory stays within `block_bytes` plus the
+    result.
+    """
+    index = gedcom.relationships
+    selected = [gedcom.individual_number(indi) for indi in individuals]
+    order, generations, parents = pedigree(index, selected)
+    size = len(order)
+    position = dict((node, n) for n, node in enumerate(order))
+    rows = numpy.array([position[node] for node in selected], dtype=numpy.intp)
+    # Parent positions, with `size` standing for an unknown parent.
+    fathers = numpy.array([p[0] for p in parents], dtype=numpy.intp)
+    mothers = numpy.array([p[1] for p in parents], dtype=numpy.intp)
+    fathers[fathers < 0] = size
+    mothers[mothers < 0] = size
+    known = (fathers < size).astype(int) + (mothers < size)
+
+    width = max(1, block_bytes // (8 * (size + 1)))
+    relationship = numpy.zeros((len(rows), len(rows)))
+    # Diagonal of T D T', that is 1 + F, complete for every generation
+    # before the current block; the extra entry is the unknown parent.
+    diagonal = numpy.zeros(size + 1)
+    diagonal[size] = 1
+    contributions = numpy.zeros((size + 1, width))
+    for generation, (start, end) in enumerate(generations):
+        for first in range(start, end, width):
+            last = min(first + width, end)
+            block = contributions[:, :last - first]
+            block[:] = 0
+            block[numpy.arange(first, last), numpy.arange(last - first)] = 1
+            # Blocks never span generations, so the parents of the block
+            # have their inbreeding coefficients complete.
+            variances = (1 - 0.25 * known[first:last] -
+                         0.25 * (diagonal[fathers[first:last]] - 1) -
+                         0.25 * (diagonal[mothers[first:last]] - 1))
+            # Only later generations descend from the block.
+            for later_start, later_end in generations[generation + 1:]:
+                nodes = slice(later_start, later_end)
+                block[nodes] += 0.5 * (block[fathers[nodes]] + block[mothers[nodes]])
+            diagonal[first:size] += numpy.dot(block[first:size] ** 2, variances)
+            selected_block = block[rows]
+            relationship += numpy.dot(selected_block * variances,
+                                      selected_block.T)
+    return relationship / 2
+
+
+def pedigree(index, selected):
+    """ Put individuals and all their natural ancestors in topological
+    generation order.
+
+    Returns the record numbers in order, the (start, end) position range
+    of each generation, and the (father, mother) positions of each
+    individual, -1 where unknown. Founders are generation 0 and everyone
+    else comes one generation after their latest parent.
+    """
+    parents = {}
+    stack = list(selected)
+    while stack:
+        node = stack.pop()
+        if node in parents:
+            continue
+        found = []
+        for parent in index.natural_parents.get(node, ()):
+            if parent not in found and len(found) < 2:
+                found.append(parent)
+        parents[node] = found
+        stack.extend(found)
+
+    children = dict((node, []) for node in parents)
+    waiting = {}
+    for node, found in parents.items():
+        waiting[node] = len(found)
+        for parent in found:
+            children[parent].append(node)
+    level = sorted(node for node, count in waiting.items() if not count)
+    order = []
+    generations = []
+    while level:
+        generations.append((len(order), len(order) + len(level)))
+        order.extend(level)
+        next_level = []
+        for node in level:
+            for child in children[node]:
+                waiting[child] -= 1
+                if not waiting[child]:
+                    next_level.append(child)
+        level = sorted(next_level)
+    if len(order) < len(parents):
+        raise ValueError("Natural parent links form a cycle.")
+
+    position = dict((node, n) for n, node in enumerate(order))
+    links = []
+    for node in order:
+        found = [position[parent] for parent in parents[node]]
+        links.append(tuple(found + [-1] * (2 - len(found))))
+    return order, generations, links
@@ -0,0 +1,164 @@
+#
+# Gedcom 6.0 Parser
+#
+# Copyright (C) 2015 The Museum of the Jewish People
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+from __future__ import unicode_literals
+from array import array
+import codecs
+import collections
+import itertools
+import re
+
+# Number of records kept parsed by a lazy Gedcom by default.
+LAZY_RECORDS = 1024
+
+# The start of a level-0 line, and of one after a line break. The leading
+# line break lets the regex engine skip ahead with a fast search for it.
+# Like Gedcom.line_re, spaces and tabs are allowed before the level.
+record_start = br'[ \t]*(?P<line>0 (?:(?P<pointer>@[^@\r\n]+@) )?(?P<tag>[A-Za-z0-9_]+))'
+record_re = re.compile(br'\n' + record_start)
+first_record_re = re.compile(b'(?:' + re.escape(codecs.BOM_UTF8) + b')?' + record_start)
+
+
+class RecordIndex(object):
+    """ Offsets, tags and pointers of the level-0 records of a buffer
+
+    Built in one regex pass over the undecoded buffer, which must be in
+    an ASCII compatible encoding with level-0 lines starting right after
+    a line feed. Record n spans from `starts[n]` to the start of the next
+    one; `pointers` maps undecoded pointers to record numbers.
+    """
+
+    def __init__(self, buf, encoding):
+        self.buf = buf
+        # Records are decoded from their middle, past any byte order mark.
+        if codecs.lookup(encoding).name == 'utf-8-sig':
+            encoding = 'utf-8'
+        self.encoding = encoding
+        self.starts = array(b'l')
+        self.tags = array(b'H')
+        self.tag_names = []
+        self.pointers = {}
+        tag_ids = {}
+        matches = record_re.finditer(buf)
+        first = first_record_re.match(buf)
+        if first:
+            matches = itertools.chain([first], matches)
+        for line in matches:
+            pointer, tag = line.group('pointer', 'tag')
+            if tag not in tag_ids:
+                tag_ids[tag] = len(self.tag_names)
+                self.tag_names.append(tag.decode('ascii'))
+            if pointer:
+                self.pointers[pointer] = len(self.starts)
+            self.starts.append(line.start('line'))
+            self.tags.append(tag_ids[tag])
+
+    def __len__(self):
+        return len(self.starts)
+
+    def span(self, n):
+        """ Return the (start, end) byte offsets of record n """
+        end = self.starts[n + 1] if n + 1 < len(self.starts) else len(self.buf)
+        return self.starts[n], end
+
+    def tag(self, n):
+        """ Return the tag of record n """
+        return self.tag_names[self.tags[n]]
+
+    def find(self, pointer):
+        """ Return the number of the record with a pointer, or None """
+        return self.pointers.get(pointer.encode(self.encoding))
+
+    def text(self, n):
+        """ Return record n decoded, starting with its level-0 line """
+        start, end = self.span(n)
+        return self.buf[start:end].decode(self.encoding, 'replace')
+
+
+class LazyDict(collections.Mapping):
+    """ The `as_dict` of a lazy Gedcom: level-0 records by pointer, parsed
+    when looked up.
+    """
+
+    def __init__(self, gedcom):
+        self.gedcom = gedcom
+        self.index = gedcom.record_index
+
+    def __getitem__(self, pointer):
+        n = self.index.find(pointer)
+        if n is None:
+            raise KeyError(pointer)
+        return self.gedcom.record(n)
+
+    def __contains__(self, pointer):
+        return self.index.find(pointer) is not None
+
+    def __iter__(self):
+        for pointer in self.index.pointers:
+            yield pointer.decode(self.index.encoding)
+
+    def __len__(self):
+        return len(self.index.pointers)
+
+
+class LazyElements(object):
+    """ The `as_list` of a lazy Gedcom: iterates over all elements in file
+    order, parsing records as it goes.
+    """
+
+    def __init__(self, gedcom):
+        self.gedcom = gedcom
+        self.lines = None
+
+    def __iter__(self):
+        for n in range(len(self.gedcom.record_index)):
+            stack = [self.gedcom.record(n)]
+            while stack:
+                element = stack.pop()
+                yield element
+                stack.extend(reversed(element.children))
+
+    def __len__(self):
+        # Lines are counted in one regex pass over the undecoded records,
+        # without parsing them.
+        if self.lines is None:
+            index = self.gedcom.record_index
+            start = index.starts[0] if len(index) else len(index.buf)
+            self.lines = sum(1 for line in
+                             self.gedcom.line_bytes_re.finditer(index.buf, start))
+        return self.lines
+
+
+class LazyRecords(object):
+    """ Numbered records of a lazy Gedcom, as in RelationshipIndex.records
+
+    Only the pointers are kept, and records are looked up in the lazy
+    `as_dict` when accessed, so that they are not all held in memory and
+    records evicted from its cache are parsed again.
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self.pointers = []
+
+    def __getitem__(self, n):
+        return self.records[self.pointers[n]]
+
+    def __len__(self):
+        return len(self.pointers)
+
+    def __iter__(self):
+        for pointer in self.pointers:
+            yield self.records[pointer]
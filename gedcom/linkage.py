@@ -0,0 +1,355 @@
+#
+# Gedcom 6.0 Parser
+#
+# Copyright (C) 2015 The Museum of the Jewish People
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+from __future__ import unicode_literals
+import collections
+import itertools
+import multiprocessing
+from dates import parse_date, gregorian_year, OPEN_START, OPEN_END
+from phonetic import name_words, soundex, daitch_mokotoff
+
+# What is compared of an individual, in plain values that pickle cheaply
+# to worker processes: its pointer, the tree it comes from (0 or 1), sex,
+# the words and Soundex codes of its given names and surname, the (low,
+# high) day ordinals and place of its birth and death, the name keys of
+# its parents and spouses, its blocking keys and the numbers of the blocks
+# it is put in once they are split, in increasing order.
+Profile = collections.namedtuple("Profile", [
+    "pointer", "side", "sex", "given", "given_codes", "surname",
+    "surname_codes", "birth", "birth_place", "death", "death_place",
+    "parents", "spouses", "keys", "blocks"])
+
+# A likely duplicate: the pointers of the two individuals, `left` from
+# the first tree, and their score from 0 to 1.
+Match = collections.namedtuple("Match", ["left", "right", "score"])
+
+# Score from which a pair is reported as a duplicate.
+THRESHOLD = 0.8
+
+# Width in years of the birth-year buckets. Each individual is put in two
+# overlapping buckets, so that births less than half this apart meet.
+BIRTH_WINDOW = 10
+
+# Blocks with more individuals are split by the Soundex code of the first
+# given name, as scoring grows with the square of the block size.
+MAX_BLOCK = 1000
+
+# Number of pairs scored per task sent to a worker process.
+TASK_PAIRS = 50000
+
+# Weights of the parts of a score; parts unknown for either individual
+# are left out.
+WEIGHTS = {
+    "given": 0.25,
+    "surname": 0.15,
+    "birth": 0.2,
+    "death": 0.1,
+    "parents": 0.2,
+    "spouses": 0.1,
+}
+
+
+def find_duplicates(gedcom, other=None, threshold=THRESHOLD, workers=None,
+                    max_block=MAX_BLOCK):
+    """ Return the likely duplicate individuals of a Gedcom, or between two
+
+    Instead of comparing every pair, individuals are blocked on the
+    phonetic codes of their surname, their sex and the decade of their
+    birth (see blocking_keys), and only pairs within a block are scored
+    by compare. Each pair sharing several blocks is scored once. With
+    `other`, only pairs of an individual of `gedcom` and one of `other`
+    are scored. Blocks of more than `max_block` individuals are split by
+    given name.
+
+    Blocks are scored in a process pool of `workers` processes, by
+    default the number of CPUs; with 1 they are scored in this process.
+    Returns the Match of each pair scoring at least `threshold`, best
+    first.
+    """
+    profiles = [make_profile(gedcom, e, 0) for e in individuals(gedcom)]
+    if other is not None:
+        profiles.extend(make_profile(other, e, 1) for e in individuals(other))
+    tasks = block_tasks(profiles, other is not None, threshold, max_block)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if workers == 1:
+        matches = list(itertools.chain.from_iterable(
+            itertools.imap(score_blocks, tasks)))
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            matches = list(itertools.chain.from_iterable(
+                pool.imap_unordered(score_blocks, tasks)))
+        finally:
+            pool.terminate()
+    matches.sort(key=lambda match: (-match.score, match.left, match.right))
+    return matches
+
+
+def individuals(gedcom):
+    """ Return the individual records of a Gedcom """
+    return [e for e in gedcom.as_list if e.level == 0 and e.is_individual]
+
+
+def make_profile(gedcom, individual, side=0):
+    """ Return the Profile of an individual of a Gedcom """
+    given, surname = individual.name
+    given = name_words(given)
+    surname = name_words(surname)
+    birth_date, birth_place = individual.birth[:2]
+    death_date, death_place = individual.death[:2]
+    parents = set()
+    for family in gedcom.families(individual, "FAMC"):
+        parents.update(spouse_keys(gedcom, family))
+    spouses = set()
+    for family in gedcom.families(individual, "FAMS"):
+        spouses.update(spouse_keys(gedcom, family, individual.pointer))
+    surname_codes = set()
+    for word in surname:
+        codes = daitch_mokotoff(word) + [soundex(word)]
+        # Names in other scripts are blocked on the word itself.
+        surname_codes.update(code for code in codes if code)
+        if not any(codes):
+            surname_codes.add(word)
+    profile = Profile(
+        individual.pointer, side, individual.gender, frozenset(given),
+        frozenset(soundex(word) for word in given), frozenset(surname),
+        frozenset(surname_codes), date_span(birth_date), place_key(birth_place),
+        date_span(death_date), place_key(death_place), frozenset(parents),
+        frozenset(spouses), (), ())
+    return profile._replace(keys=blocking_keys(profile))
+
+
+def spouse_keys(gedcom, family, exclude=None):
+    """ Return the name keys of the spouses of a family """
+    keys = []
+    for child in family.children:
+        if child.tag in ("HUSB", "WIFE") and child.value != exclude:
+            spouse = gedcom.as_dict.get(child.value)
+            if spouse is not None and spouse.is_individual:
+                key = name_key(spouse.name)
+                if key:
+                    keys.append(key)
+    return keys
+
+
+def name_key(name):
+    """ Return a key comparing relatives by name: the Soundex codes of the
+    first given name and the first surname word, or "" without either.
+    """
+    given = name_words(name[0])
+    surname = name_words(name[1])
+    if not given or not surname:
+        return ""
+    return "{}/{}".format(soundex(given[0]) or given[0],
+                          soundex(surname[0]) or surname[0])
+
+
+def date_span(text):
+    """ Return the (low, high) ordinals of a date, or None """
+    date = parse_date(text) if text else None
+    if date is None:
+        return None
+    return date.low, date.high
+
+
+def place_key(place):
+    """ Return the first part of a place in upper case, "" if none """
+    return place.split(",")[0].strip().upper()
+
+
+def blocking_keys(profile):
+    """ Return the sorted blocking keys of a Profile
+
+    A key is a (surname code, birth bucket, sex) tuple for each phonetic
+    code of the surname and each of the two overlapping BIRTH_WINDOW year
+    buckets of the year of birth, which is None if unknown. Individuals
+    of unknown sex are blocked with both sexes. Individuals without a
+    surname are not blocked.
+    """
+    if profile.birth is None:
+        buckets = [None]
+    else:
+        year = parse_year(profile.birth)
+        buckets = [(0, year // BIRTH_WINDOW),
+                   (1, (year + BIRTH_WINDOW // 2) // BIRTH_WINDOW)]
+    sexes = [profile.sex] if profile.sex in ("M", "F") else ["M", "F"]
+    return tuple(sorted((code, bucket, sex) for code in profile.surname_codes
+                        for bucket in buckets for sex in sexes))
+
+
+def parse_year(span):
+    """ Return the year of the middle of a (low, high) span of ordinals,
+    or of its closed end.
+    """
+    low, high = span
+    if low == OPEN_START:
+        return gregorian_year(high)
+    if high == OPEN_END:
+        return gregorian_year(low)
+    return gregorian_year(low + (high - low) // 2)
+
+
+def block_tasks(profiles, cross, threshold, max_block=MAX_BLOCK):
+    """ Group profiles into blocks and yield the tasks of score_blocks,
+    each of numbered blocks adding up to about TASK_PAIRS pairs.
+
+    Blocks are numbered after being split, and each profile is given the
+    numbers of its blocks, so that a pair is scored in the first block
+    that holds both, even when they are parted in a split block.
+    """
+    blocks = collections.defaultdict(list)
+    for profile in profiles:
+        for key in profile.keys:
+            blocks[key].append(profile)
+    numbered = []
+    numbers = collections.defaultdict(list)
+    for key in sorted(blocks, key=repr):
+        for block in split_block(blocks[key], max_block):
+            if cross and len(set(p.side for p in block)) < 2:
+                continue
+            for profile in block:
+                numbers[id(profile)].append(len(numbered))
+            numbered.append(block)
+    final = dict((id(p), p._replace(blocks=tuple(numbers[id(p)])))
+                 for p in profiles if id(p) in numbers)
+    batch = []
+    pairs = 0
+    for n, block in enumerate(numbered):
+        batch.append((n, [final[id(p)] for p in block]))
+        pairs += len(block) * (len(block) - 1) // 2
+        if pairs >= TASK_PAIRS:
+            yield batch, cross, threshold
+            batch = []
+            pairs = 0
+    if batch:
+        yield batch, cross, threshold
+
+
+def split_block(block, max_block):
+    """ Return a block as a list of blocks of at most about max_block
+    profiles, split by the Soundex code of the first given name.
+    """
+    if len(block) < 2:
+        return []
+    if len(block) <= max_block:
+        return [block]
+    parts = collections.defaultdict(list)
+    for profile in block:
+        parts[min(profile.given_codes) if profile.given_codes else ""].append(profile)
+    return [part for part in parts.values() if len(part) > 1]
+
+
+def score_blocks(task):
+    """ Score the pairs of the blocks of a task, returning the Match of
+    each pair scoring at least the threshold.
+    """
+    blocks, cross, threshold = task
+    matches = []
+    for n, block in blocks:
+        for i, a in enumerate(block):
+            for b in block[i + 1:]:
+                if cross and a.side == b.side:
+                    continue
+                # Score each pair in the first block the two share.
+                if first_shared(a.blocks, b.blocks) != n:
+                    continue
+                score = compare(a, b)
+                if score >= threshold:
+                    if a.side > b.side:
+                        a, b = b, a
+                    matches.append(Match(a.pointer, b.pointer, score))
+    return matches
+
+
+def first_shared(a, b):
+    """ Return the first number of two sorted tuples in both, or None """
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if a[i] == b[j]:
+            return a[i]
+        if a[i] < b[j]:
+            i += 1
+        else:
+            j += 1
+    return None
+
+
+def compare(a, b):
+    """ Return the score from 0 to 1 of two Profiles being the same
+    individual: the weighted mean of the similarity of their given names,
+    surnames, births, deaths, parents and spouses known for both.
+    """
+    if a.sex != b.sex and a.sex in ("M", "F") and b.sex in ("M", "F"):
+        return 0.0
+    parts = [
+        ("given", words_similarity(a.given, a.given_codes, b.given, b.given_codes)),
+        ("surname", words_similarity(a.surname, a.surname_codes,
+                                     b.surname, b.surname_codes)),
+        ("birth", event_similarity(a.birth, a.birth_place, b.birth, b.birth_place)),
+        ("death", event_similarity(a.death, a.death_place, b.death, b.death_place)),
+        ("parents", set_similarity(a.parents, b.parents)),
+        ("spouses", set_similarity(a.spouses, b.spouses)),
+    ]
+    total = 0.0
+    weights = 0.0
+    for name, similarity in parts:
+        if similarity is not None:
+            total += WEIGHTS[name] * similarity
+            weights += WEIGHTS[name]
+    return total / weights if weights else 0.0
+
+
+def words_similarity(words, codes, other_words, other_codes):
+    """ Return the share of the words of the shorter name found in the
+    other, counting words only sounding the same as 0.8, or None if
+    either is empty.
+    """
+    if not words or not other_words:
+        return None
+    if len(words) > len(other_words):
+        words, codes, other_words, other_codes = (other_words, other_codes,
+                                                  words, codes)
+    found = 0.0
+    for word in words:
+        if word in other_words:
+            found += 1
+        elif (word in other_codes or soundex(word) in other_codes or
+              not other_codes.isdisjoint(daitch_mokotoff(word))):
+            found += 0.8
+    return found / len(words)
+
+
+def event_similarity(span, place, other_span, other_place):
+    """ Return the similarity of two events by their dates and places:
+    1 for overlapping dates, falling to 0 five years apart, with places
+    weighing a fifth if both are known. None if either date is unknown.
+    """
+    if span is None or other_span is None:
+        return None
+    gap = max(span[0], other_span[0]) - min(span[1], other_span[1])
+    similarity = max(0.0, 1.0 - max(gap, 0) / (5 * 365.25))
+    if place and other_place:
+        similarity = 0.8 * similarity + 0.2 * (place == other_place)
+    return similarity
+
+
+def set_similarity(keys, other_keys):
+    """ Return the share of the smaller set of name keys in the other, or
+    None if either is empty.
+    """
+    if not keys or not other_keys:
+        return None
+    return len(keys & other_keys) / float(min(len(keys), len(other_keys)))
@@ -0,0 +1,148 @@
+#
+# Gedcom 6.0 Parser
+#
+# Copyright (C) 2015 The Museum of the Jewish People
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+from __future__ import unicode_literals
+import collections
+import timeit
+
+
+class ParseMetrics(object):
+    """ Timings and counts of a parse, collected when passed as `metrics`
+    to Gedcom, FeedParser or iter_records
+
+    `phases` holds the seconds spent in each phase, in the order they
+    first ran: "read", "detect", "decode", "match" (finding lines with
+    the line regex), "build" (creating and linking elements), and "parse"
+    where matching and building are not separate, as well as "snapshot"
+    and "index" for the cache and lazy modes. Phases run once per chunk
+    add up. `bytes`, `lines`, `records`, the per-tag `tags` Counter and
+    `max_depth`, the deepest level seen, are counted from the parsed
+    records.
+
+    `on_phase_end(name, seconds)` is called as each phase ends and
+    `on_record(record)` for each parsed level-0 record; a Gedcom calls it
+    once parsing is over, FeedParser as records complete.
+    """
+    enabled = True
+
+    def __init__(self, on_record=None, on_phase_end=None):
+        self.on_record = on_record
+        self.on_phase_end = on_phase_end
+        self.phases = collections.OrderedDict()
+        self.bytes = 0
+        self.lines = 0
+        self.records = 0
+        self.tags = collections.Counter()
+        self.max_depth = 0
+
+    def phase(self, name):
+        """ Return a context manager timing a phase """
+        return Phase(self, name)
+
+    def read(self, size):
+        """ Count bytes read """
+        self.bytes += size
+
+    def end_phase(self, name, seconds):
+        """ Add the seconds of a phase """
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+        if self.on_phase_end is not None:
+            self.on_phase_end(name, seconds)
+
+    def count(self, records):
+        """ Count the lines, tags and depth of parsed level-0 records """
+        tags = self.tags
+        for record in records:
+            self.records += 1
+            stack = [record]
+            while stack:
+                element = stack.pop()
+                self.lines += 1
+                tags[element.tag] += 1
+                if element.level > self.max_depth:
+                    self.max_depth = element.level
+                stack.extend(element.children)
+            if self.on_record is not None:
+                self.on_record(record)
+
+    @property
+    def seconds(self):
+        """ Total seconds of all phases """
+        return sum(self.phases.values())
+
+    def as_dict(self):
+        """ Return the metrics as a JSON-serializable dict """
+        return {
+            "phases": dict(self.phases),
+            "seconds": self.seconds,
+            "bytes": self.bytes,
+            "lines": self.lines,
+            "records": self.records,
+            "tags": dict(self.tags),
+            "max_depth": self.max_depth,
+        }
+
+    def __unicode__(self):
+        phases = ", ".join("{} {:.3f}s".format(name, seconds)
+                           for name, seconds in self.phases.items())
+        return ("{} bytes, {} lines, {} records, depth {} in {:.3f}s: "
+                "{}".format(self.bytes, self.lines, self.records,
+                            self.max_depth, self.seconds, phases))
+
+
+class Phase(object):
+    """ Context manager timing a phase of a ParseMetrics """
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = timeit.default_timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.end_phase(self.name, timeit.default_timer() - self.started)
+        return False
+
+
+class NullMetrics(object):
+    """ Stand-in for ParseMetrics when they are not collected, doing
+    nothing at the few places a parse reports to it.
+    """
+    enabled = False
+
+    def phase(self, name):
+        return NULL_PHASE
+
+    def read(self, size):
+        pass
+
+    def count(self, records):
+        pass
+
+
+class NullPhase(object):
+    """ Context manager of NullMetrics phases """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_PHASE = NullPhase()
+NULL_METRICS = NullMetrics()
@@ -25,9 +25,70 @@
 # This code based on work from Zappala, 2005.
 # To contact the Zappala, see http://faculty.cs.byu.edu/~zappala
 from __future__ import unicode_literals
+from array import array
+import codecs
+import collections
+import gc
+import itertools
+import mmap
+import multiprocessing
+import os
 import re
-from element import Element
+import sys
+from element import Element, MappedElement
+from extract import Extract
+from dates import date_year, date_arrays
+from compact import CompactStore, CompactList, CompactDict, TOP
+from lazy import RecordIndex, LazyDict, LazyElements, LAZY_RECORDS
+from metrics import NULL_METRICS
+from phonetic import PhoneticIndex
+from references import ReferenceIndex
+from query import Query, QueryIndex, compile_query
+from snapshot import SnapshotCache, source_info
+from writer import GedcomWriter, MAX_LINE, BOM_ENCODINGS, newline_re
+from relations import (RelationshipIndex, Relationship, AncestorMap, LRUCache,
+                       select_members,
+                       breadth_first, ancestor_map, chain,
+                       nearest_common_ancestors, describe)
 import chardet
+from chardet.universaldetector import UniversalDetector
+
+# Number of bytes read at a time when streaming a file.
+CHUNK_SIZE = 1 << 16
+
+# Number of leading bytes looked at when detecting the encoding from the
+# HEAD record, and fed to chardet when the header does not say.
+DETECT_PREFIX = 1 << 16
+
+# Byte order marks and the codecs that strip them.
+BOMS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+# Values of the HEAD CHAR tag and the matching Python codecs. ANSEL has
+# no Python codec, files declaring it are left to chardet. So are files
+# declaring UNICODE: UTF-16 is found before the tag is read, so a tag read
+# as single bytes is in some other encoding.
+CHAR_ENCODINGS = {
+    'UTF-8': 'utf-8',
+    'UTF8': 'utf-8',
+    'ANSI': 'cp1252',
+    'ASCII': 'ascii',
+}
+char_re = re.compile(br'^\s*1 CHAR ([A-Za-z0-9-]+)', re.MULTILINE)
+head_end_re = re.compile(br'[\r\n]\s*0 ')
+
+# An edit made to a Gedcom, as passed to its listeners: the action ("add",
+# "remove", "move" or "replace"), the element added, removed, moved or put
+# in place, the element it replaced or the parent it was moved or removed
+# from, and the level-0 records whose subtrees changed.
+Change = collections.namedtuple("Change", ["action", "element", "old", "records"])
+
+# Number of chunks given to each worker process by a parallel parse, so
+# that workers finishing early pick up more of the file.
+CHUNKS_PER_WORKER = 4
 
 
 class Gedcom:
@@ -42,31 +103,170 @@ class Gedcom:
       - `as_dict` (only elements with pointers, which are the keys)
     """
 
-    def __init__(self, filename=None, stream=None, fd=None, encoding=None):
-        """ Initialize a GEDCOM data object. You must supply a Gedcom file."""
+    # Layout of the source kept by write(): its byte order mark, line
+    # terminator and whether its last line is terminated.
+    bom = b''
+    newline = '\n'
+    final_newline = False
+
+    # Collects nothing unless a ParseMetrics is given.
+    metrics = NULL_METRICS
+
+    # Built on first use by the relationship methods and by query.
+    _relationships = None
+    _query_index = None
+    _phonetic_index = None
+    _references = None
+
+    line_re = re.compile(
+            # Level must start with nonnegative int, no leading zeros.
+            '\s*(?P<level>0|[1-9]+[0-9]*) ' +
+            # Pointer optional, if it exists it must be flanked by '@'
+            '(?P<pointer>@[^@]+@ |)' +
+            # Tag must be alphanumeric string
+            '(?P<tag>[A-Za-z0-9_]+)' +
+            # Value optional, consists of anything after a space to end of line
+            r'(?P<value> [^\r\n]*)?', re.UNICODE
+        )
+    # Same pattern over undecoded bytes, for memory-mapped files.
+    line_bytes_re = re.compile(line_re.pattern.encode('ascii'))
+
+    def __init__(self, filename=None, stream=None, fd=None, encoding=None,
+                 detect=None, use_mmap=False, compact=False, workers=None,
+                 cache=None, lazy=False, metrics=None):
+        """ Initialize a GEDCOM data object. You must supply a Gedcom file.
+
+        When no encoding is given it is detected according to `detect`:
+        "full" feeds the file to chardet a chunk at a time, without
+        copying a memory-mapped file, until chardet is sure or the file
+        ends; "header" uses a BOM or the HEAD CHAR tag and only runs
+        chardet over a bounded prefix of the file when neither is
+        present; the default is "header" in lazy mode and "full"
+        otherwise. The encoding used is kept in
+        `encoding`, and how it was found ("given", "bom", "header" or
+        "chardet") in `encoding_strategy`.
+
+        With `use_mmap` the file is memory-mapped and parsed as bytes, and
+        element values are only decoded when first accessed. The mapping
+        stays open as long as elements refer to it. Files in UTF-16 cannot
+        be parsed as bytes and are decoded as usual.
+
+        With `compact` lines are stored in a CompactStore instead of one
+        Element per line; `as_list`, `as_dict` and `top_element` then
+        hold read-only CompactElement views.
+
+        With `workers` above 1 the file is split at level-0 lines and the
+        parts are parsed by that many processes, see parse_parallel.
+
+        With `cache`, a SnapshotCache or the name of its directory, a file
+        is loaded from a snapshot made when it was last parsed, if its
+        size, mtime and content hash are unchanged, and snapshotted after
+        being parsed otherwise.
+
+        With `lazy` only the offsets, pointers and tags of the level-0
+        records are found when opening, in one pass over the undecoded
+        file, which is memory-mapped when given by name. A record is
+        parsed when looked up in `as_dict` or reached while iterating over
+        `as_list`, and the `lazy` most recently used records, LAZY_RECORDS
+        if it is True, are kept parsed. `as_list` can only be iterated
+        over, `top_element` has no children, and line numbers in parse
+        errors count from the start of the record. Files in UTF-16 or with
+        CR line terminators are parsed as usual.
+
+        With `metrics`, a ParseMetrics, the time of each phase of the
+        parse is measured and the parsed records are counted once it is
+        over; lazy mode only measures the phases and bytes.
+        """
+        if use_mmap and not filename:
+            raise ValueError("use_mmap requires a filename")
+        if cache is not None and (not filename or use_mmap or compact or lazy):
+            raise ValueError("cache requires a filename and no use_mmap, "
+                             "compact or lazy")
         self.as_list = []
         self.as_dict = {}
         self.top_element = Element(-1, "", "TOP", "")
-        if filename:
-            f = open(filename)
-            stream = f.read()
-            f.close()
-        if fd:
-            stream = fd.read()
+        self.listeners = []
+        self.encoding = encoding
+        self.encoding_strategy = "given" if encoding else None
+        self.metrics = metrics = metrics or NULL_METRICS
+        buf = None
+        with metrics.phase("read"):
+            if filename:
+                f = open(filename)
+                if (use_mmap or lazy) and os.fstat(f.fileno()).st_size:
+                    buf = stream = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    stream = f.read()
+                f.close()
+            if fd:
+                stream = fd.read()
+        metrics.read(len(stream))
 
         if not len(stream):
             return
 
-        if not encoding:
-            det = chardet.detect(stream)
-            encoding = det['encoding']
+        if detect is None:
+            detect = "header" if lazy else "full"
+        if cache is not None:
+            if not isinstance(cache, SnapshotCache):
+                cache = SnapshotCache(cache)
+            with metrics.phase("snapshot"):
+                # A snapshot is only used with the encoding and detection
+                # it was parsed with.
+                source = source_info(filename, stream,
+                                     "{}:{}".format(encoding or "", detect))
+                snapshot = cache.load(source)
+                if snapshot is not None:
+                    self.encoding, self.encoding_strategy, fields = snapshot
+                    self.bom, self.newline, self.final_newline = line_format(
+                        stream, self.encoding)
+                    self.build_tree(fields)
+            if snapshot is not None:
+                metrics.count(self.top_element.children)
+                return
+
+        with metrics.phase("detect"):
             if not encoding:
-                raise GedcomParseError("failed to detect file's encoding")
+                if detect == "header":
+                    encoding, self.encoding_strategy = detect_encoding(stream)
+                else:
+                    encoding = detect_whole(stream)
+                    self.encoding_strategy = "chardet"
+                self.encoding = encoding
+            try:
+                self.bom, self.newline, self.final_newline = line_format(
+                    stream, encoding)
+            except LookupError:
+                raise GedcomParseError("failed to lookup file's encoding '{}'".format(encoding))
 
         try:
-            self.parse_stream(stream.decode(encoding, errors='replace'))
+            if lazy and not is_wide(encoding) and self.newline != '\r':
+                with metrics.phase("index"):
+                    self.parse_lazy(stream, encoding,
+                                    LAZY_RECORDS if lazy is True else lazy)
+            elif compact:
+                if is_wide(encoding):
+                    with metrics.phase("decode"):
+                        stream = stream[:].decode(encoding, errors='replace')
+                        stream, encoding = stream.encode('utf-8'), 'utf-8'
+                with metrics.phase("parse"):
+                    self.parse_compact(stream, encoding)
+            elif buf is not None and not is_wide(encoding):
+                with metrics.phase("parse"):
+                    self.parse_mapped(buf, encoding)
+            elif workers and workers > 1 and not is_wide(encoding):
+                with metrics.phase("parse"):
+                    self.parse_parallel(stream, encoding, workers)
+            else:
+                with metrics.phase("decode"):
+                    stream = stream[:].decode(encoding, errors='replace')
+                self.parse_stream(stream)
         except LookupError:
             raise GedcomParseError("failed to lookup file's encoding '{}'".format(encoding))
+        if cache is not None:
+            with metrics.phase("snapshot"):
+                cache.store(self, source)
+        metrics.count(self.top_element.children)
 
     def parse_stream(self, stream):
         """Open and parse file path as GEDCOM 5.5 formatted data.
@@ -74,62 +274,139 @@ class Gedcom:
         Each line should have the following (bracketed items optional):
         level + ' ' + [pointer + ' ' +] tag + [' ' + line_value]
         """
-        r = re.compile(
-                # Level must start with nonnegative int, no leading zeros.
-                '\s*(?P<level>0|[1-9]+[0-9]*) ' +
-                # Pointer optional, if it exists it must be flanked by '@'
-                '(?P<pointer>@[^@]+@ |)' +
-                # Tag must be alphanumeric string
-                '(?P<tag>[A-Za-z0-9_]+)' +
-                # Value optional, consists of anything after a space to end of line
-                r'(?P<value> [^\r\n]*)?', re.UNICODE
-            )
-        line_num = 1
-        last_elem = self.top_element
-        for line in r.finditer(stream):
-            last_elem = self.parse_line(line_num, line, last_elem)
-            line_num += 1
+        lines = self.line_re.finditer(stream)
+        if self.metrics.enabled:
+            # Match all the lines first to time matching and building apart.
+            with self.metrics.phase("match"):
+                lines = list(lines)
+        with self.metrics.phase("build"):
+            line_num = 1
+            last_elem = self.top_element
+            for line in lines:
+                last_elem = self.parse_line(line_num, line, last_elem)
+                line_num += 1
 
     def parse_line(self, line_num, line, last_elem):
         """Parse a line from a GEDCOM 5.5 formatted document.  """
-        d = line.groupdict()
-        '''
-        else:
-            errmsg = ("Line %d of document violates GEDCOM format" % line_num +
-                      "\nSee: http://homepages.rootsweb.ancestry.com/" +
-                      "~pmcbride/gedcom/55gctoc.htm")
-            raise SyntaxError(errmsg)
-        '''
-
-        level = int(d['level'])
-        pointer = d['pointer'].rstrip(' ')
-        tag = d['tag']
-        if d['value']:
-            value = d['value'].lstrip(' ')
-        else:
-            value = ''
-
-        # Check level: should never be more than one higher than previous line.
-        if level > last_elem.level + 1:
-            errmsg = ("Line %d of document violates GEDCOM format" % line_num +
-                      "\nLines must be no more than one level higher than " +
-                      "previous line.\nSee: http://homepages.rootsweb." +
-                      "ancestry.com/~pmcbride/gedcom/55gctoc.htm")
-            raise SyntaxError(errmsg)
-
-        # Create element. Store in list and dict, create children and parents.
-        element = Element(level, pointer, tag, value)
+        element = build_element(line_num, line, last_elem)
+        # Store in list and dict.
         self.as_list.append(element)
-        if pointer != '':
-            self.as_dict[pointer] = element
-
-        # Start with last element as parent, back up if necessary.
-        parent_elem = last_elem
-        while parent_elem.level > level - 1:
-            parent_elem = parent_elem.parent
-        # Add child to parent & parent to child.
-        parent_elem.add_child(element)
-        element.add_parent(parent_elem)
+        if element.pointer != '':
+            self.as_dict[element.pointer] = element
+        return element
+
+    def parse_mapped(self, buf, encoding):
+        """Parse GEDCOM data from an undecoded buffer such as an mmap.
+
+        The encoding must be ASCII compatible. Values are left in the
+        buffer and decoded by the elements when first accessed.
+        """
+        source = (buf, encoding)
+        tags = {}
+        line_num = 1
+        last_elem = self.top_element
+        for line in self.line_bytes_re.finditer(buf):
+            level, pointer, tag = decode_fields(line, encoding, tags)
+            start, end = line.span('value')
+            element = MappedElement(level, pointer, tag, source, start, end)
+            link_element(line_num, element, last_elem)
+            self.as_list.append(element)
+            if pointer != '':
+                self.as_dict[pointer] = element
+            last_elem = element
+            line_num += 1
+
+    def parse_parallel(self, buf, encoding, workers):
+        """Parse GEDCOM data from an undecoded buffer in a process pool.
+
+        The encoding must be ASCII compatible. The buffer is split into
+        chunks starting with level-0 lines, and each worker decodes a
+        chunk and matches its lines with `line_re`. The elements are then
+        created and linked here in file order, with the checks of
+        parse_line, as the chunks come back.
+        """
+        pool = multiprocessing.Pool(workers)
+        try:
+            chunks = ((buf[start:end], encoding) for start, end in
+                      split_records(buf, workers * CHUNKS_PER_WORKER))
+            self.build_tree(itertools.chain.from_iterable(
+                unpack_fields(fields)
+                for fields in pool.imap(parse_chunk, chunks)))
+        finally:
+            pool.terminate()
+
+    def build_tree(self, fields):
+        """Create, link and store elements from (level, pointer, tag,
+        value) tuples in file order, with the checks of parse_line.
+        """
+        # The tree only grows while it is linked, so the cyclic garbage
+        # collector has nothing to find and is paused rather than
+        # repeatedly rescanning it.
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            line_num = 1
+            last_elem = self.top_element
+            for level, pointer, tag, value in fields:
+                element = Element(level, pointer, tag, value)
+                link_element(line_num, element, last_elem)
+                self.as_list.append(element)
+                if pointer != '':
+                    self.as_dict[pointer] = element
+                last_elem = element
+                line_num += 1
+        finally:
+            if enabled:
+                gc.enable()
+
+    def parse_compact(self, buf, encoding):
+        """Parse GEDCOM data from an undecoded buffer into a CompactStore.
+
+        The encoding must be ASCII compatible. The store keeps a reference
+        to the buffer and decodes values when they are accessed.
+        """
+        store = CompactStore(buf, encoding)
+        tags = {}
+        line_num = 1
+        last_level = -1
+        for line in self.line_bytes_re.finditer(buf):
+            level, pointer, tag = decode_fields(line, encoding, tags)
+            check_level(line_num, level, last_level)
+            start, end = line.span('value')
+            store.append(level, pointer, tag, start, end)
+            last_level = level
+            line_num += 1
+        self.as_list = CompactList(store)
+        self.as_dict = CompactDict(store)
+        self.top_element = store.element(TOP)
+
+    def parse_lazy(self, buf, encoding, size):
+        """Index the level-0 records of an undecoded buffer, which are
+        parsed by record() when accessed.
+
+        The encoding must be ASCII compatible.
+        """
+        self.record_index = RecordIndex(buf, encoding)
+        self.records_cache = LRUCache(size)
+        self.as_list = LazyElements(self)
+        self.as_dict = LazyDict(self)
+
+    def record(self, n):
+        """Return the element of level-0 record n of a lazy Gedcom,
+        parsing it unless it was recently used.
+        """
+        return self.records_cache.get(n, lambda: self.parse_record(n))
+
+    def parse_record(self, n):
+        """Parse level-0 record n of a lazy Gedcom into an element tree."""
+        top = Element(-1, "", "TOP", "")
+        line_num = 1
+        last_elem = top
+        for line in self.line_re.finditer(self.record_index.text(n)):
+            last_elem = build_element(line_num, line, last_elem)
+            line_num += 1
+        element = top.children[0]
+        element.add_parent(self.top_element)
         return element
 
     # Methods for analyzing individuals and relationships between individuals
@@ -166,11 +443,9 @@ class Gedcom:
                 if famdata.tag == "MARR":
                     for marrdata in famdata.children:
                         if marrdata.tag == "DATE":
-                            date = marrdata.value.split()[-1]
-                            try:
-                                dates.append(int(date))
-                            except ValueError:
-                                pass
+                            year = date_year(marrdata.value)
+                            if year is not None:
+                                dates.append(year)
         return dates
 
     def marriage_year_match(self, individual, year):
@@ -189,6 +464,133 @@ class Gedcom:
                 return True
         return False
 
+    @property
+    def query_index(self):
+        """ The QueryIndex of this Gedcom, built on first use and kept
+        up to date by the edit methods, see invalidate.
+        """
+        if self._query_index is None:
+            self._query_index = QueryIndex(self)
+        return self._query_index
+
+    def query(self, criteria=None, **terms):
+        """ Return an iterator over the individuals matching criteria
+
+        The criteria are a string in the syntax of Element.criteria_match,
+        keyword arguments with the same keys (surname, name, birth,
+        birthrange, death, deathrange), or a Query from compile_query.
+        Individuals are yielded in file order, as they are requested.
+        """
+        if not isinstance(criteria, Query):
+            criteria = compile_query(criteria, **terms)
+        return criteria.select(self.query_index)
+
+    def date_ranges(self, tag="BIRT", individuals=None):
+        """ Return the individuals and NumPy arrays of the low and high
+        day ordinals of the first date of their `tag` events, see
+        gedcom.dates.parse_date, to filter a whole tree at once:
+
+            people, low, high = gedcom.date_ranges("BIRT")
+            born = (low >= date(1800, 1, 1).toordinal()) & (high < ...)
+
+        Individuals without a date span all time. Needs NumPy.
+        """
+        if individuals is None:
+            individuals = [e for e in self.as_list if e.is_individual]
+        dates = []
+        for individual in individuals:
+            date = None
+            for event in individual.children_with_tag(tag):
+                for child in event.children:
+                    if child.tag == "DATE":
+                        date = child.value
+                        break
+                if date is not None:
+                    break
+            dates.append(date)
+        lows, highs = date_arrays(dates)
+        return individuals, lows, highs
+
+    @property
+    def phonetic_index(self):
+        """ The PhoneticIndex of the names of the individuals of this
+        Gedcom, built on first use or read by load_phonetic_index and
+        kept up to date by the edit methods, see invalidate.
+        """
+        if self._phonetic_index is None:
+            self._phonetic_index = PhoneticIndex.build(
+                e for e in self.as_list if e.is_individual)
+        return self._phonetic_index
+
+    def load_phonetic_index(self, fd):
+        """ Use a PhoneticIndex saved with phonetic_index.save(fd) """
+        self._phonetic_index = PhoneticIndex.load(fd)
+
+    def search_names(self, query, fuzzy=True):
+        """ Return the individuals whose given names or surname have all
+        the words of a query, in the order they were indexed.
+
+        With `fuzzy`, words also match names with the same Soundex or
+        Daitch-Mokotoff code, so that Schwartz finds Shvarts and Szwarc.
+        """
+        index = self.phonetic_index
+        found = []
+        for n in index.search(query, fuzzy):
+            individual = self.as_dict.get(index.pointers[n])
+            if individual is not None:
+                found.append(individual)
+        return found
+
+    @property
+    def relationships(self):
+        """ The RelationshipIndex of this Gedcom, built on first use and
+        kept up to date by the edit methods, see invalidate.
+        """
+        if self._relationships is None:
+            self._relationships = RelationshipIndex(self)
+        return self._relationships
+
+    @property
+    def references(self):
+        """ The ReferenceIndex of this Gedcom, built on first use and
+        kept up to date by the edit methods, see invalidate.
+        """
+        if self._references is None:
+            self._references = ReferenceIndex(self)
+        return self._references
+
+    def invalidate(self):
+        """ Drop the relationship, query, phonetic and reference indexes
+        and the record summaries built so far, to be built again on next
+        use.
+
+        The indexes only follow edits made with add, remove, move and
+        replace. Call this after changing elements in place, such as
+        setting the value of a FAMC. Children added or removed with the
+        Element methods are not in `as_list` or `as_dict` either, so
+        records must be edited with the Gedcom methods.
+        """
+        self._relationships = None
+        self._query_index = None
+        self._phonetic_index = None
+        self._references = None
+        for record in self.top_element.children:
+            record.children_changed()
+
+    def referrers(self, pointer):
+        """ Return the elements whose value is a pointer, such as the
+        FAMS, FAMC, HUSB, WIFE and CHIL elements pointing to a family.
+        """
+        return list(self.references.get(pointer))
+
+    def check_references(self):
+        """ Return a ReferenceReport of the pointers of this Gedcom: the
+        elements pointing to a missing record, which families and
+        get_family_members skip, the records nothing points to, and the
+        elements pointing to a record of the wrong type.
+        """
+        return self.references.report()
+
     def families(self, individual, family_type="FAMS"):
         """ Return family elements listed for an individual. 
 
@@ -198,27 +600,86 @@ class Gedcom:
         """
         if not individual.is_individual:
             raise ValueError("Operation only valid for elements with INDI tag.")
-        families = []
-        for child in individual.children:
-            if (child.tag == family_type):
-                family = child.value
-                if family in self.as_dict and self.as_dict[family].is_family:
-                    families.append(self.as_dict[family])
-        return families
-
-    def get_ancestors(self, indi, anc_type="ALL"):
+        index = self.relationships
+        n = index.number(individual)
+        if n is not None and family_type == "FAMS":
+            families = index.spouse_families[n]
+        elif n is not None and family_type == "FAMC":
+            families = index.child_families[n]
+        else:
+            families = index.find_families(individual, (family_type,))[0]
+        return index.elements(families)
+
+    def get_ancestors(self, indi, anc_type="ALL", max_generations=None):
         """ Return elements corresponding to ancestors of an individual
 
         Optional anc_type. Default "ALL" returns all ancestors, "NAT" can be
-        used to specify only natural (genetic) ancestors.
+        used to specify only natural (genetic) ancestors. Each ancestor is
+        returned once, nearest generations first. max_generations limits
+        how far back to go (1 for parents only).
+        """
+        return [ancestor for ancestor, generation in
+                self.get_ancestor_generations(indi, anc_type, max_generations)]
+
+    def get_ancestor_generations(self, indi, anc_type="ALL", max_generations=None):
+        """ Return (element, generation) tuples for the ancestors of an
+        individual, with generation 1 for parents, 2 for grandparents...
+
+        Ancestors reached along several lines, as in intermarried families,
+        are returned once with their nearest generation. anc_type and
+        max_generations are as for get_ancestors.
         """
         if not indi.is_individual:
             raise ValueError("Operation only valid for elements with INDI tag.")
-        parents = self.get_parents(indi, anc_type)
-        ancestors = parents
-        for parent in parents:
-            ancestors = ancestors + self.get_ancestors(parent)
-        return ancestors
+        index = self.relationships
+        if anc_type == "NAT":
+            parents = index.natural_parents
+        else:
+            parents = index.parents
+        n = index.number(indi)
+        if n is None:
+            # Start from the parents found in the individual's own records.
+            first = [index.number(p) for p in self.get_parents(indi, anc_type)]
+            neighbours = lambda m: first if m is None else parents.get(m, ())
+        else:
+            neighbours = lambda m: parents.get(m, ())
+        return [(index.records[m], generation) for m, generation in
+                breadth_first(n, neighbours, max_generations)]
+
+    def get_descendants(self, indi, max_generations=None):
+        """ Return elements corresponding to descendants of an individual
+
+        Descendants are found through the CHIL members of the FAMS
+        families of each generation. Each descendant is returned once,
+        nearest generations first. max_generations limits how far down to
+        go (1 for children only).
+        """
+        return [descendant for descendant, generation in
+                self.get_descendant_generations(indi, max_generations)]
+
+    def get_descendant_generations(self, indi, max_generations=None):
+        """ Return (element, generation) tuples for the descendants of an
+        individual, with generation 1 for children, 2 for grandchildren...
+
+        Descendants reached along several lines are returned once with
+        their nearest generation. max_generations is as for
+        get_descendants.
+        """
+        if not indi.is_individual:
+            raise ValueError("Operation only valid for elements with INDI tag.")
+        index = self.relationships
+        n = index.number(indi)
+
+        def children(m):
+            if m is None:
+                # Start from the families found in the individual's own records.
+                families = index.find_families(indi, ("FAMS",))[0]
+            else:
+                families = index.spouse_families.get(m, ())
+            return [child for family in families
+                    for child in index.family_children[family]]
+        return [(index.records[m], generation) for m, generation in
+                breadth_first(n, children, max_generations)]
 
     def get_parents(self, indi, parent_type="ALL"):
         """ Return elements corresponding to parents of an individual
@@ -228,40 +689,111 @@ class Gedcom:
         """
         if not indi.is_individual:
             raise ValueError("Operation only valid for elements with INDI tag.")
-        parents = []
-        famc_families = self.families(indi, "FAMC")
-        for family in famc_families:
-            if parent_type == "NAT":
-                for famrec in family.children:
-                    if famrec.tag == "CHIL" and famrec.value == indi.pointer:
-                        for chilrec in famrec.children:
-                            if chilrec.value == "Natural":
-                                if chilrec.tag == "_FREL":
-                                    parents = (parents + 
-                                               self.get_family_members(family, "WIFE"))
-                                elif chilrec.tag == "_MREL":
-                                    parents = (parents +
-                                               self.get_family_members(family, "HUSB"))
-            else:
-                parents = parents + self.get_family_members(family, "PARENTS")
-        return parents
+        index = self.relationships
+        n = index.number(indi)
+        if n is None:
+            families = index.find_families(indi, ("FAMC",))[0]
+            parents = index.find_parents(families, index.ids.get(indi.pointer))
+        else:
+            parents = (index.parents.get(n, []), index.natural_parents.get(n, []))
+        if parent_type == "NAT":
+            return index.elements(parents[1])
+        return index.elements(parents[0])
 
     def find_path_to_anc(self, desc, anc, path=None):
         """ Return path from descendant to ancestor. """
-        if not desc.is_individual and anc.is_individual:
+        if not (desc.is_individual and anc.is_individual):
             raise ValueError("Operation only valid for elements with IND tag.")
         if not path:
             path = [desc]
-        if path[-1].pointer == anc.pointer:
+        if desc.pointer == anc.pointer:
             return path
-        else:
-            parents = self.get_parents(desc, "NAT")
-            for par in parents:
-                potential_path = self.find_path_to_anc(par, anc, path + [par])
-                if potential_path:
-                    return potential_path
+        index = self.relationships
+        target = index.number(anc)
+        predecessors = {}
+        for ancestor, generation in breadth_first(
+                self.individual_number(desc), self.parents_of("NAT"),
+                predecessors=predecessors):
+            if ancestor == target:
+                nodes = list(reversed(chain(target, predecessors)))
+                return path + index.elements(nodes[1:])
         return None
 
+    def relationship(self, a, b, anc_type="ALL"):
+        """ Return how individual a is related to individual b
+
+        The result is a Relationship of:
+          - `label`: what a is to b, such as "parent", "sibling",
+            "great-aunt/uncle" or "2nd cousin once removed"
+          - `ancestors`: their nearest common ancestors
+          - `path`: individuals from a up to one of the ancestors and
+            down to b
+        or None if they have no common ancestor. anc_type is as for
+        get_ancestors.
+        """
+        found, side_a, side_b = nearest_common_ancestors(
+            self.individual_number(a), self.individual_number(b),
+            self.parents_of(anc_type))
+        return self.make_relationship(describe(found, side_a, side_b))
+
+    def batch_relationship(self, pairs, anc_type="ALL", cache_size=1024):
+        """ Return the relationship of each (a, b) pair of individuals
+
+        Like relationship, but the ancestors of the `cache_size` most
+        recently seen individuals are kept, so that pairs sharing
+        individuals are answered without walking the tree again.
+        Results are yielded in the order of `pairs`.
+        """
+        parents = self.parents_of(anc_type)
+        cache = LRUCache(cache_size)
+        for a, b in pairs:
+            a = self.individual_number(a)
+            b = self.individual_number(b)
+            side_a = AncestorMap(*cache.get(a, lambda: ancestor_map(a, parents)))
+            side_b = AncestorMap(*cache.get(b, lambda: ancestor_map(b, parents)))
+            if len(side_a.generations) > len(side_b.generations):
+                smaller, larger = side_b.generations, side_a.generations
+            else:
+                smaller, larger = side_a.generations, side_b.generations
+            found = []
+            best = None
+            for node in smaller:
+                if node in larger:
+                    up = side_a.generations[node]
+                    down = side_b.generations[node]
+                    if best is None or up + down < best:
+                        best = up + down
+                        found = []
+                    if up + down == best:
+                        found.append((node, up, down))
+            yield self.make_relationship(describe(found, side_a, side_b))
+
+    def individual_number(self, indi):
+        """ Return the number of an individual in the relationship index """
+        if not indi.is_individual:
+            raise ValueError("Operation only valid for elements with INDI tag.")
+        n = self.relationships.number(indi)
+        if n is None:
+            raise ValueError("Individual {} is not part of this Gedcom.".format(indi.pointer))
+        return n
+
+    def parents_of(self, anc_type="ALL"):
+        """ Return a function giving the parent numbers of an individual """
+        index = self.relationships
+        if anc_type == "NAT":
+            parents = index.natural_parents
+        else:
+            parents = index.parents
+        return lambda n: parents.get(n, ())
+
+    def make_relationship(self, described):
+        """ Turn the result of relations.describe into a Relationship """
+        if described is None:
+            return None
+        label, ancestors, path = described
+        index = self.relationships
+        return Relationship(label, index.elements(ancestors), index.elements(path))
+
     def get_family_members(self, family, mem_type="ALL"):
         """Return array of family members: individual, spouse, and children.
 
@@ -274,31 +806,304 @@ class Gedcom:
         """
         if not family.is_family:
             raise ValueError("Operation only valid for elements with FAM tag.")
-        family_members = [ ]
-        for elem in family.children:
-            # Default is ALL
-            is_family = (elem.tag == "HUSB" or
-                         elem.tag == "WIFE" or
-                         elem.tag == "CHIL")
-            if mem_type == "PARENTS":
-                is_family = (elem.tag == "HUSB" or
-                             elem.tag == "WIFE")
-            elif mem_type == "HUSB":
-                is_family = (elem.tag == "HUSB")
-            elif mem_type == "WIFE":
-                is_family = (elem.tag == "WIFE")
-            elif mem_type == "CHIL":
-                is_family = (elem.tag == "CHIL")
-            if is_family and elem.value in self.as_dict:
-                family_members.append(self.as_dict[elem.value])
-        return family_members
+        index = self.relationships
+        n = index.number(family)
+        if n is None:
+            members = select_members(index.find_members(family)[0], mem_type)
+        else:
+            members = index.members(n, mem_type)
+        return index.elements(members)
+
+    # Methods for editing records
+
+    def subscribe(self, listener):
+        """ Call listener(change) with a Change after every edit """
+        self.listeners.append(listener)
+
+    def add(self, element, parent=None, index=None):
+        """ Add an element and its subtree as child number `index` of
+        `parent`, by default as the last record before any TRLR
+
+        The levels of the subtree are set to fit under `parent`.
+        Raises ValueError if the element is already in a tree or one of
+        its pointers is in use.
+        """
+        if element.parent is not None:
+            raise ValueError("Element is already in a tree, use move.")
+        parent = self.edit_parent(parent)
+        self.check_pointers(subtree(element))
+        if index is None:
+            index = self.end_index(parent)
+        if parent is self.top_element:
+            removed, added, changed = [], [element], []
+        else:
+            removed, added, changed = [], [], [self.record_of(parent)]
+        self.apply_edit(Change("add", element, None, added + changed),
+                        removed, added, changed,
+                        lambda: self.attach(element, parent, index))
+        return element
+
+    def remove(self, element):
+        """ Remove an element and its subtree """
+        parent = self.edit_parent(element.parent)
+        if parent is self.top_element:
+            removed, added, changed = [element], [], []
+        else:
+            removed, added, changed = [], [], [self.record_of(parent)]
+        self.apply_edit(Change("remove", element, parent, removed + changed),
+                        removed, added, changed,
+                        lambda: self.detach(element))
+        return element
+
+    def move(self, element, parent=None, index=None):
+        """ Move an element and its subtree to child number `index` of
+        another parent, by default the last record before any TRLR
+        """
+        old_parent = self.edit_parent(element.parent)
+        parent = self.edit_parent(parent)
+        ancestor = parent
+        while ancestor is not None:
+            if ancestor is element:
+                raise ValueError("Cannot move an element under itself.")
+            ancestor = ancestor.parent
+        removed, added, changed = [], [], []
+        if old_parent is self.top_element and parent is self.top_element:
+            changed.append(element)
+        else:
+            if old_parent is self.top_element:
+                removed.append(element)
+            else:
+                changed.append(self.record_of(old_parent))
+            if parent is self.top_element:
+                added.append(element)
+            else:
+                changed.append(self.record_of(parent))
+
+        def edit():
+            self.detach(element)
+            position = self.end_index(parent) if index is None else index
+            self.attach(element, parent, position)
+        self.apply_edit(Change("move", element, old_parent,
+                               unique(removed + added + changed)),
+                        removed, added, changed, edit)
+        return element
+
+    def replace(self, old, new):
+        """ Put an element and its subtree in place of another one """
+        if new.parent is not None:
+            raise ValueError("Element is already in a tree, use move.")
+        parent = self.edit_parent(old.parent)
+        self.check_pointers(subtree(new), subtree(old))
+        if parent is self.top_element:
+            removed, added, changed = [old], [new], []
+        else:
+            removed, added, changed = [], [], [self.record_of(parent)]
+
+        def edit():
+            index = parent.children.index(old)
+            self.detach(old)
+            self.attach(new, parent, index)
+        self.apply_edit(Change("replace", new, old, removed + added + changed),
+                        removed, added, changed, edit)
+        return new
+
+    def edit_parent(self, parent):
+        """ Check that elements of this Gedcom can be edited, and return
+        the parent an element is added to or removed from.
+        """
+        if not isinstance(self.as_list, list):
+            raise ValueError("Compact and lazy Gedcoms cannot be edited.")
+        if parent is None:
+            return self.top_element
+        record = parent
+        while record.parent is not None:
+            record = record.parent
+        if record is not self.top_element:
+            raise ValueError("Element is not part of this Gedcom.")
+        return parent
+
+    def check_pointers(self, elements, replaced=()):
+        """ Raise ValueError if the pointers of elements are in use by
+        elements other than those replaced, or repeated.
+        """
+        free = set(e.pointer for e in replaced if e.pointer)
+        pointers = [e.pointer for e in elements if e.pointer]
+        for pointer in pointers:
+            if pointer in self.as_dict and pointer not in free:
+                raise ValueError("Pointer {} is in use.".format(pointer))
+        if len(set(pointers)) < len(pointers):
+            raise ValueError("Pointers are repeated.")
+
+    def end_index(self, parent):
+        """ Return where elements are added to a parent by default """
+        children = parent.children
+        if (parent is self.top_element and children and
+                children[-1].tag == "TRLR"):
+            return len(children) - 1
+        return len(children)
+
+    def record_of(self, element):
+        """ Return the level-0 record an element is part of """
+        while element.parent is not self.top_element:
+            element = element.parent
+        return element
+
+    def apply_edit(self, change, removed, added, changed, edit):
+        """ Make an edit, update the indexes built so far and notify the
+        listeners.
+
+        `removed` and `added` are the records removed and added by the
+        edit, and `changed` those whose subtrees are changed. Individuals
+        are taken out of the search indexes before the edit, while their
+        names and years are those indexed, and put back after it.
+        """
+        changed = unique(changed)
+        searched = [(record, self.unindex_individual(record))
+                    for record in unique(removed + changed)
+                    if record.is_individual]
+        edit()
+        if self._relationships is not None:
+            for record in removed:
+                self._relationships.delete(record)
+            for record in added:
+                self._relationships.insert(record)
+            for record in changed:
+                self._relationships.update(record)
+        if self._references is not None:
+            for record in removed:
+                self._references.delete(record)
+            for record in added:
+                self._references.insert(record)
+            for record in changed:
+                self._references.update(record)
+        for record, numbers in searched:
+            if record.parent is self.top_element:
+                self.index_individual(record, numbers)
+        for record in added:
+            if record.is_individual:
+                self.index_individual(record, (None, None))
+        for listener in self.listeners:
+            listener(change)
+
+    def unindex_individual(self, individual):
+        """ Remove an individual from the search indexes built so far,
+        returning its numbers in them.
+        """
+        query = phonetic = None
+        if self._query_index is not None:
+            query = self._query_index.remove(individual)
+        if self._phonetic_index is not None:
+            phonetic = self._phonetic_index.remove(individual.pointer,
+                                                   individual.name)
+        return query, phonetic
+
+    def index_individual(self, individual, numbers):
+        """ Add an individual to the search indexes built so far, with
+        the numbers it had in them if any.
+        """
+        query, phonetic = numbers
+        if self._query_index is not None:
+            self._query_index.add(individual, query)
+        if self._phonetic_index is not None:
+            self._phonetic_index.add(individual.pointer, individual.name,
+                                     phonetic)
+
+    def attach(self, element, parent, index):
+        """ Link an element under a parent and add its subtree to
+        `as_list` and `as_dict`.
+        """
+        elements = subtree(element)
+        index = min(index, len(parent.children))
+        # Levels and parents follow from the tree, whatever they were.
+        element.level = parent.level + 1
+        for e in elements:
+            for child in e.children:
+                child.level = e.level + 1
+                child.add_parent(e)
+        if index:
+            before = parent.children[index - 1]
+            while before.children:
+                before = before.children[-1]
+            start = self.as_list.index(before) + 1
+        elif parent is self.top_element:
+            start = 0
+        else:
+            start = self.as_list.index(parent) + 1
+        parent.insert_child(index, element)
+        element.add_parent(parent)
+        self.as_list[start:start] = elements
+        for e in elements:
+            if e.pointer:
+                self.as_dict[e.pointer] = e
+
+    def detach(self, element):
+        """ Unlink an element from its parent and remove its subtree from
+        `as_list` and `as_dict`.
+        """
+        elements = subtree(element)
+        start = self.as_list.index(element)
+        del self.as_list[start:start + len(elements)]
+        for e in elements:
+            if e.pointer and self.as_dict.get(e.pointer) is e:
+                del self.as_dict[e.pointer]
+        element.parent.remove_child(element)
+        element.parent = None
 
     # Other methods
 
     def print_gedcom(self):
         """Write GEDCOM data to stdout."""
+        self.write(sys.stdout)
+
+    def write(self, fd, encoding=None, newline=None, max_line=MAX_LINE,
+              **options):
+        """ Write the GEDCOM data to a binary file object
+
+        By default the data is written in the encoding it was read in,
+        with the same byte order mark, line terminator and final line
+        terminator. Values are continued on CONT and CONC lines as needed,
+        see GedcomWriter, which also takes the other options.
+
+        An unmodified file is written back identical when it is in the
+        canonical form lines are written in. Lines are rebuilt from their
+        parsed fields rather than copied, so otherwise:
+          - spaces before the level, and extra spaces before the value,
+            are dropped
+          - all lines end with the terminator of the first line
+          - lines that are not GEDCOM lines are left out
+          - lines longer than `max_line` are split
+        """
+        writer = self.make_writer(fd, encoding, newline, max_line, options)
         for element in self.as_list:
-            print(element)
+            writer.write_element(element)
+        writer.close()
+
+    def extract(self, individuals, fd, encoding=None, newline=None,
+                max_line=MAX_LINE, **options):
+        """ Write a self-contained GEDCOM file holding only some individuals
+        to a binary file object
+
+        The file has the HEAD record, the individuals, the families they
+        are spouses or children in and the records the lines written point
+        to, such as SOUR, NOTE and OBJE records, followed by TRLR. Lines
+        pointing to other individuals and families are left out. Records
+        are written as they are found rather than copied first, see
+        Extract. The other arguments are as for write.
+        """
+        extract = Extract(self, individuals)
+        writer = self.make_writer(fd, encoding, newline, max_line, options)
+        for record in extract.records():
+            writer.write_tree(record, extract.keep)
+        writer.close()
+
+    def make_writer(self, fd, encoding, newline, max_line, options):
+        """ Return the GedcomWriter of write and extract """
+        if encoding is None:
+            encoding = self.encoding or 'utf-8'
+            options.setdefault('bom', self.bom)
+        options.setdefault('final_newline', self.final_newline)
+        return GedcomWriter(fd, encoding, newline or self.newline,
+                            max_line, **options)
 
 
 class GedcomParseError(Exception):
@@ -310,3 +1115,364 @@ class GedcomParseError(Exception):
 
     def __str__(self):
         return repr(self.value)
+
+
+def subtree(element):
+    """ Return an element and its descendants in file order """
+    elements = []
+    stack = [element]
+    while stack:
+        element = stack.pop()
+        elements.append(element)
+        stack.extend(reversed(element.children))
+    return elements
+
+
+def unique(elements):
+    """ Return elements without repeats, by identity, in order """
+    seen = set()
+    found = []
+    for element in elements:
+        if id(element) not in seen:
+            seen.add(id(element))
+            found.append(element)
+    return found
+
+
+def detect_whole(stream, chunk_size=CHUNK_SIZE):
+    """ Return the encoding chardet finds in GEDCOM data, fed to it a
+    chunk at a time so that a memory-mapped file is not copied, and
+    stopping as soon as it is sure.
+    """
+    detector = UniversalDetector()
+    for start in range(0, len(stream), chunk_size):
+        detector.feed(stream[start:start + chunk_size])
+        if detector.done:
+            break
+    detector.close()
+    encoding = detector.result['encoding']
+    if not encoding:
+        raise GedcomParseError("failed to detect file's encoding")
+    return encoding
+
+
+def detect_encoding(stream, prefix_size=DETECT_PREFIX):
+    """ Detect the encoding of GEDCOM data without reading all of it.
+
+    Returns an (encoding, strategy) tuple. A byte order mark wins
+    ("bom"), then the CHAR tag of the HEAD record ("header"); otherwise
+    chardet is run over the first `prefix_size` bytes ("chardet").
+    """
+    for bom, encoding in BOMS:
+        if stream[:len(bom)] == bom:
+            return encoding, "bom"
+    head = stream[:prefix_size]
+    # UTF-16 without a BOM still starts with the level digit of HEAD.
+    if head[:2] == b'0\x00':
+        return 'utf-16-le', "header"
+    if head[:2] == b'\x000':
+        return 'utf-16-be', "header"
+    # Only look inside the HEAD record, which ends at the next level 0.
+    end = head_end_re.search(head)
+    if end:
+        head = head[:end.start()]
+    char = char_re.search(head)
+    if char and char.group(1).upper() in CHAR_ENCODINGS:
+        return CHAR_ENCODINGS[char.group(1).upper()], "header"
+    encoding = chardet.detect(head)['encoding']
+    if not encoding:
+        raise GedcomParseError("failed to detect file's encoding")
+    return encoding, "chardet"
+
+
+def line_format(stream, encoding):
+    """ Return the byte order mark, the line terminator and whether the
+    last line is terminated, of GEDCOM data in an encoding.
+    """
+    bom = b''
+    for mark, name in BOMS:
+        if stream[:len(mark)] == mark:
+            bom = mark
+            encoding = BOM_ENCODINGS[mark]
+            break
+    try:
+        head = stream[len(bom):len(bom) + DETECT_PREFIX].decode(encoding, 'replace')
+        tail = stream[-4:].decode(encoding, 'replace')
+    except LookupError:
+        return bom, '\n', False
+    newline = '\n'
+    found = newline_re.search(head)
+    if found:
+        newline = found.group()
+    return bom, newline, tail.endswith(('\r', '\n'))
+
+
+def build_element(line_num, line, last_elem):
+    """Create an element from a matched line and link it into the tree."""
+    element = Element(*line_fields(line))
+    link_element(line_num, element, last_elem)
+    return element
+
+
+def line_fields(line):
+    """Return the level, pointer, tag and value of a matched line."""
+    d = line.groupdict()
+    '''
+    else:
+        errmsg = ("Line %d of document violates GEDCOM format" % line_num +
+                  "\nSee: http://homepages.rootsweb.ancestry.com/" +
+                  "~pmcbride/gedcom/55gctoc.htm")
+        raise SyntaxError(errmsg)
+    '''
+
+    level = int(d['level'])
+    pointer = d['pointer'].rstrip(' ')
+    tag = d['tag']
+    if d['value']:
+        value = d['value'].lstrip(' ')
+    else:
+        value = ''
+    return level, pointer, tag, value
+
+
+def link_element(line_num, element, last_elem):
+    """Attach a new element to the tree built so far.
+
+    `last_elem` is the element created from the previous line; the new
+    element becomes a child of its closest ancestor one level up.
+    """
+    level = element.level
+    check_level(line_num, level, last_elem.level)
+
+    # Start with last element as parent, back up if necessary.
+    parent_elem = last_elem
+    while parent_elem.level > level - 1:
+        parent_elem = parent_elem.parent
+    # Add child to parent & parent to child.
+    parent_elem.add_child(element)
+    element.add_parent(parent_elem)
+
+
+def check_level(line_num, level, last_level):
+    """Check a line's level against the level of the previous line."""
+    # Check level: should never be more than one higher than previous line.
+    if level > last_level + 1:
+        errmsg = ("Line %d of document violates GEDCOM format" % line_num +
+                  "\nLines must be no more than one level higher than " +
+                  "previous line.\nSee: http://homepages.rootsweb." +
+                  "ancestry.com/~pmcbride/gedcom/55gctoc.htm")
+        raise SyntaxError(errmsg)
+
+
+def decode_fields(line, encoding, tags):
+    """Return the level, pointer and tag of a line matched as bytes.
+
+    `tags` maps raw tags to decoded ones so each distinct tag is decoded
+    and stored only once.
+    """
+    level, pointer, tag = line.group('level', 'pointer', 'tag')
+    if pointer:
+        pointer = pointer.rstrip(b' ').decode(encoding, 'replace')
+    else:
+        pointer = ''
+    if tag in tags:
+        tag = tags[tag]
+    else:
+        tag = tags[tag] = tag.decode('ascii')
+    return int(level), pointer, tag
+
+
+def split_records(buf, count):
+    """Return (start, end) offsets cutting a buffer into at most `count`
+    chunks of about the same size, each starting with a level-0 line.
+    """
+    bounds = [0]
+    for n in range(1, count):
+        target = max(len(buf) * n // count, bounds[-1])
+        found = head_end_re.search(buf, target)
+        if not found:
+            break
+        start = found.start() + 1
+        if start > bounds[-1]:
+            bounds.append(start)
+    bounds.append(len(buf))
+    return zip(bounds[:-1], bounds[1:])
+
+
+def parse_chunk(args):
+    """Match the lines of a (bytes, encoding) chunk in a worker process.
+
+    The fields of the lines are returned packed for a cheap transfer back
+    to the parent process: an array of levels and strings of the
+    pointers, tags and values joined by newlines, which never occur in
+    them. unpack_fields gives them back line by line.
+    """
+    chunk, encoding = args
+    levels = array(b'i')
+    pointers = []
+    tags = []
+    values = []
+    for line in Gedcom.line_re.finditer(chunk.decode(encoding, 'replace')):
+        level, pointer, tag, value = line_fields(line)
+        levels.append(level)
+        pointers.append(pointer)
+        tags.append(tag)
+        values.append(value)
+    return (levels.tostring(), '\n'.join(pointers), '\n'.join(tags),
+            '\n'.join(values))
+
+
+def unpack_fields(fields):
+    """Return the (level, pointer, tag, value) tuples packed by
+    parse_chunk.
+    """
+    levels = array(b'i')
+    levels.fromstring(fields[0])
+    if not levels:
+        return []
+    return zip(levels, *[packed.split('\n') for packed in fields[1:]])
+
+
+def is_wide(encoding):
+    """ Whether an encoding is too wide to be parsed as ASCII bytes """
+    return codecs.lookup(encoding).name.startswith(('utf-16', 'utf-32'))
+
+
+class FeedParser(object):
+    """ Incremental parser of GEDCOM data given a chunk at a time
+
+    It does no I/O itself, so it can be driven by any event loop or
+    network library: feed() the bytes as they arrive, handle the level-0
+    records it returns, and close() at the end of the data. Each call
+    only parses the lines its chunk completes, so the time it blocks for
+    is bounded by the chunk size, and only the record being read and an
+    incomplete line are kept between calls.
+
+    Without an `encoding` the first bytes are held back until the HEAD
+    record is complete, or `prefix_size` bytes arrived, and the encoding
+    is detected from them as by detect_encoding. Records are linked to a
+    TOP element like in Gedcom, which drops them once returned.
+
+    A ParseMetrics given as `metrics` times the phases of each call and
+    counts the records as they complete.
+    """
+
+    def __init__(self, encoding=None, prefix_size=DETECT_PREFIX, metrics=None):
+        self.encoding = encoding
+        self.encoding_strategy = "given" if encoding else None
+        self.prefix_size = prefix_size
+        self.decoder = None
+        self.head = b''
+        self.top = Element(-1, "", "TOP", "")
+        self.last_elem = self.top
+        self.record = None
+        self.line_num = 1
+        self.pending = ''
+        self.metrics = metrics or NULL_METRICS
+
+    def feed(self, chunk):
+        """ Parse a chunk of bytes and return the records it completes """
+        self.metrics.read(len(chunk))
+        if self.decoder is None:
+            self.head += chunk
+            if not self.head_complete():
+                return []
+            chunk, self.head = self.head, b''
+            self.start(chunk)
+        return self.parse(chunk, False)
+
+    def close(self):
+        """ Parse the rest of the data and return the last records """
+        chunk = b''
+        if self.decoder is None:
+            if not self.head:
+                return []
+            chunk, self.head = self.head, b''
+            self.start(chunk)
+        return self.parse(chunk, True)
+
+    def head_complete(self):
+        """ Check if enough bytes arrived to detect the encoding """
+        head = self.head
+        return (self.encoding is not None or len(head) >= self.prefix_size or
+                any(head.startswith(bom) for bom, encoding in BOMS) or
+                head[:2] in (b'0\x00', b'\x000') or
+                head_end_re.search(head) is not None)
+
+    def start(self, head):
+        """ Detect the encoding from the first bytes if needed and set up
+        the decoder.
+        """
+        if not self.encoding:
+            with self.metrics.phase("detect"):
+                self.encoding, self.encoding_strategy = detect_encoding(
+                    head, self.prefix_size)
+        try:
+            self.decoder = codecs.getincrementaldecoder(self.encoding)(
+                errors='replace')
+        except LookupError:
+            raise GedcomParseError("failed to lookup file's encoding '{}'".format(self.encoding))
+
+    def parse(self, chunk, final):
+        """ Decode a chunk and parse its complete lines """
+        metrics = self.metrics
+        with metrics.phase("decode"):
+            text = self.pending + self.decoder.decode(chunk, final)
+        if final:
+            block, self.pending = text, ''
+        else:
+            # Only parse complete lines, keep the rest for the next chunk.
+            cut = max(text.rfind('\n'), text.rfind('\r')) + 1
+            block, self.pending = text[:cut], text[cut:]
+        records = []
+        last_elem = self.last_elem
+        line_num = self.line_num
+        with metrics.phase("parse"):
+            for line in Gedcom.line_re.finditer(block):
+                last_elem = build_element(line_num, line, last_elem)
+                line_num += 1
+                if last_elem.level == 0:
+                    if self.record is not None:
+                        records.append(self.record)
+                    del self.top.children[:]
+                    self.record = last_elem
+        self.last_elem = last_elem
+        self.line_num = line_num
+        if final and self.record is not None:
+            records.append(self.record)
+            self.record = None
+        metrics.count(records)
+        return records
+
+
+def iter_records(path_or_fd, encoding=None, chunk_size=CHUNK_SIZE,
+                 metrics=None):
+    """ Iterate over the level-0 records of a GEDCOM file.
+
+    `path_or_fd` is a filename or a file object opened in binary mode.
+    The file is read `chunk_size` bytes at a time and parsed by a
+    FeedParser, and each record (a level-0 Element with its subtree) is
+    yielded as soon as the next level-0 line is read, so memory use is
+    bounded by the largest record rather than by the file size. A
+    ParseMetrics given as `metrics` is passed on to the FeedParser, and
+    also times reading the file.
+    """
+    metrics = metrics or NULL_METRICS
+    if hasattr(path_or_fd, 'read'):
+        fd = path_or_fd
+    else:
+        fd = open(path_or_fd, 'rb')
+    try:
+        parser = FeedParser(encoding, metrics=metrics)
+        while True:
+            with metrics.phase("read"):
+                chunk = fd.read(chunk_size)
+            if not chunk:
+                break
+            for record in parser.feed(chunk):
+                yield record
+        for record in parser.close():
+            yield record
+    finally:
+        if fd is not path_or_fd:
+            fd.close()
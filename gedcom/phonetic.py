@@ -0,0 +1,285 @@
+#
+# Gedcom 6.0 Parser
+#
+# Copyright (C) 2015 The Museum of the Jewish People
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+from __future__ import unicode_literals
+import bisect
+import json
+import re
+import unicodedata
+
+# Format version of saved PhoneticIndex files.
+INDEX_VERSION = 1
+
+word_re = re.compile(r"\w+", re.UNICODE)
+letters_re = re.compile("[^A-Z]")
+
+# American Soundex digits; vowels and H, W, Y are not coded.
+SOUNDEX_CODES = dict(zip("BFPVCGJKQSXZDTLMNR", "111122222222334556"))
+
+# Daitch-Mokotoff Soundex rules: letter sequences followed by their codes
+# at the start of a name, before a vowel, and elsewhere. "-" is not
+# coded and "|" separates the alternatives of ambiguous sequences.
+DM_TABLE = """
+AI AJ AY 0 1 -
+AU 0 7 -
+A 0 - -
+B 7 7 7
+CHS 5 54 54
+CH 5|4 5|4 5|4
+CK 5|45 5|45 5|45
+CSZ CZS CS CZ 4 4 4
+C 5|4 5|4 5|4
+DRZ DRS DSH DSZ DZH DZS DS DZ 4 4 4
+DT D 3 3 3
+EI EJ EY 0 1 -
+EU 1 1 -
+E 0 - -
+FB F 7 7 7
+G 5 5 5
+H 5 5 -
+IA IE IO IU 1 - -
+I 0 - -
+J 1|4 -|4 -|4
+KS 5 54 54
+KH K 5 5 5
+L 8 8 8
+MN NM 66 66 66
+M 6 6 6
+N 6 6 6
+OI OJ OY 0 1 -
+O 0 - -
+PF PH P 7 7 7
+Q 5 5 5
+RZ RS 94|4 94|4 94|4
+R 9 9 9
+SCHTSCH SCHTSH SCHTCH SHTCH SHCH SHTSH 2 4 4
+SCHT SCHD SHT 2 43 43
+SCH SH 4 4 4
+STCH STSCH SC STRZ STRS STSH 2 4 4
+ST 2 43 43
+SZCZ SZCS 2 4 4
+SZT SHD SZD SD 2 43 43
+SZ S 4 4 4
+TTSCH TTCH TCH 4 4 4
+TH 3 3 3
+TRZ TRS TSCH TSH 4 4 4
+TTSZ TTS TS TC 4 4 4
+TTZ TZS TSZ TZ 4 4 4
+T 3 3 3
+UI UJ UY 0 1 -
+UE U 0 - -
+V W 7 7 7
+X 5 54 54
+Y 1 - -
+ZHDZH ZDZH ZDZ 2 4 4
+ZHD ZD 2 43 43
+ZSCH ZSH ZH ZS Z 4 4 4
+"""
+DM_VOWELS = frozenset("AEIOU")
+
+
+def parse_dm_table(table):
+    """ Return the Daitch-Mokotoff rules as a dict from first letter to
+    (sequence, codes) pairs, longest sequences first. Each of the three
+    codes is a tuple of alternatives.
+    """
+    rules = {}
+    for line in table.split("\n"):
+        fields = line.split()
+        if not fields:
+            continue
+        codes = tuple(tuple(alt.replace("-", "") for alt in code.split("|"))
+                      for code in fields[-3:])
+        for sequence in fields[:-3]:
+            rules.setdefault(sequence[0], []).append((sequence, codes))
+    for pairs in rules.values():
+        pairs.sort(key=lambda pair: -len(pair[0]))
+    return rules
+
+DM_RULES = parse_dm_table(DM_TABLE)
+
+
+def ascii_letters(word):
+    """ Return a word in upper case with accents removed and anything but
+    the letters A to Z dropped.
+    """
+    if isinstance(word, bytes):
+        word = word.decode("utf-8")
+    word = unicodedata.normalize("NFKD", word).upper()
+    return letters_re.sub("", word)
+
+
+def soundex(word):
+    """ Return the American Soundex code of a word, "" if it has no
+    letters to code.
+    """
+    letters = ascii_letters(word)
+    if not letters:
+        return ""
+    code = letters[0]
+    last = SOUNDEX_CODES.get(letters[0], "")
+    for letter in letters[1:]:
+        digit = SOUNDEX_CODES.get(letter, "")
+        if digit and digit != last:
+            code += digit
+        # H and W do not separate letters with the same code.
+        if letter not in "HW":
+            last = digit
+    return (code + "000")[:4]
+
+
+def daitch_mokotoff(word):
+    """ Return the sorted list of Daitch-Mokotoff Soundex codes of a word
+
+    Ambiguous letter sequences, such as CH or RZ, give several codes. The
+    list is empty if the word has no letters to code.
+    """
+    letters = ascii_letters(word)
+    if not letters:
+        return []
+    # (code, code of the previous sequence) of each alternative.
+    branches = [("", None)]
+    i = 0
+    while i < len(letters):
+        for sequence, codes in DM_RULES[letters[i]]:
+            if letters.startswith(sequence, i):
+                break
+        following = letters[i + len(sequence):i + len(sequence) + 1]
+        if i == 0:
+            alternatives = codes[0]
+        elif following in DM_VOWELS:
+            alternatives = codes[1]
+        else:
+            alternatives = codes[2]
+        branches = [(code + alt if alt and alt != last else code, alt)
+                    for code, last in branches for alt in alternatives]
+        i += len(sequence)
+    return sorted(set((code + "000000")[:6] for code, last in branches))
+
+
+def name_words(text):
+    """ Return the words of a name in upper case """
+    if isinstance(text, bytes):
+        text = text.decode("utf-8")
+    return [word.upper() for word in word_re.findall(text)]
+
+
+def name_keys(name):
+    """ Return the sets of words and of phonetic codes of a (first, last)
+    name, as indexed by PhoneticIndex.
+    """
+    words = set(name_words(name[0]) + name_words(name[1]))
+    codes = set()
+    for word in words:
+        codes.add(soundex(word))
+        codes.update(daitch_mokotoff(word))
+    codes.discard("")
+    return words, codes
+
+
+class PhoneticIndex(object):
+    """ Inverted index from the words of people's names to individuals
+
+    Individuals are numbered in the order they are added and kept by
+    pointer in `pointers`. `words` maps each upper-case word of a given
+    name or surname, and `codes` its Soundex and Daitch-Mokotoff codes,
+    to the sorted numbers of the individuals having it. Removed
+    individuals leave their number unused, with a pointer of None.
+    """
+
+    # Number of each indexed pointer, built on the first edit.
+    numbers = None
+
+    def __init__(self, pointers=None, words=None, codes=None):
+        self.pointers = pointers or []
+        self.words = words or {}
+        self.codes = codes or {}
+
+    @classmethod
+    def build(cls, individuals):
+        """ Return the index of the names of a list of individuals """
+        index = cls()
+        for individual in individuals:
+            index.add(individual.pointer, individual.name)
+        return index
+
+    def add(self, pointer, name, n=None):
+        """ Index the (first, last) name of the individual with a pointer,
+        as number n if given.
+        """
+        if n is None:
+            n = len(self.pointers)
+            self.pointers.append(pointer)
+        else:
+            self.pointers[n] = pointer
+        if self.numbers is not None:
+            self.numbers[pointer] = n
+        words, codes = name_keys(name)
+        for word in words:
+            bisect.insort(self.words.setdefault(word, []), n)
+        for code in codes:
+            bisect.insort(self.codes.setdefault(code, []), n)
+
+    def remove(self, pointer, name):
+        """ Remove the individual with a pointer, indexed with a name, and
+        return its number, or None if it was not indexed.
+        """
+        if self.numbers is None:
+            self.numbers = dict((p, n) for n, p in enumerate(self.pointers)
+                                if p is not None)
+        n = self.numbers.pop(pointer, None)
+        if n is None:
+            return None
+        self.pointers[n] = None
+        words, codes = name_keys(name)
+        for keys, postings in ((words, self.words), (codes, self.codes)):
+            for key in keys:
+                numbers = postings[key]
+                del numbers[bisect.bisect_left(numbers, n)]
+                if not numbers:
+                    del postings[key]
+        return n
+
+    def search(self, query, fuzzy=True):
+        """ Return the sorted numbers of the individuals whose names have
+        every word of a query, or a word sounding like it when `fuzzy`.
+        """
+        found = None
+        for word in name_words(query):
+            numbers = set(self.words.get(word, ()))
+            if fuzzy:
+                for code in [soundex(word)] + daitch_mokotoff(word):
+                    numbers.update(self.codes.get(code, ()))
+            found = numbers if found is None else found & numbers
+            if not found:
+                return []
+        return sorted(found or ())
+
+    def save(self, fd):
+        """ Write the index as JSON to a file object """
+        json.dump({
+            "version": INDEX_VERSION,
+            "pointers": self.pointers,
+            "words": self.words,
+            "codes": self.codes,
+        }, fd, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, fd):
+        """ Read an index written by save from a file object """
+        data = json.load(fd)
+        if data.get("version") != INDEX_VERSION:
+            raise ValueError("Unsupported phonetic index version")
+        return cls(data["pointers"], data["words"], data["codes"])
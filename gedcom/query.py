@@ -0,0 +1,270 @@
+#
+# Gedcom 6.0 Parser
+#
+# Copyright (C) 2015 The Museum of the Jewish People
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+from __future__ import unicode_literals
+import bisect
+import collections
+
+# Part of the (first, last) name tuple searched by each name criterion.
+NAME_PARTS = {
+    "name": 0,
+    "surname": 1,
+}
+
+# Year accessor searched by each year criterion, and whether it takes a
+# range of years.
+YEAR_CRITERIA = {
+    "birth": ("birth_year", False),
+    "birthrange": ("birth_year", True),
+    "death": ("death_year", False),
+    "deathrange": ("death_year", True),
+}
+
+# One compiled criterion: a text to find in a name part, or an inclusive
+# (low, high) range of years.
+Term = collections.namedtuple("Term", ["key", "field", "low", "high"])
+
+
+def parse_criteria(criteria):
+    """ Split a criteria string as taken by Element.criteria_match into
+    (key, value) pairs. Raises ValueError if it is malformed.
+    """
+    pairs = []
+    for crit in criteria.split(':'):
+        key, value = crit.split('=')
+        pairs.append((key, value))
+    return pairs
+
+
+def compile_query(criteria=None, **terms):
+    """ Compile criteria into a Query
+
+    The criteria are given as a string in the syntax of
+    Element.criteria_match, as keyword arguments with the same keys, or
+    both. Ranges may also be given as (year1, year2) tuples. Raises
+    ValueError on unknown keys or malformed values.
+    """
+    pairs = parse_criteria(criteria) if criteria else []
+    pairs.extend(sorted(terms.items()))
+    return Query([compile_term(key, value) for key, value in pairs])
+
+
+def compile_term(key, value):
+    """ Return the Term of one criterion """
+    if key in NAME_PARTS:
+        return Term(key, NAME_PARTS[key], value, None)
+    if key not in YEAR_CRITERIA:
+        raise ValueError("Unknown criterion '{}'".format(key))
+    field, is_range = YEAR_CRITERIA[key]
+    if not is_range:
+        year = int(value)
+        return Term(key, field, year, year)
+    if isinstance(value, tuple):
+        year1, year2 = value
+    else:
+        year1, year2 = value.split('-')
+    return Term(key, field, int(year1), int(year2))
+
+
+class Query(object):
+    """ A conjunction of compiled criteria
+
+    A Query is matched against a single element with `matches`, or run
+    against the QueryIndex of a Gedcom with `select`.
+    """
+
+    def __init__(self, terms):
+        self.terms = tuple(terms)
+
+    def matches(self, element):
+        """ Check if an individual matches all the criteria """
+        if not element.is_individual:
+            return False
+        for term in self.terms:
+            if term.high is None:
+                if element.name[term.field].find(term.low) == -1:
+                    return False
+            else:
+                year = getattr(element, term.field)
+                if year is None or not term.low <= year <= term.high:
+                    return False
+        return True
+
+    def select(self, index):
+        """ Yield the individuals of a QueryIndex matching all the
+        criteria, in file order.
+
+        Each criterion is looked up in the index, and the candidates are
+        intersected starting from the most selective criterion.
+        """
+        if not self.terms:
+            matches = range(len(index.individuals))
+        else:
+            candidates = sorted((index.candidates(term) for term in self.terms),
+                                key=len)
+            matches = candidates[0]
+            for other in candidates[1:]:
+                matches = matches.intersection(other)
+            matches = sorted(matches)
+        for n in matches:
+            individual = index.individuals[n]
+            if individual is not None:
+                yield individual
+
+
+class QueryIndex(object):
+    """ Search indexes over the individuals of a Gedcom
+
+    Individuals are numbered in file order. For each name part, every
+    suffix of every distinct name is kept sorted, so that a bisect over
+    them finds the names containing a text; for each year accessor, the
+    known years are kept sorted with the numbers of their individuals
+    for bisecting ranges.
+
+    Individuals are added and removed after the index was built with add
+    and remove. Removed individuals leave their number unused, and added
+    ones come after the others unless given the number of one removed.
+    """
+
+    # Number of each indexed individual, built on the first edit.
+    numbers = None
+
+    def __init__(self, gedcom):
+        """ Build the indexes of a parsed Gedcom """
+        self.individuals = [e for e in gedcom.as_list if e.is_individual]
+        people = {}
+        years = {}
+        for field in NAME_PARTS.values():
+            people[field] = collections.defaultdict(list)
+        for field, is_range in YEAR_CRITERIA.values():
+            years[field] = []
+        for n, individual in enumerate(self.individuals):
+            name = individual.name
+            for field in people:
+                people[field][name[field]].append(n)
+            for field in years:
+                year = getattr(individual, field)
+                if year is not None:
+                    years[field].append((year, n))
+
+        # Per name part: the people with each distinct name, and the
+        # sorted (suffix, name) pairs of the names.
+        self.names = {}
+        for field, named in people.items():
+            suffixes = sorted((name[i:], name) for name in named
+                              for i in range(len(name)))
+            self.names[field] = (dict(named), suffixes)
+        # Per year accessor: sorted years and the matching individuals.
+        self.years = {}
+        for field, pairs in years.items():
+            pairs.sort()
+            self.years[field] = ([year for year, n in pairs],
+                                 [n for year, n in pairs])
+
+    def number(self, individual):
+        """ Return the number of an individual, None if not indexed """
+        if self.numbers is None:
+            self.numbers = dict((e, n) for n, e in enumerate(self.individuals)
+                                if e is not None)
+        return self.numbers.get(individual)
+
+    def add(self, individual, n=None):
+        """ Index an individual, as number n if given """
+        if n is None:
+            n = len(self.individuals)
+            self.individuals.append(individual)
+        else:
+            self.individuals[n] = individual
+        if self.numbers is not None:
+            self.numbers[individual] = n
+        name = individual.name
+        for field, (named, suffixes) in self.names.items():
+            part = name[field]
+            if part in named:
+                bisect.insort(named[part], n)
+            else:
+                named[part] = [n]
+                for i in range(len(part)):
+                    bisect.insort(suffixes, (part[i:], part))
+        for field, (years, numbers) in self.years.items():
+            year = getattr(individual, field)
+            if year is not None:
+                start, end = year_span(years, year)
+                i = start + bisect.bisect(numbers[start:end], n)
+                years.insert(i, year)
+                numbers.insert(i, n)
+
+    def remove(self, individual):
+        """ Remove an individual from the index and return its number,
+        or None if it was not indexed.
+        """
+        n = self.number(individual)
+        if n is None:
+            return None
+        self.individuals[n] = None
+        del self.numbers[individual]
+        name = individual.name
+        for field, (named, suffixes) in self.names.items():
+            part = name[field]
+            named[part].remove(n)
+            if not named[part]:
+                del named[part]
+                for i in range(len(part)):
+                    del suffixes[bisect.bisect_left(suffixes, (part[i:], part))]
+        for field, (years, numbers) in self.years.items():
+            year = getattr(individual, field)
+            if year is not None:
+                start, end = year_span(years, year)
+                i = start + numbers[start:end].index(n)
+                del years[i]
+                del numbers[i]
+        return n
+
+    def candidates(self, term):
+        """ Return the set of individual numbers matching a Term """
+        if term.high is None:
+            return self.find_name(term.field, term.low)
+        return self.find_years(term.field, term.low, term.high)
+
+    def find_name(self, field, text):
+        """ Return the numbers of the individuals with `text` in part
+        `field` of their name.
+        """
+        named, suffixes = self.names[field]
+        if not text:
+            return set(range(len(self.individuals)))
+        found = set()
+        i = bisect.bisect_left(suffixes, (text,))
+        while i < len(suffixes) and suffixes[i][0].startswith(text):
+            found.add(suffixes[i][1])
+            i += 1
+        matches = set()
+        for name in found:
+            matches.update(named[name])
+        return matches
+
+    def find_years(self, field, low, high):
+        """ Return the numbers of the individuals whose year `field` is
+        within [low, high].
+        """
+        years, numbers = self.years[field]
+        start = bisect.bisect_left(years, low)
+        end = bisect.bisect_right(years, high)
+        return set(numbers[start:end])
+
+
+def year_span(years, year):
+    """ Return the slice of a sorted list of years equal to a year """
+    return bisect.bisect_left(years, year), bisect.bisect_right(years, year)
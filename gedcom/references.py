@@ -0,0 +1,139 @@
+#
+# Gedcom 6.0 Parser
+#
+# Copyright (C) 2015 The Museum of the Jewish People
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+from __future__ import unicode_literals
+import collections
+import re
+
+# A value that is a pointer to a record. Calendar escapes such as
+# @#DJULIAN@ start with "@#" and are not pointers.
+pointer_re = re.compile(r'^@[^@#][^@]*@$')
+
+# Tag of the records that elements with these tags must point to.
+TARGET_TAGS = {
+    "FAMS": "FAM",
+    "FAMC": "FAM",
+    "HUSB": "INDI",
+    "WIFE": "INDI",
+    "CHIL": "INDI",
+    "ASSO": "INDI",
+    "ALIA": "INDI",
+    "SOUR": "SOUR",
+    "NOTE": "NOTE",
+    "OBJE": "OBJE",
+    "REPO": "REPO",
+    "SUBM": "SUBM",
+    "SUBN": "SUBN",
+    "ANCI": "SUBM",
+    "DESI": "SUBM",
+}
+
+# Problems found by ReferenceIndex.report: the elements pointing to no
+# record, the records with a pointer that nothing points to, and the
+# elements pointing to a record of the wrong type, such as a FAMS
+# pointing to an INDI.
+ReferenceReport = collections.namedtuple(
+    "ReferenceReport", ["dangling", "orphaned", "mismatched"])
+
+
+def is_pointer(value):
+    """ Return whether an element value is a pointer to a record """
+    return bool(value) and value[0] == "@" and bool(pointer_re.match(value))
+
+
+class ReferenceIndex(object):
+    """ Reverse references of a Gedcom, built in one pass over its elements
+
+    `referrers` maps each pointer to the elements whose value is that
+    pointer, whether or not a record has it. `sources` keeps the level-0
+    records in file order, each with the (pointer, element) references
+    made within it, so that an edited record can be indexed again with
+    insert, update and delete. Records added after the index was built
+    come last.
+    """
+
+    def __init__(self, gedcom):
+        """ Build the index of a parsed Gedcom. """
+        self.gedcom = gedcom
+        self.referrers = {}
+        self.sources = collections.OrderedDict()
+        record = None
+        found = []
+        for element in gedcom.as_list:
+            if element.level == 0:
+                if record is not None:
+                    self.sources[record] = found
+                record = element
+                found = []
+            value = element.value
+            if is_pointer(value):
+                self.referrers.setdefault(value, []).append(element)
+                found.append((value, element))
+        if record is not None:
+            self.sources[record] = found
+
+    def get(self, pointer):
+        """ Return the elements pointing to a pointer """
+        return self.referrers.get(pointer, [])
+
+    def insert(self, record):
+        """ Index the references made within a record added to the Gedcom """
+        found = []
+        stack = [record]
+        while stack:
+            element = stack.pop()
+            value = element.value
+            if is_pointer(value):
+                self.referrers.setdefault(value, []).append(element)
+                found.append((value, element))
+            stack.extend(reversed(element.children))
+        self.sources[record] = found
+
+    def delete(self, record):
+        """ Forget the references made within a record """
+        self.unlink(record)
+        self.sources.pop(record, None)
+
+    def update(self, record):
+        """ Index again the references made within a changed record """
+        self.unlink(record)
+        self.insert(record)
+
+    def unlink(self, record):
+        """ Remove the references made within a record from `referrers` """
+        for pointer, element in self.sources.get(record, ()):
+            elements = self.referrers[pointer]
+            elements.remove(element)
+            if not elements:
+                del self.referrers[pointer]
+
+    def report(self):
+        """ Return the ReferenceReport of the Gedcom, with the elements of
+        each list in record order.
+        """
+        records = self.gedcom.as_dict
+        dangling = []
+        orphaned = []
+        mismatched = []
+        for record, found in self.sources.items():
+            if record.pointer and record.pointer not in self.referrers:
+                orphaned.append(record)
+            for pointer, element in found:
+                target = records.get(pointer)
+                if target is None:
+                    dangling.append(element)
+                elif TARGET_TAGS.get(element.tag, target.tag) != target.tag:
+                    mismatched.append(element)
+        return ReferenceReport(dangling, orphaned, mismatched)
@@ -0,0 +1,528 @@
+#
+# Gedcom 6.0 Parser
+#
+# Copyright (C) 2015 The Museum of the Jewish People
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+from __future__ import unicode_literals
+import collections
+import gc
+from lazy import LazyDict, LazyRecords
+
+# Family member tags, as used by Gedcom.get_family_members.
+MEMBER_TAGS = {
+    "ALL": ("HUSB", "WIFE", "CHIL"),
+    "PARENTS": ("HUSB", "WIFE"),
+    "HUSB": ("HUSB",),
+    "WIFE": ("WIFE",),
+    "CHIL": ("CHIL",),
+}
+
+# Tags by which individual and family records refer to other records.
+LINK_TAGS = {
+    "INDI": ("FAMS", "FAMC"),
+    "FAM": MEMBER_TAGS["ALL"],
+}
+
+# How two individuals are related: what the first is to the second, their
+# nearest common ancestors and a path through one of them.
+Relationship = collections.namedtuple("Relationship", ["label", "ancestors", "path"])
+
+# The generations and predecessors dicts of a walk up from an individual.
+AncestorMap = collections.namedtuple("AncestorMap", ["generations", "predecessors"])
+
+# Parent taken from the family for a natural _FREL/_MREL qualifier.
+NATURAL_PARENT = {
+    "_FREL": "WIFE",
+    "_MREL": "HUSB",
+}
+
+
+class RelationshipIndex(object):
+    """ Family links of a Gedcom, built in one pass over its records
+
+    Records with a pointer are numbered, and links are kept as lists of
+    record numbers keyed by record number:
+      - `spouse_families` and `child_families`: the FAMS and FAMC
+        families of each individual
+      - `family_members`: (tag, member) pairs of each family, for its
+        HUSB, WIFE and CHIL records in file order, and `family_spouses`
+        and `family_children` for the HUSB and WIFE or CHIL ones
+      - `parents` and `natural_parents`: the parents of each individual,
+        all of them or only those marked "Natural" by _FREL/_MREL
+
+    Records added, changed or removed after the index was built are
+    indexed again with insert, update and delete. Removed records leave
+    their number unused.
+    """
+
+    # Pointers each record refers to, and the records referring to each
+    # pointer, found on the first edit.
+    links = None
+    referrers = None
+
+    # Top element of a lazy Gedcom, whose records are known by pointer.
+    top_element = None
+
+    def __init__(self, gedcom):
+        """ Build the index of a parsed Gedcom. """
+        # The index only holds acyclic lists and dicts, so the cyclic
+        # garbage collector has nothing to find while it grows and is
+        # paused rather than repeatedly rescanning the parsed tree.
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self.build(gedcom)
+        finally:
+            if enabled:
+                gc.enable()
+
+    def build(self, gedcom):
+        """ Fill the index from the records of a parsed Gedcom """
+        self.ids = {}
+        if isinstance(gedcom.as_dict, LazyDict):
+            # Records parsed again after being evicted are new elements,
+            # so they are known by pointer only.
+            self.records = LazyRecords(gedcom.as_dict)
+            self.top_element = gedcom.top_element
+            for pointer in gedcom.as_dict:
+                self.ids[pointer] = len(self.records)
+                self.records.pointers.append(pointer)
+        else:
+            self.records = []
+            for pointer, record in gedcom.as_dict.items():
+                self.ids[pointer] = len(self.records)
+                self.records.append(record)
+        self.spouse_families = {}
+        self.child_families = {}
+        self.family_members = {}
+        self.family_spouses = {}
+        self.family_children = {}
+        # (child, qualifier tags) pairs of the CHIL records of a family.
+        self.child_links = {}
+        for n, record in enumerate(self.records):
+            if record.is_individual:
+                self.spouse_families[n], self.child_families[n] = (
+                    self.find_families(record, ("FAMS", "FAMC")))
+            elif record.is_family:
+                self.add_family(n, record)
+        self.parents = {}
+        self.natural_parents = {}
+        for n, families in self.child_families.items():
+            if families:
+                self.parents[n], self.natural_parents[n] = self.find_parents(families, n)
+
+    def insert(self, record):
+        """ Index a record added to the Gedcom, and the records that
+        referred to its pointer before it was added.
+        """
+        if not record.pointer:
+            return
+        self.track_links()
+        n = len(self.records)
+        self.records.append(record)
+        self.ids[record.pointer] = n
+        self.reindex(n)
+        for m in list(self.referrers.get(record.pointer, ())):
+            self.reindex(m)
+
+    def update(self, record):
+        """ Index again a record whose children changed """
+        n = self.number(record)
+        if n is None:
+            return
+        self.track_links()
+        self.reindex(n)
+
+    def delete(self, record):
+        """ Remove a record from the index, and index again the records
+        referring to it.
+        """
+        n = self.number(record)
+        if n is None:
+            return
+        self.track_links()
+        self.unlink(n)
+        self.forget(n)
+        self.records[n] = None
+        del self.ids[record.pointer]
+        for m in list(self.referrers.get(record.pointer, ())):
+            self.reindex(m)
+
+    def track_links(self):
+        """ Find the pointers each record refers to, once """
+        if self.links is not None:
+            return
+        self.links = {}
+        self.referrers = {}
+        for n, record in enumerate(self.records):
+            if record is not None:
+                self.link(n)
+
+    def link(self, n):
+        """ Note the pointers record n refers to """
+        record = self.records[n]
+        tags = LINK_TAGS.get(record.tag, ())
+        pointers = [child.value for child in record.children if child.tag in tags]
+        self.links[n] = pointers
+        for pointer in pointers:
+            self.referrers.setdefault(pointer, set()).add(n)
+
+    def unlink(self, n):
+        """ Forget the pointers record n refers to """
+        for pointer in self.links.pop(n, ()):
+            referrers = self.referrers.get(pointer)
+            if referrers is not None:
+                referrers.discard(n)
+                if not referrers:
+                    del self.referrers[pointer]
+
+    def forget(self, n):
+        """ Remove the links of record n """
+        for links in (self.spouse_families, self.child_families,
+                      self.family_members, self.family_spouses,
+                      self.family_children, self.child_links,
+                      self.parents, self.natural_parents):
+            links.pop(n, None)
+
+    def reindex(self, n):
+        """ Find the links of record n again """
+        record = self.records[n]
+        self.unlink(n)
+        self.forget(n)
+        self.link(n)
+        if record.is_individual:
+            self.spouse_families[n], self.child_families[n] = (
+                self.find_families(record, ("FAMS", "FAMC")))
+            self.update_parents(n)
+        elif record.is_family:
+            self.add_family(n, record)
+            # Children of the family get their parents from it.
+            for m in self.referrers.get(record.pointer, ()):
+                if n in self.child_families.get(m, ()):
+                    self.update_parents(m)
+
+    def update_parents(self, n):
+        """ Find the parents of individual n again """
+        families = self.child_families.get(n)
+        if families:
+            self.parents[n], self.natural_parents[n] = self.find_parents(families, n)
+        else:
+            self.parents.pop(n, None)
+            self.natural_parents.pop(n, None)
+
+    def number(self, element):
+        """ Return the record number of an element, None if not indexed """
+        n = self.ids.get(element.pointer)
+        if n is None:
+            return None
+        if self.top_element is not None:
+            return n if element.parent is self.top_element else None
+        if self.records[n] == element:
+            return n
+        return None
+
+    def find_families(self, individual, family_types):
+        """ Return, for each of the given family tags, the numbers of the
+        families an individual refers to with that tag.
+        """
+        families = tuple([] for family_type in family_types)
+        for child in individual.children:
+            if child.tag not in family_types:
+                continue
+            family = self.ids.get(child.value)
+            if family is not None and self.records[family].is_family:
+                families[family_types.index(child.tag)].append(family)
+        return families
+
+    def add_family(self, n, family):
+        """ Index the members of family number n """
+        members, links = self.find_members(family)
+        self.family_members[n] = members
+        self.family_spouses[n] = select_members(members, "PARENTS")
+        self.family_children[n] = select_members(members, "CHIL")
+        self.child_links[n] = links
+
+    def find_members(self, family):
+        """ Return the (tag, member) pairs of a family element, and the
+        (child, qualifier tags) pairs of its natural children.
+        """
+        members = []
+        links = []
+        for elem in family.children:
+            if elem.tag not in MEMBER_TAGS["ALL"]:
+                continue
+            member = self.ids.get(elem.value)
+            if member is None:
+                continue
+            members.append((elem.tag, member))
+            if elem.tag == "CHIL":
+                qualifiers = [rec.tag for rec in elem.children
+                              if rec.value == "Natural" and
+                              rec.tag in NATURAL_PARENT]
+                if qualifiers:
+                    links.append((member, qualifiers))
+        return members, links
+
+    def find_parents(self, families, n):
+        """ Return the parents and natural parents of individual n, who
+        is a child in the given families.
+        """
+        parents = []
+        natural = []
+        for family in families:
+            parents.extend(self.family_spouses[family])
+            for child, qualifiers in self.child_links[family]:
+                if child == n:
+                    for tag in qualifiers:
+                        natural.extend(self.members(family, NATURAL_PARENT[tag]))
+        return parents, natural
+
+    def members(self, family, mem_type="ALL"):
+        """ Return the numbers of the members of family number `family` """
+        return select_members(self.family_members[family], mem_type)
+
+    def elements(self, numbers):
+        """ Return the records with the given numbers """
+        return [self.records[n] for n in numbers]
+
+
+def select_members(members, mem_type="ALL"):
+    """ Return the members of a given type from (tag, member) pairs """
+    tags = MEMBER_TAGS.get(mem_type, MEMBER_TAGS["ALL"])
+    return [member for tag, member in members if tag in tags]
+
+
+def breadth_first(start, neighbours, max_generations=None, predecessors=None):
+    """ Walk a graph breadth first from node `start`
+
+    `neighbours` is a function returning the nodes adjacent to a node.
+    Returns (node, generation) pairs for every node reached, in the order
+    reached, each node once at its lowest generation and `start` never.
+    Nodes already visited are not expanded again, so the walk is linear
+    in the size of the graph and stops on cyclic data. If a
+    `predecessors` dict is given, it is filled with the node each node
+    was reached from.
+    """
+    seen = set([start])
+    found = []
+    level = [start]
+    generation = 0
+    while level and (max_generations is None or generation < max_generations):
+        generation += 1
+        next_level = []
+        for node in level:
+            for adjacent in neighbours(node):
+                if adjacent not in seen:
+                    seen.add(adjacent)
+                    found.append((adjacent, generation))
+                    next_level.append(adjacent)
+                    if predecessors is not None:
+                        predecessors[adjacent] = node
+        level = next_level
+    return found
+
+
+def ancestor_map(start, neighbours):
+    """ Return the generations and predecessors dicts of all the nodes
+    reachable from `start`, including `start` itself at generation 0.
+    """
+    predecessors = {}
+    generations = dict(breadth_first(start, neighbours, predecessors=predecessors))
+    generations[start] = 0
+    return generations, predecessors
+
+
+def chain(node, predecessors):
+    """ Return the nodes from `node` back to the start of a walk """
+    nodes = [node]
+    while nodes[-1] in predecessors:
+        nodes.append(predecessors[nodes[-1]])
+    return nodes
+
+
+class AncestorSearch(object):
+    """ One side of a bidirectional search for common ancestors """
+
+    def __init__(self, start):
+        self.generations = {start: 0}
+        self.predecessors = {}
+        self.frontier = [start]
+        self.level = 0
+        # Number of nodes of each generation not reached by the other side.
+        self.unmatched = [1]
+        self.lowest = 0
+
+    def expand(self, neighbours):
+        """ Reach the next generation and return its nodes """
+        self.level += 1
+        found = []
+        for node in self.frontier:
+            for parent in neighbours(node):
+                if parent not in self.generations:
+                    self.generations[parent] = self.level
+                    self.predecessors[parent] = node
+                    found.append(parent)
+        self.frontier = found
+        self.unmatched.append(len(found))
+        return found
+
+    def match(self, node):
+        """ Note that the other side reached a node of this side """
+        self.unmatched[self.generations[node]] -= 1
+
+    def closest_unmatched(self):
+        """ Lowest generation a node reached only by this side can be in,
+        counting the nodes it has yet to reach.
+        """
+        while (self.lowest < len(self.unmatched) and
+               not self.unmatched[self.lowest]):
+            self.lowest += 1
+        if self.lowest < len(self.unmatched):
+            return self.lowest
+        return self.next_level()
+
+    def next_level(self):
+        """ Generation of the nodes this side has yet to reach """
+        if self.frontier:
+            return self.level + 1
+        return float('inf')
+
+
+def nearest_common_ancestors(a, b, neighbours):
+    """ Find the nearest common ancestors of nodes a and b
+
+    Searches up from both nodes, a generation at a time on the side with
+    the smaller frontier, and stops once no common ancestor as close as
+    those found can remain. Nodes count as their own ancestors. Returns
+    the (ancestor, generations from a, generations from b) tuples with
+    the smallest total, and the generations and predecessors dicts of
+    both searches.
+    """
+    sides = (AncestorSearch(a), AncestorSearch(b))
+    best = float('inf')
+    found = []
+    if a == b:
+        best = 0
+        found.append((a, 0, 0))
+    while True:
+        # Total generations of a common ancestor not found yet is at least:
+        bound = min(sides[0].closest_unmatched() + sides[1].next_level(),
+                    sides[1].closest_unmatched() + sides[0].next_level())
+        if best < bound or bound == float('inf'):
+            break
+        if (not sides[1].frontier or
+                sides[0].frontier and
+                len(sides[0].frontier) <= len(sides[1].frontier)):
+            side, other = sides
+        else:
+            other, side = sides
+        for node in side.expand(neighbours):
+            if node in other.generations:
+                side.match(node)
+                other.match(node)
+                up = sides[0].generations[node]
+                down = sides[1].generations[node]
+                if up + down < best:
+                    best = up + down
+                    found = []
+                if up + down == best:
+                    found.append((node, up, down))
+    return found, sides[0], sides[1]
+
+
+def describe(found, side_a, side_b):
+    """ Return the kinship label, the nearest common ancestors and the
+    path between two nodes from the results of a common ancestor search.
+
+    `side_a` and `side_b` have the `generations` and `predecessors` of
+    the searches from each node. Among ancestors at the same total
+    distance the most even split between the two lines is used.
+    """
+    if not found:
+        return None
+    up, down = min(((up, down) for node, up, down in found),
+                   key=lambda gens: abs(gens[0] - gens[1]))
+    ancestors = [node for node, u, d in found if (u, d) == (up, down)]
+    path = (list(reversed(chain(ancestors[0], side_a.predecessors))) +
+            chain(ancestors[0], side_b.predecessors)[1:])
+    return kinship_label(up, down), ancestors, path
+
+
+def ordinal(n):
+    """ Return n as an English ordinal: 1st, 2nd, 3rd, 4th... """
+    if 10 <= n % 100 <= 20:
+        suffix = 'th'
+    else:
+        suffix = {1: 'st', 2: 'nd', 3: 'rd'}.get(n % 10, 'th')
+    return '%d%s' % (n, suffix)
+
+
+def greats(n):
+    """ Return the prefix for n greats: "", "great-", "2nd great-"... """
+    if n == 0:
+        return ''
+    if n == 1:
+        return 'great-'
+    return '%s great-' % ordinal(n)
+
+
+def kinship_label(up, down):
+    """ Name what a person is to another
+
+    `up` and `down` are the numbers of generations from the person and
+    from the other one to their nearest common ancestor.
+    """
+    if up == 0 and down == 0:
+        return "self"
+    if up == 0:
+        if down == 1:
+            return "parent"
+        return greats(down - 2) + "grandparent"
+    if down == 0:
+        if up == 1:
+            return "child"
+        return greats(up - 2) + "grandchild"
+    if up == 1 and down == 1:
+        return "sibling"
+    if up == 1:
+        return greats(down - 2) + "aunt/uncle"
+    if down == 1:
+        return greats(up - 2) + "niece/nephew"
+    label = "%s cousin" % ordinal(min(up, down) - 1)
+    removed = abs(up - down)
+    if removed == 1:
+        label += " once removed"
+    elif removed == 2:
+        label += " twice removed"
+    elif removed:
+        label += " %d times removed" % removed
+    return label
+
+
+class LRUCache(object):
+    """ Mapping keeping the `size` most recently used items """
+
+    def __init__(self, size):
+        self.size = size
+        self.items = collections.OrderedDict()
+
+    def get(self, key, compute):
+        """ Return the item for a key, calling compute() if missing """
+        if key in self.items:
+            value = self.items.pop(key)
+        else:
+            value = compute()
+            if len(self.items) >= self.size:
+                self.items.popitem(last=False)
+        self.items[key] = value
+        return value
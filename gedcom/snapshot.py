@@ -0,0 +1,253 @@
+#
+# Gedcom 6.0 Parser
+#
+# Copyright (C) 2015 The Museum of the Jewish People
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+from __future__ import unicode_literals
+from array import array
+import binascii
+import collections
+import hashlib
+import os
+import struct
+import sys
+import tempfile
+
+# Snapshot files start with MAGIC and a header of the format version, the
+# size, mtime and SHA-1 digest of the source file and the number of lines.
+MAGIC = b"GEDSNAP\x00"
+VERSION = 2
+HEADER = struct.Struct(b"<8sHQd20sI")
+# Each section of a snapshot is preceded by its length in bytes.
+SECTION = struct.Struct(b"<Q")
+# Separates the strings of a section.
+SEPARATOR = "\x00"
+
+# Default size limit of a SnapshotCache directory.
+CACHE_BYTES = 1 << 30
+
+# What a snapshot is checked against: the size, mtime and SHA-1 digest of
+# the source file, and the options it was parsed with that change the
+# result, such as the encoding asked for.
+SourceInfo = collections.namedtuple("SourceInfo",
+                                    ["size", "mtime", "digest", "options"])
+
+
+class SnapshotError(Exception):
+    """ A snapshot is corrupt, of another version or out of date """
+    pass
+
+
+def source_info(filename, data, options=""):
+    """ Return the SourceInfo of a file whose content is `data`, parsed
+    with options summed up in a string.
+    """
+    return SourceInfo(len(data), os.stat(filename).st_mtime,
+                      hashlib.sha1(data).digest(), options)
+
+
+def write_snapshot(gedcom, fd, source):
+    """ Write a parsed Gedcom to a binary file object
+
+    The lines are stored as little-endian arrays of levels and tag
+    numbers, a table of tags, and the pointers and values as UTF-8 text,
+    with the encoding of the source and the options of `source`. The
+    tree and `as_dict` are rebuilt from them on loading. Raises
+    SnapshotError if a string contains the separator.
+    """
+    levels = array(b'i')
+    tag_ids = array(b'i')
+    tags = {}
+    pointers = []
+    values = []
+    for element in gedcom.as_list:
+        levels.append(element.level)
+        tag_ids.append(tags.setdefault(element.tag, len(tags)))
+        pointers.append(element.pointer)
+        values.append(element.value)
+    table = sorted(tags, key=tags.get)
+    meta = [gedcom.encoding or "", gedcom.encoding_strategy or "",
+            source.options]
+
+    fd.write(HEADER.pack(MAGIC, VERSION, source.size, source.mtime,
+                         source.digest, len(levels)))
+    write_section(fd, join_strings(meta))
+    write_section(fd, little_endian(levels))
+    write_section(fd, join_strings(table))
+    write_section(fd, little_endian(tag_ids))
+    write_section(fd, join_strings(pointers))
+    write_section(fd, join_strings(values))
+
+
+def read_snapshot(fd, source=None):
+    """ Read a snapshot written by write_snapshot
+
+    Returns the encoding, the encoding strategy and a list of (level,
+    pointer, tag, value) tuples in file order. Raises SnapshotError if
+    the snapshot is invalid or, when `source` is given, was not made from
+    a file with that SourceInfo.
+    """
+    header = fd.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise SnapshotError("Truncated snapshot header")
+    magic, version, size, mtime, digest, count = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        raise SnapshotError("Not a version {} snapshot".format(VERSION))
+    meta = split_strings(read_section(fd))
+    if len(meta) != 3:
+        raise SnapshotError("Corrupt snapshot")
+    encoding, strategy, options = meta
+    if source is not None and SourceInfo(size, mtime, digest, options) != source:
+        raise SnapshotError("Snapshot is out of date")
+
+    levels = from_little_endian(read_section(fd))
+    table = split_strings(read_section(fd))
+    tag_ids = from_little_endian(read_section(fd))
+    pointers = split_strings(read_section(fd))
+    values = split_strings(read_section(fd))
+    if not count:
+        return encoding or None, strategy or None, []
+    if not len(levels) == len(tag_ids) == len(pointers) == len(values) == count:
+        raise SnapshotError("Corrupt snapshot")
+    try:
+        tags = [table[n] for n in tag_ids]
+    except IndexError:
+        raise SnapshotError("Corrupt snapshot")
+    return (encoding or None, strategy or None,
+            zip(levels, pointers, tags, values))
+
+
+def write_section(fd, data):
+    """ Write bytes preceded by their length """
+    fd.write(SECTION.pack(len(data)))
+    fd.write(data)
+
+
+def read_section(fd):
+    """ Read bytes written by write_section """
+    header = fd.read(SECTION.size)
+    if len(header) < SECTION.size:
+        raise SnapshotError("Truncated snapshot")
+    size = SECTION.unpack(header)[0]
+    data = fd.read(size)
+    if len(data) < size:
+        raise SnapshotError("Truncated snapshot")
+    return data
+
+
+def join_strings(strings):
+    """ Encode strings separated by SEPARATOR """
+    text = SEPARATOR.join(strings)
+    if text.count(SEPARATOR) != max(len(strings) - 1, 0):
+        raise SnapshotError("String contains the snapshot separator")
+    return text.encode('utf-8')
+
+
+def split_strings(data):
+    """ Decode strings encoded by join_strings """
+    try:
+        return data.decode('utf-8').split(SEPARATOR)
+    except UnicodeDecodeError:
+        raise SnapshotError("Corrupt snapshot")
+
+
+def little_endian(numbers):
+    """ Return the bytes of an array in little-endian order """
+    if sys.byteorder == 'big':
+        numbers = array(numbers.typecode, numbers)
+        numbers.byteswap()
+    return numbers.tostring()
+
+
+def from_little_endian(data):
+    """ Return the array of ints stored by little_endian """
+    numbers = array(b'i')
+    if len(data) % numbers.itemsize:
+        raise SnapshotError("Corrupt snapshot")
+    numbers.fromstring(data)
+    if sys.byteorder == 'big':
+        numbers.byteswap()
+    return numbers
+
+
+class SnapshotCache(object):
+    """ Directory of snapshots named by the digest of their source file
+
+    Loading a snapshot marks it as recently used by touching it, and
+    storing one evicts the least recently used snapshots once the
+    directory holds more than `max_bytes` of them.
+    """
+
+    def __init__(self, directory, max_bytes=CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, source):
+        """ Return the snapshot file name for a SourceInfo """
+        name = binascii.hexlify(source.digest).decode('ascii')
+        return os.path.join(self.directory, name + ".snap")
+
+    def load(self, source):
+        """ Return read_snapshot's result for a source file, or None if
+        there is no valid snapshot of it.
+        """
+        path = self.path(source)
+        try:
+            with open(path, 'rb') as fd:
+                snapshot = read_snapshot(fd, source)
+        except (IOError, SnapshotError):
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return snapshot
+
+    def store(self, gedcom, source):
+        """ Save a snapshot of a Gedcom parsed from a source file and
+        evict old snapshots. Returns whether it was saved.
+        """
+        fd, temp = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write_snapshot(gedcom, f, source)
+            os.rename(temp, self.path(source))
+        except (IOError, OSError, SnapshotError):
+            if os.path.exists(temp):
+                os.remove(temp)
+            return False
+        self.evict()
+        return True
+
+    def evict(self):
+        """ Remove the least recently used snapshots above max_bytes """
+        snapshots = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".snap"):
+                path = os.path.join(self.directory, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                snapshots.append((info.st_mtime, info.st_size, path))
+        total = sum(size for used, size, path in snapshots)
+        for used, size, path in sorted(snapshots):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
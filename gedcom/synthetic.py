@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+#
+# Gedcom 6.0 Parser
+#
+# Copyright (C) 2015 The Museum of the Jewish People
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+from __future__ import unicode_literals
+from array import array
+import argparse
+import random
+from element import Element
+from writer import GedcomWriter
+
+GIVEN_NAMES = {
+    "M": ["Abraham", "Isaac", "Jacob", "David", "Samuel", "Joseph", "Moses",
+          "Aaron", "Benjamin", "Daniel", "Elijah", "Solomon", "Nathan"],
+    "F": ["Sarah", "Rebecca", "Rachel", "Leah", "Miriam", "Esther", "Hannah",
+          "Ruth", "Deborah", "Judith", "Naomi", "Dinah", "Tamar"],
+}
+SURNAMES = ["Cohen", "Levi", "Katz", "Friedman", "Schwartz", "Shapiro",
+            "Rosen", "Klein", "Weiss", "Goldberg", "Adler", "Halevy",
+            "Mizrahi", "Peretz", "Biton", "Azoulay"]
+# Names with non-ASCII letters, Hebrew script among them.
+NON_ASCII_GIVEN = {
+    "M": ["אברהם", "יצחק", "Zoë", "Łukasz", "Jiří", "Jürgen"],
+    "F": ["שרה", "רבקה", "Zoë", "Małgorzata", "Chloé", "Zofia"],
+}
+NON_ASCII_SURNAMES = ["כהן", "לוי", "Szwarc", "Wójcik", "Ďurčo", "Öztürk"]
+PLACES = ["Vilna, Lithuania", "Warsaw, Poland", "Odessa, Ukraine",
+          "Jerusalem, Israel", "Fez, Morocco", "Baghdad, Iraq",
+          "New York, USA", "Łódź, Poland", "Kraków, Poland"]
+MONTHS = ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP",
+          "OCT", "NOV", "DEC"]
+HEBREW_MONTHS = ["TSH", "CSH", "KSL", "TVT", "SHV", "ADR", "ADS", "NSN",
+                 "IYR", "SVN", "TMZ", "AAV", "ELL"]
+NOTE_WORDS = ("family story recorded by a cousin from letters kept in the "
+              "archive of the community and checked against the registers "
+              "of births marriages and deaths").split()
+
+# Year the founders are born around, and the years between generations.
+FIRST_YEAR = 1700
+GENERATION_YEARS = 25
+# Share of children marked as natural children of both parents.
+NATURAL_CHILDREN = 0.9
+
+
+class TreeSpec(object):
+    """ Parameters of a synthetic tree, see generate """
+
+    def __init__(self, individuals=1000, generations=8, collapse=0.05,
+                 notes=0.2, sources=0.3, non_ascii=0.1, hebrew_dates=0.1,
+                 seed=0):
+        if individuals < 1 or generations < 1:
+            raise ValueError("individuals and generations must be positive")
+        self.individuals = individuals
+        self.generations = min(generations, individuals)
+        self.collapse = collapse
+        self.notes = notes
+        self.sources = sources
+        self.non_ascii = non_ascii
+        self.hebrew_dates = hebrew_dates
+        self.seed = seed
+
+
+class Pedigree(object):
+    """ The individuals and families of a synthetic tree
+
+    Individuals are numbered from 0, oldest generation first, and split
+    evenly between the generations. Every individual past the first
+    generation is a child of a family of the previous one, whose spouses
+    are drawn from that generation. With probability `collapse` the wife
+    of a family is a cousin of the husband, descending from the same
+    grandparents' family, so that ancestors repeat in pedigrees.
+    """
+
+    def __init__(self, spec, rng):
+        size = spec.individuals
+        self.sex = [rng.choice("MF") for n in range(size)]
+        self.generation = array(b'i', [n * spec.generations // size
+                                       for n in range(size)])
+        self.child_family = array(b'l', [-1] * size)
+        self.spouse_families = {}
+        self.husbands = array(b'l')
+        self.wives = array(b'l')
+        self.children = []
+        # First individual of each generation, and the end of the last.
+        bounds = [-(-generation * size // spec.generations)
+                  for generation in range(spec.generations + 1)]
+        for generation in range(1, spec.generations):
+            families = self.make_families(
+                range(bounds[generation - 1], bounds[generation]), spec, rng)
+            if not families:
+                continue
+            for child in range(bounds[generation], bounds[generation + 1]):
+                family = rng.choice(families)
+                self.child_family[child] = family
+                self.children[family].append(child)
+
+    def make_families(self, members, spec, rng):
+        """ Pair individuals of one generation into families """
+        men = [n for n in members if self.sex[n] == "M"]
+        women = [n for n in members if self.sex[n] == "F"]
+        rng.shuffle(men)
+        rng.shuffle(women)
+        # Unmarried women by the family of their grandparents.
+        cousins = {}
+        for woman in women:
+            cousins.setdefault(self.grandparents(woman), set()).add(woman)
+        married = set()
+        families = []
+        for husband in men:
+            wife = None
+            clan = self.grandparents(husband)
+            if clan >= 0 and rng.random() < spec.collapse:
+                # Any cousin but a sister.
+                for candidate in cousins.get(clan, ()):
+                    if self.child_family[candidate] != self.child_family[husband]:
+                        wife = candidate
+                        break
+            if wife is None:
+                while women and women[-1] in married:
+                    women.pop()
+                if not women:
+                    break
+                wife = women.pop()
+            married.add(wife)
+            cousins[self.grandparents(wife)].discard(wife)
+            families.append(self.add_family(husband, wife))
+        return families
+
+    def grandparents(self, n):
+        """ Return the family of the father of individual n, or -1 """
+        family = self.child_family[n]
+        if family < 0:
+            return -1
+        return self.child_family[self.husbands[family]]
+
+    def add_family(self, husband, wife):
+        """ Add a family of two spouses and return its number """
+        family = len(self.husbands)
+        self.husbands.append(husband)
+        self.wives.append(wife)
+        self.children.append([])
+        self.spouse_families.setdefault(husband, []).append(family)
+        self.spouse_families.setdefault(wife, []).append(family)
+        return family
+
+
+def generate(fd, spec=None, **options):
+    """ Write a synthetic GEDCOM tree to a binary file object in UTF-8
+
+    The tree is described by a TreeSpec, or by its keyword arguments:
+      - `individuals` and `generations`: the size and depth of the tree
+      - `collapse`: the rate of cousin marriages, see Pedigree
+      - `notes` and `sources`: the probability of an individual having a
+        NOTE, long enough to be continued on CONC lines, and a SOUR
+        citation of one of the source records
+      - `non_ascii`: the probability of a name with non-ASCII letters,
+        including Hebrew script
+      - `hebrew_dates`: the probability of a date in the Hebrew calendar
+      - `seed`: the same seed and parameters give the same file
+    Returns the Pedigree of the tree.
+    """
+    if spec is None:
+        spec = TreeSpec(**options)
+    rng = random.Random(spec.seed)
+    pedigree = Pedigree(spec, rng)
+    source_count = max(1, spec.individuals // 100)
+    writer = GedcomWriter(fd)
+    for line in ["0 HEAD", "1 SOUR python-gedcom", "2 NAME Synthetic tree",
+                 "1 GEDC", "2 VERS 5.5.1", "2 FORM LINEAGE-LINKED",
+                 "1 CHAR UTF-8"]:
+        writer.write_line(line)
+
+    surnames = [None] * spec.individuals
+    for n in range(spec.individuals):
+        sex = pedigree.sex[n]
+        family = pedigree.child_family[n]
+        if family >= 0:
+            surname = surnames[pedigree.husbands[family]]
+        elif rng.random() < spec.non_ascii:
+            surname = rng.choice(NON_ASCII_SURNAMES)
+        else:
+            surname = rng.choice(SURNAMES)
+        surnames[n] = surname
+        if rng.random() < spec.non_ascii:
+            given = rng.choice(NON_ASCII_GIVEN[sex])
+        else:
+            given = rng.choice(GIVEN_NAMES[sex])
+        born = (FIRST_YEAR + GENERATION_YEARS * pedigree.generation[n] +
+                rng.randint(-5, 5))
+        writer.write_line("0 @I{}@ INDI".format(n + 1))
+        writer.write_line("1 NAME {} /{}/".format(given, surname))
+        writer.write_line("1 SEX {}".format(sex))
+        write_event(writer, "BIRT", born, spec, rng)
+        if rng.random() < 0.7:
+            write_event(writer, "DEAT", born + rng.randint(1, 90), spec, rng)
+        if family >= 0:
+            writer.write_line("1 FAMC @F{}@".format(family + 1))
+        for family in pedigree.spouse_families.get(n, ()):
+            writer.write_line("1 FAMS @F{}@".format(family + 1))
+        if rng.random() < spec.notes:
+            words = [rng.choice(NOTE_WORDS) for i in range(rng.randint(5, 80))]
+            note = " ".join(words).capitalize()
+            writer.write_element(Element(1, "", "NOTE", note))
+        if rng.random() < spec.sources:
+            writer.write_line("1 SOUR @S{}@".format(rng.randint(1, source_count)))
+            writer.write_line("2 PAGE {}".format(rng.randint(1, 500)))
+
+    for family in range(len(pedigree.husbands)):
+        husband = pedigree.husbands[family]
+        writer.write_line("0 @F{}@ FAM".format(family + 1))
+        writer.write_line("1 HUSB @I{}@".format(husband + 1))
+        writer.write_line("1 WIFE @I{}@".format(pedigree.wives[family] + 1))
+        married = (FIRST_YEAR + GENERATION_YEARS * pedigree.generation[husband] +
+                   rng.randint(18, 30))
+        write_event(writer, "MARR", married, spec, rng)
+        for child in pedigree.children[family]:
+            writer.write_line("1 CHIL @I{}@".format(child + 1))
+            if rng.random() < NATURAL_CHILDREN:
+                writer.write_line("2 _FREL Natural")
+                writer.write_line("2 _MREL Natural")
+
+    for source in range(source_count):
+        writer.write_line("0 @S{}@ SOUR".format(source + 1))
+        writer.write_line("1 TITL Register of {}".format(rng.choice(PLACES)))
+    writer.write_line("0 TRLR")
+    writer.close()
+    return pedigree
+
+
+def write_event(writer, tag, year, spec, rng):
+    """ Write an event with a date in `year` and a place """
+    writer.write_line("1 " + tag)
+    writer.write_line("2 DATE " + random_date(year, spec, rng))
+    writer.write_line("2 PLAC " + rng.choice(PLACES))
+
+
+def random_date(year, spec, rng):
+    """ Return a GEDCOM date in a year, sometimes approximate or in the
+    Hebrew calendar.
+    """
+    if rng.random() < spec.hebrew_dates:
+        return "@#DHEBREW@ {} {} {}".format(rng.randint(1, 29),
+                                            rng.choice(HEBREW_MONTHS),
+                                            year + 3760)
+    kind = rng.random()
+    if kind < 0.1:
+        return "ABT {}".format(year)
+    if kind < 0.2:
+        return "BET {} AND {}".format(year - 1, year + 1)
+    if kind < 0.4:
+        return str(year)
+    return "{} {} {}".format(rng.randint(1, 28), rng.choice(MONTHS), year)
+
+
+def main(argv=None):
+    """ Command line entry point of gedcom-generate """
+    parser = argparse.ArgumentParser(
+        prog="gedcom-generate",
+        description="Write a synthetic GEDCOM tree.")
+    parser.add_argument("output", metavar="FILE")
+    parser.add_argument("-n", "--individuals", type=int, default=1000)
+    parser.add_argument("--generations", type=int, default=8)
+    parser.add_argument("--collapse", type=float, default=0.05,
+                        help="rate of cousin marriages")
+    parser.add_argument("--notes", type=float, default=0.2)
+    parser.add_argument("--sources", type=float, default=0.3)
+    parser.add_argument("--non-ascii", type=float, default=0.1)
+    parser.add_argument("--hebrew-dates", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    spec = TreeSpec(args.individuals, args.generations, args.collapse,
+                    args.notes, args.sources, args.non_ascii,
+                    args.hebrew_dates, args.seed)
+    with open(args.output, 'wb') as fd:
+        generate(fd, spec)
+    return 0
@@ -0,0 +1,158 @@
+#
+# Gedcom 6.0 Parser
+#
+# Copyright (C) 2015 The Museum of the Jewish People
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+from __future__ import unicode_literals
+import codecs
+import re
+
+# Maximum length of a GEDCOM line, terminator included, in characters.
+MAX_LINE = 255
+
+# Number of characters gathered before they are encoded and written.
+BUFFER_SIZE = 1 << 16
+
+# Codec writing the data that follows each byte order mark.
+BOM_ENCODINGS = {
+    codecs.BOM_UTF8: 'utf-8',
+    codecs.BOM_UTF16_LE: 'utf-16-le',
+    codecs.BOM_UTF16_BE: 'utf-16-be',
+}
+
+newline_re = re.compile(r'\r\n|\r|\n')
+
+
+class GedcomWriter(object):
+    """ Buffered writer of GEDCOM lines to a binary file object
+
+    Lines are gathered until `buffer_size` characters are pending, then
+    joined, encoded and written at once. Values too long for a line of
+    `max_line` characters are continued on CONC lines, and values holding
+    line breaks on CONT lines; a `max_line` of None only splits at line
+    breaks. A given byte order mark is written first, and the data is then
+    encoded with the matching codec. Call close() to write what is pending.
+    """
+
+    def __init__(self, fd, encoding='utf-8', newline='\n', max_line=MAX_LINE,
+                 bom=b'', final_newline=True, buffer_size=BUFFER_SIZE,
+                 errors='strict'):
+        self.fd = fd
+        self.newline = newline
+        self.max_line = max_line
+        self.final_newline = final_newline
+        self.buffer_size = buffer_size
+        if bom:
+            fd.write(bom)
+            encoding = BOM_ENCODINGS[bom]
+        self.encoder = codecs.getincrementalencoder(encoding)(errors)
+        self.pending = []
+        self.pending_size = 0
+        self.separator = ''
+
+    def write_element(self, element):
+        """ Write the line of an element, without its children """
+        level = element.level
+        if element.pointer:
+            head = "{} {} {}".format(level, element.pointer, element.tag)
+        else:
+            head = "{} {}".format(level, element.tag)
+        value = element.value
+        if not value:
+            self.write_line(head)
+        elif (self.max_line is None or
+              len(head) + len(value) + len(self.newline) < self.max_line) and \
+                '\n' not in value and '\r' not in value:
+            self.write_line(head + " " + value)
+        else:
+            for line in split_value(head, level, value, self.max_line,
+                                    len(self.newline)):
+                self.write_line(line)
+
+    def write_tree(self, element, keep=None):
+        """ Write an element and its subtree, leaving out the elements for
+        which `keep`, if given, returns False, with their subtrees.
+        """
+        stack = [element]
+        while stack:
+            element = stack.pop()
+            if keep is not None and not keep(element):
+                continue
+            self.write_element(element)
+            stack.extend(reversed(element.children))
+
+    def write_line(self, line):
+        """ Write one line, given without its terminator """
+        line = self.separator + line
+        self.separator = self.newline
+        self.pending.append(line)
+        self.pending_size += len(line)
+        if self.pending_size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """ Encode and write the pending lines """
+        self.fd.write(self.encoder.encode(''.join(self.pending)))
+        self.pending = []
+        self.pending_size = 0
+
+    def close(self):
+        """ Write the pending lines and the final terminator. The file
+        object is left open.
+        """
+        if self.final_newline and self.separator:
+            self.pending.append(self.newline)
+        self.flush()
+        self.fd.write(self.encoder.encode('', True))
+
+
+def split_value(head, level, value, max_line, terminator):
+    """ Return the lines of an element whose value needs CONT or CONC
+    lines. `head` is the start of its first line, before the value, and
+    `terminator` the length of the line terminator.
+    """
+    lines = []
+    for n, segment in enumerate(newline_re.split(value)):
+        if n:
+            head = "{} CONT".format(level + 1)
+        while max_line is not None and \
+                len(head) + 1 + len(segment) + terminator > max_line:
+            cut = split_point(segment, max_line - len(head) - 1 - terminator)
+            lines.append(head + " " + segment[:cut])
+            segment = segment[cut:]
+            head = "{} CONC".format(level + 1)
+        lines.append(head + " " + segment if segment else head)
+    return lines
+
+
+def split_point(text, room):
+    """ Return where to cut a text to fit in `room` characters, avoiding
+    cuts next to a space, which some readers strip from CONC lines.
+    """
+    room = max(room, 1)
+    cut = room
+    while cut > 1 and (text[cut - 1] == ' ' or text[cut] == ' '):
+        cut -= 1
+    if cut == 1 and (text[0] == ' ' or text[1] == ' '):
+        return room
+    return cut
+
+
+def write_records(records, fd, **options):
+    """ Write records, such as those from iter_records, to a binary file
+    object as they come. Options are those of GedcomWriter.
+    """
+    writer = GedcomWriter(fd, **options)
+    for record in records:
+        writer.write_tree(record)
+    writer.close()
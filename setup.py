@@ -4,6 +4,7 @@ setup(
     name='python-gedcom',
     version='0.2dev',
     packages=['gedcom',],
+    scripts=['bin/gedcom-ingest', 'bin/gedcom-bench', 'bin/gedcom-generate'],
     license='GPLv2',
     package_dir={'': '.'},
     description=open('README').readlines()[0].strip(),
@@ -14,4 +15,7 @@ setup(
     install_requires=[
         'chardet',
     ],
+    extras_require={
+        'kinship': ['numpy'],
+    },
 )
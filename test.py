@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
+import codecs
+import threading
 import pytest
-from gedcom import Gedcom, GedcomParseError
+from gedcom import (Gedcom, Element, GedcomParseError, FeedParser, iter_records,
+                    write_records, ParseMetrics)
 from StringIO import StringIO
 
 
@@ -65,3 +68,1036 @@ for the win
     assert g.as_list[2].value == "python"
 
 
+def test_iter_records():
+    fd = StringIO(b"""0 HEAD
+1 CHAR UTF-8
+0 @I1@ INDI
+1 NAME John /Doe/
+2 GIVN John
+0 TRLR""")
+    records = list(iter_records(fd, chunk_size=7))
+    assert [r.tag for r in records] == ["HEAD", "INDI", "TRLR"]
+    assert records[1].pointer == "@I1@"
+    assert records[1].children[0].children[0].value == "John"
+    assert records[1].parent.children == []
+
+def test_feed_parser():
+    data = u"""0 HEAD
+1 CHAR ANSI
+0 @I1@ INDI
+1 NAME Zoë /Doe/
+0 TRLR
+""".replace(u"\n", u"\r\n").encode('cp1252')
+    parser = FeedParser()
+    assert parser.feed(data[:12]) == []
+    assert parser.encoding is None
+    records = parser.feed(data[12:24])
+    assert parser.encoding == 'cp1252' and records == []
+    for n in range(24, len(data), 3):
+        records += parser.feed(data[n:n + 3])
+    records += parser.close()
+    assert [r.tag for r in records] == ["HEAD", "INDI", "TRLR"]
+    assert records[1].children[0].value == u"Zoë /Doe/"
+    assert FeedParser().close() == []
+
+def test_iter_records_level_jump():
+    fd = StringIO(b"""0 HEAD
+2 SOUR FTW""")
+    with pytest.raises(SyntaxError):
+        list(iter_records(fd))
+
+def test_detect_header():
+    g = Gedcom(stream=u"""0 HEAD
+1 CHAR UTF-8
+0 @I1@ INDI
+1 NAME אינה""".encode('utf-8'), detect="header")
+    assert g.encoding == "utf-8"
+    assert g.encoding_strategy == "header"
+    assert g.as_list[3].value == u'אינה'
+
+def test_detect_bom():
+    g = Gedcom(stream=u"""0 HEAD
+1 CHAR ANSI""".encode('utf-16'), detect="header")
+    assert g.encoding_strategy == "bom"
+    assert g.as_list[1].value == "ANSI"
+
+def test_detect_fallback():
+    g = Gedcom(stream=b"0 HEAD\n1 SOUR FTW", detect="header")
+    assert g.encoding_strategy == "chardet"
+    assert len(g.as_list) == 2
+    g = Gedcom(stream=b"0 HEAD\n1 CHAR UNICODE\n0 @I1@ INDI", detect="header")
+    assert g.encoding_strategy == "chardet"
+    assert len(g.as_list) == 3
+
+def test_mmap(tmpdir):
+    path = tmpdir.join("mmap.ged")
+    path.write(u"""0 HEAD
+1 CHAR UTF-8
+0 @I1@ INDI
+1 NAME אינה /Doe/
+1 NOTE  spaced""".encode('utf-8'), mode='wb')
+    g = Gedcom(str(path), detect="header", use_mmap=True)
+    plain = Gedcom(str(path), detect="header")
+    indi = g.as_dict['@I1@']
+    assert 'value' not in indi.children[0].__dict__
+    assert indi.name == (u'אינה', 'Doe')
+    assert ([e.value for e in g.as_list] ==
+            [e.value for e in plain.as_list])
+    assert [e.tag for e in g.as_list] == [e.tag for e in plain.as_list]
+
+def test_detect_whole(tmpdir):
+    import chardet
+    from gedcom.parser import detect_whole
+    data = u"0 HEAD\n0 @I1@ INDI\n1 NAME אינה /Doe/\n".encode('utf-8') * 50
+    assert detect_whole(data, chunk_size=16) == chardet.detect(data)['encoding']
+    path = tmpdir.join("full.ged")
+    path.write(data, mode='wb')
+    g = Gedcom(str(path), detect="full", use_mmap=True)
+    assert (g.encoding, g.encoding_strategy) == (chardet.detect(data)['encoding'],
+                                                 "chardet")
+    assert g.as_dict['@I1@'].name == (u'אינה', 'Doe')
+
+def test_mmap_empty(tmpdir):
+    path = tmpdir.join("empty.ged")
+    path.write(b"", mode='wb')
+    g = Gedcom(str(path), use_mmap=True)
+    assert len(g.as_list) == 0
+
+def test_compact():
+    stream = b"""0 HEAD
+1 CHAR UTF-8
+0 @I1@ INDI
+1 NAME John /Doe/
+1 SEX M
+1 BIRT
+2 DATE 1 JAN 1900
+1 FAMS @F1@
+0 @F1@ FAM
+1 HUSB @I1@
+0 TRLR"""
+    plain = Gedcom(stream=stream)
+    g = Gedcom(stream=stream, compact=True)
+    assert len(g.as_list) == len(plain.as_list)
+    assert sorted(g.as_dict.keys()) == sorted(plain.as_dict.keys())
+    for e, p in zip(g.as_list, plain.as_list):
+        assert (e.level, e.pointer, e.tag, e.value) == (p.level, p.pointer, p.tag, p.value)
+        assert [c.tag for c in e.children] == [c.tag for c in p.children]
+        assert e.parent.tag == p.parent.tag
+    indi = g.as_dict['@I1@']
+    assert indi.name == ("John", "Doe")
+    assert indi.birth_year == 1900
+    assert g.families(indi) == [g.as_dict['@F1@']]
+    assert [e.tag for e in g.top_element.children] == ["HEAD", "INDI", "FAM", "TRLR"]
+    with pytest.raises(TypeError):
+        indi.add_child(g.as_list[0])
+
+def test_compact_level_jump():
+    with pytest.raises(SyntaxError):
+        Gedcom(stream=b"0 HEAD\n2 SOUR FTW", compact=True)
+
+def test_compact_wide():
+    deep = b"".join(b"%d NOTE\n" % level for level in range(300))
+    g = Gedcom(stream=deep, compact=True)
+    assert [e.level for e in g.as_list] == list(range(300))
+    tags = b"0 HEAD\n" + b"".join(b"1 T%d\n" % n for n in range(70000))
+    g = Gedcom(stream=tags, compact=True)
+    assert len(g.as_list) == 70001
+    assert g.as_list[-1].tag == "T69999"
+
+def test_summary():
+    g = Gedcom(stream=b"""0 @I1@ INDI
+1 NAME
+2 GIVN John
+2 SURN Doe
+1 SEX M
+1 BIRT
+2 DATE 5 MAR 5660
+2 PLAC Vilna
+2 SOUR @S1@
+1 BIRT
+2 SOUR @S2@
+1 OCCU Tailor""")
+    indi = g.as_list[0]
+    assert indi.name == ("John", "Doe")
+    assert indi.birth == ("5 MAR 5660", "Vilna", ("@S1@", "@S2@"))
+    assert indi.birth_year == 1900
+    assert indi.death == ("", "", ())
+    assert not indi.deceased
+    assert indi.occupation == "Tailor"
+    assert [e.tag for e in indi.children_with_tag("BIRT")] == ["BIRT", "BIRT"]
+    assert indi.summary is indi.summary
+
+def test_summary_invalidated():
+    g = Gedcom(stream=b"""0 @I1@ INDI
+1 BIRT""")
+    indi, birt = g.as_list
+    assert indi.birth_year is None
+    date = Element(2, "", "DATE", "1900")
+    birt.add_child(date)
+    date.add_parent(birt)
+    assert indi.birth_year == 1900
+    death = Element(1, "", "DEAT", "")
+    indi.add_child(death)
+    assert indi.deceased
+
+family_stream = b"""0 HEAD
+0 @I1@ INDI
+1 NAME Abraham /Cohen/
+1 FAMS @F1@
+0 @I2@ INDI
+1 NAME Sarah /Levi/
+1 FAMS @F1@
+0 @I3@ INDI
+1 NAME Isaac /Cohen/
+1 FAMC @F1@
+1 FAMS @F2@
+0 @I4@ INDI
+1 NAME Rebecca /Levi/
+1 FAMS @F2@
+0 @I5@ INDI
+1 NAME Jacob /Cohen/
+1 FAMC @F2@
+0 @F1@ FAM
+1 HUSB @I1@
+1 WIFE @I2@
+1 CHIL @I3@
+2 _FREL Natural
+2 _MREL Natural
+0 @F2@ FAM
+1 HUSB @I3@
+1 WIFE @I4@
+1 CHIL @I5@
+2 _MREL Natural
+1 CHIL @I9@
+0 TRLR"""
+
+def test_relationships():
+    g = Gedcom(stream=family_stream)
+    d = g.as_dict
+    assert g.families(d['@I3@']) == [d['@F2@']]
+    assert g.families(d['@I3@'], "FAMC") == [d['@F1@']]
+    assert g.get_family_members(d['@F2@']) == [d['@I3@'], d['@I4@'], d['@I5@']]
+    assert g.get_family_members(d['@F2@'], "CHIL") == [d['@I5@']]
+    assert g.get_parents(d['@I5@']) == [d['@I3@'], d['@I4@']]
+    assert g.get_parents(d['@I5@'], "NAT") == [d['@I3@']]
+    assert g.get_parents(d['@I3@'], "NAT") == [d['@I2@'], d['@I1@']]
+    with pytest.raises(ValueError):
+        g.families(d['@F1@'])
+
+def test_ancestors():
+    # I5 is a child of first cousins I3 and I4, whose grandparents are
+    # I1 and I2. I6 is listed as their own father.
+    g = Gedcom(stream=b"""0 @I1@ INDI
+1 FAMS @F1@
+0 @I2@ INDI
+1 FAMS @F1@
+0 @A@ INDI
+1 FAMC @F1@
+1 FAMS @F2@
+0 @B@ INDI
+1 FAMC @F1@
+1 FAMS @F3@
+0 @I3@ INDI
+1 FAMC @F2@
+1 FAMS @F4@
+0 @I4@ INDI
+1 FAMC @F3@
+1 FAMS @F4@
+0 @I5@ INDI
+1 FAMC @F4@
+0 @I6@ INDI
+1 FAMC @F5@
+1 FAMS @F5@
+0 @F1@ FAM
+1 HUSB @I1@
+1 WIFE @I2@
+1 CHIL @A@
+1 CHIL @B@
+0 @F2@ FAM
+1 HUSB @A@
+1 CHIL @I3@
+0 @F3@ FAM
+1 WIFE @B@
+1 CHIL @I4@
+0 @F4@ FAM
+1 HUSB @I3@
+1 WIFE @I4@
+1 CHIL @I5@
+2 _MREL Natural
+0 @F5@ FAM
+1 HUSB @I6@
+1 CHIL @I6@""")
+    d = g.as_dict
+    generations = [(e.pointer, n) for e, n in
+                   g.get_ancestor_generations(d['@I5@'])]
+    assert generations == [('@I3@', 1), ('@I4@', 1), ('@A@', 2), ('@B@', 2),
+                           ('@I1@', 3), ('@I2@', 3)]
+    assert g.get_ancestors(d['@I5@'], max_generations=2) == [
+        d['@I3@'], d['@I4@'], d['@A@'], d['@B@']]
+    assert g.get_ancestors(d['@I5@'], "NAT") == [d['@I3@']]
+    assert g.get_ancestors(d['@I6@']) == []
+
+def test_kinship_label():
+    from gedcom.relations import kinship_label
+    assert kinship_label(0, 1) == "parent"
+    assert kinship_label(0, 4) == "2nd great-grandparent"
+    assert kinship_label(1, 0) == "child"
+    assert kinship_label(1, 1) == "sibling"
+    assert kinship_label(1, 3) == "great-aunt/uncle"
+    assert kinship_label(2, 2) == "1st cousin"
+    assert kinship_label(3, 4) == "2nd cousin once removed"
+    assert kinship_label(5, 2) == "1st cousin 3 times removed"
+
+def test_relationship():
+    g = Gedcom(stream=family_stream + b"""
+0 @I6@ INDI
+1 FAMC @F3@
+0 @I7@ INDI
+1 FAMC @F3@
+0 @I8@ INDI
+0 @F3@ FAM
+1 HUSB @I5@
+1 CHIL @I6@
+1 CHIL @I7@""")
+    d = g.as_dict
+    rel = g.relationship(d['@I6@'], d['@I7@'])
+    assert rel.label == "sibling"
+    assert rel.ancestors == [d['@I5@']]
+    assert rel.path == [d['@I6@'], d['@I5@'], d['@I7@']]
+    rel = g.relationship(d['@I1@'], d['@I6@'])
+    assert rel.label == "great-grandparent"
+    assert rel.path == [d['@I1@'], d['@I3@'], d['@I5@'], d['@I6@']]
+    assert g.relationship(d['@I4@'], d['@I6@']).label == "grandparent"
+    assert g.relationship(d['@I4@'], d['@I1@']) is None
+    assert g.relationship(d['@I8@'], d['@I8@']).label == "self"
+    pairs = [(d['@I6@'], d['@I7@']), (d['@I1@'], d['@I6@']),
+             (d['@I4@'], d['@I1@']), (d['@I6@'], d['@I2@'])]
+    batch = list(g.batch_relationship(pairs, cache_size=2))
+    assert [r and r.label for r in batch] == [
+        "sibling", "great-grandparent", None, "great-grandchild"]
+    assert batch[1].path == rel.path
+
+def test_descendants():
+    g = Gedcom(stream=family_stream)
+    d = g.as_dict
+    assert pointers(g.get_descendants(d['@I1@'])) == ['@I3@', '@I5@']
+    assert pointers(g.get_descendants(d['@I2@'], max_generations=1)) == ['@I3@']
+    assert [(e.pointer, n) for e, n in g.get_descendant_generations(d['@I4@'])] == [
+        ('@I5@', 1)]
+    assert g.get_descendants(d['@I5@']) == []
+    with pytest.raises(ValueError):
+        g.get_descendants(d['@F1@'])
+
+
+def test_extract():
+    g = Gedcom(stream=b"""0 HEAD
+1 SUBM @U1@
+0 @U1@ SUBM
+0 @I1@ INDI
+1 NAME Abraham /Cohen/
+1 FAMS @F1@
+1 SOUR @S1@
+2 PAGE 12
+1 ASSO @I2@
+0 @I2@ INDI
+1 NAME Sarah /Levi/
+1 FAMS @F1@
+0 @I3@ INDI
+1 NAME Isaac /Cohen/
+1 FAMC @F1@
+1 NOTE @N1@
+0 @F1@ FAM
+1 HUSB @I1@
+1 WIFE @I2@
+1 CHIL @I3@
+0 @S1@ SOUR
+1 REPO @R1@
+1 NOTE @N1@
+0 @N1@ NOTE Seen in 1901
+0 @R1@ REPO
+0 @S2@ SOUR
+0 TRLR
+""")
+    d = g.as_dict
+    people = [d['@I1@']] + g.get_descendants(d['@I1@'])
+    out = StringIO()
+    g.extract(people + [d['@I1@']], out)
+    extract = Gedcom(stream=out.getvalue())
+    assert [(e.level, e.pointer, e.tag, e.value) for e in extract.as_list] == [
+        (0, '', 'HEAD', ''), (1, '', 'SUBM', '@U1@'),
+        (0, '@I1@', 'INDI', ''), (1, '', 'NAME', 'Abraham /Cohen/'),
+        (1, '', 'FAMS', '@F1@'), (1, '', 'SOUR', '@S1@'), (2, '', 'PAGE', '12'),
+        (0, '@I3@', 'INDI', ''), (1, '', 'NAME', 'Isaac /Cohen/'),
+        (1, '', 'FAMC', '@F1@'), (1, '', 'NOTE', '@N1@'),
+        (0, '@F1@', 'FAM', ''), (1, '', 'HUSB', '@I1@'), (1, '', 'CHIL', '@I3@'),
+        (0, '@U1@', 'SUBM', ''),
+        (0, '@S1@', 'SOUR', ''), (1, '', 'REPO', '@R1@'), (1, '', 'NOTE', '@N1@'),
+        (0, '@N1@', 'NOTE', 'Seen in 1901'), (0, '@R1@', 'REPO', ''),
+        (0, '', 'TRLR', '')]
+    report = extract.check_references()
+    assert report.dangling == [] and report.mismatched == []
+
+
+def test_find_path_to_anc():
+    g = Gedcom(stream=family_stream)
+    d = g.as_dict
+    assert g.find_path_to_anc(d['@I5@'], d['@I1@']) == [
+        d['@I5@'], d['@I3@'], d['@I1@']]
+    assert g.find_path_to_anc(d['@I5@'], d['@I4@']) is None
+
+def test_kinship_matrix():
+    numpy = pytest.importorskip("numpy")
+    from gedcom.kinship import kinship_matrix
+    # I5 is the child of half first cousins, F = 1/32.
+    g = Gedcom(stream=b"""0 @I0@ INDI
+0 @I1@ INDI
+0 @I2@ INDI
+0 @A@ INDI
+1 FAMC @F1@
+0 @B@ INDI
+1 FAMC @F2@
+0 @I3@ INDI
+1 FAMC @F3@
+0 @I4@ INDI
+1 FAMC @F4@
+0 @I5@ INDI
+1 FAMC @F5@
+0 @F1@ FAM
+1 HUSB @I0@
+1 WIFE @I1@
+1 CHIL @A@
+2 _FREL Natural
+2 _MREL Natural
+0 @F2@ FAM
+1 HUSB @I2@
+1 WIFE @I1@
+1 CHIL @B@
+2 _FREL Natural
+2 _MREL Natural
+0 @F3@ FAM
+1 HUSB @A@
+1 CHIL @I3@
+2 _MREL Natural
+0 @F4@ FAM
+1 WIFE @B@
+1 CHIL @I4@
+2 _FREL Natural
+0 @F5@ FAM
+1 HUSB @I3@
+1 WIFE @I4@
+1 CHIL @I5@
+2 _FREL Natural
+2 _MREL Natural""")
+    d = g.as_dict
+    people = [d['@I1@'], d['@A@'], d['@B@'], d['@I3@'], d['@I5@'], d['@I2@']]
+    expected = numpy.array([
+        [16, 8, 8, 4, 4, 0],
+        [8, 16, 4, 8, 5, 0],
+        [8, 4, 16, 2, 5, 8],
+        [4, 8, 2, 16, 8.5, 0],
+        [4, 5, 5, 8.5, 16.5, 2],
+        [0, 0, 8, 0, 2, 16],
+    ]) / 32
+    assert numpy.allclose(kinship_matrix(g, people), expected)
+    assert numpy.allclose(kinship_matrix(g, people, block_bytes=1), expected)
+
+
+people_stream = b"""0 @I1@ INDI
+1 NAME Sarah /Cohen/
+1 BIRT
+2 DATE 3 MAR 1901
+1 DEAT
+2 DATE 1950
+0 @I2@ INDI
+1 NAME David /Cohenson/
+1 BIRT
+2 DATE ABT 1925
+0 @I3@ INDI
+1 NAME Sarai /Levi/
+1 BIRT
+2 DATE 1930
+0 @F1@ FAM
+1 HUSB @I2@"""
+
+
+def test_criteria_match():
+    d = Gedcom(stream=people_stream).as_dict
+    assert d['@I1@'].criteria_match("surname=Coh:birthrange=1900-1910")
+    assert not d['@I1@'].criteria_match("surname=Levi")
+    assert d['@I3@'].criteria_match("name=ara:birth=1930")
+    assert not d['@I2@'].criteria_match("deathrange=1900-2000")
+    assert not d['@I1@'].criteria_match("birth=unknown")
+    assert not d['@I1@'].criteria_match("")
+    assert not d['@I1@'].criteria_match("surname")
+    assert not d['@F1@'].criteria_match("surname=")
+
+
+def test_query():
+    g = Gedcom(stream=people_stream)
+    pointers = lambda found: [e.pointer for e in found]
+    assert pointers(g.query("surname=ohen")) == ["@I1@", "@I2@"]
+    assert pointers(g.query(name="Sara", birthrange=(1920, 1940))) == ["@I3@"]
+    assert pointers(g.query("birthrange=1900-1925", death=1950)) == ["@I1@"]
+    assert pointers(g.query()) == ["@I1@", "@I2@", "@I3@"]
+    assert pointers(g.query(surname="Katz")) == []
+    with pytest.raises(ValueError):
+        g.query(born=1900)
+
+
+def test_phonetic_codes():
+    from gedcom.phonetic import soundex, daitch_mokotoff
+    assert soundex("Ashcraft") == "A261"
+    assert soundex("Tymczak") == "T522"
+    assert daitch_mokotoff("Moskowitz") == ["645740"]
+    assert daitch_mokotoff("Jackson") == ["145460", "154600", "445460", "454600"]
+    assert daitch_mokotoff("") == []
+
+
+def test_search_names():
+    g = Gedcom(stream=b"""0 @I1@ INDI
+1 NAME Sarah /Schwartz/
+0 @I2@ INDI
+1 NAME Sara /Shvarts/
+0 @I3@ INDI
+1 NAME Moshe /Szwarc/
+0 @I4@ INDI
+1 NAME Sarah /Levi/""")
+    pointers = lambda found: [e.pointer for e in found]
+    assert pointers(g.search_names("schwartz")) == ["@I1@", "@I2@", "@I3@"]
+    assert pointers(g.search_names("Schwartz", fuzzy=False)) == ["@I1@"]
+    assert pointers(g.search_names("Sarah Szwarc")) == ["@I1@", "@I2@"]
+    assert pointers(g.search_names("Cohen")) == []
+    fd = StringIO()
+    g.phonetic_index.save(fd)
+    other = Gedcom(stream=b"0 @I1@ INDI\n1 NAME Sarah /Schwartz/")
+    other.load_phonetic_index(StringIO(fd.getvalue()))
+    assert len(other.search_names("Sarah")) == 1
+
+
+def test_parse_parallel():
+    stream = family_stream + b"\n1 NOTE trailing\n2 CONT more"
+    serial = Gedcom(stream=stream)
+    g = Gedcom(stream=stream, workers=2)
+    assert [unicode(e) for e in g.as_list] == [unicode(e) for e in serial.as_list]
+    assert [e.pointer for e in g.top_element.children] == \
+        [e.pointer for e in serial.top_element.children]
+    assert g.as_dict['@I5@'].parent is g.top_element
+    assert g.as_list[-1].parent is g.as_list[-2]
+    assert g.get_parents(g.as_dict['@I5@']) == [g.as_dict['@I3@'], g.as_dict['@I4@']]
+    with pytest.raises(SyntaxError):
+        Gedcom(stream=b"0 HEAD\n0 @I1@ INDI\n2 NAME Jump", workers=2)
+
+
+def test_ingest_many(tmpdir):
+    from gedcom.ingest import ingest_many, IngestStats
+    good = tmpdir.join("good.ged")
+    good.write(family_stream, mode="wb")
+    bad = tmpdir.join("bad.ged")
+    bad.write(b"0 HEAD\n2 NOTE jump", mode="wb")
+    paths = [str(good), str(bad), str(tmpdir.join("missing.ged"))]
+    stats = IngestStats()
+    results = dict((r.path, r) for r in
+                   ingest_many(paths, workers=2, max_in_flight=1, stats=stats,
+                               process=len_as_list, detect="header"))
+    assert results[str(good)].individuals == 5
+    assert results[str(good)].families == 2
+    assert results[str(good)].value == results[str(good)].lines
+    assert results[str(good)].error is None
+    assert results[str(bad)].error.startswith("SyntaxError")
+    assert "No such file" in results[str(tmpdir.join("missing.ged"))].error
+    assert (stats.files, stats.failed) == (3, 2)
+    serial = list(ingest_many([str(good)], workers=1))
+    assert serial[0].lines == results[str(good)].lines
+    lazy = list(ingest_many([str(good)], workers=1, lazy=True))
+    assert lazy[0].error is None
+    assert lazy[0].lines == results[str(good)].lines
+    assert (lazy[0].individuals, lazy[0].families) == (5, 2)
+    # Tasks or results that cannot be pickled fail instead of hanging.
+    unpicklable = list(ingest_many([str(good)] * 2, workers=2,
+                                   process=lambda gedcom, path: None))
+    assert [r.error.split(":")[0] for r in unpicklable] == ["PicklingError"] * 2
+    unsendable = list(ingest_many([str(good)], workers=2, process=unpicklable_value))
+    assert "MaybeEncodingError" in unsendable[0].error
+
+
+def unpicklable_value(gedcom, path):
+    return threading.Lock()
+
+
+def len_as_list(gedcom, path):
+    return len(gedcom.as_list)
+
+
+def test_ingest_command(tmpdir, capsys):
+    from gedcom.ingest import main
+    good = tmpdir.join("good.ged")
+    good.write(family_stream, mode="wb")
+    assert main(["-j", "1", str(good)]) == 0
+    out = capsys.readouterr()[0]
+    assert "5 individuals, 2 families" in out
+    assert "1 files (0 failed)" in out
+
+
+def test_snapshot_cache(tmpdir):
+    from gedcom.snapshot import SnapshotCache
+    source = tmpdir.join("tree.ged")
+    source.write(family_stream, mode="wb")
+    cache = SnapshotCache(str(tmpdir.join("cache")))
+    parsed = Gedcom(str(source), cache=cache)
+    assert len(tmpdir.join("cache").listdir()) == 1
+    loaded = Gedcom(str(source), cache=str(tmpdir.join("cache")))
+    assert [unicode(e) for e in loaded.as_list] == [unicode(e) for e in parsed.as_list]
+    assert loaded.encoding == parsed.encoding
+    assert sorted(loaded.as_dict) == sorted(parsed.as_dict)
+    assert loaded.get_parents(loaded.as_dict['@I5@']) == \
+        [loaded.as_dict['@I3@'], loaded.as_dict['@I4@']]
+    # A changed file is reparsed.
+    source.write(family_stream + b"\n0 @I9@ INDI", mode="wb")
+    assert '@I9@' in Gedcom(str(source), cache=cache).as_dict
+    assert len(tmpdir.join("cache").listdir()) == 2
+    SnapshotCache(cache.directory, max_bytes=1).evict()
+    assert tmpdir.join("cache").listdir() == []
+
+    # A snapshot is not used when another encoding is asked for.
+    source.write(b"0 @I1@ INDI\n1 NAME Jos\xc3\xa9 /Cohen/\n0 TRLR\n", mode="wb")
+    utf8 = Gedcom(str(source), cache=cache)
+    latin = Gedcom(str(source), encoding="latin-1", cache=cache)
+    assert utf8.as_dict['@I1@'].name == (u"Jos\xe9", "Cohen")
+    assert latin.as_dict['@I1@'].name == (u"Jos\xc3\xa9", "Cohen")
+    assert (latin.encoding, latin.encoding_strategy) == ("latin-1", "given")
+    again = Gedcom(str(source), encoding="latin-1", cache=cache)
+    assert again.as_dict['@I1@'].name == latin.as_dict['@I1@'].name
+
+
+def test_snapshot_invalid():
+    from gedcom.snapshot import read_snapshot, SnapshotError
+    with pytest.raises(SnapshotError):
+        read_snapshot(StringIO(b"GEDSNAP\x00garbage"))
+
+
+def test_database(tmpdir):
+    from gedcom.database import GedcomDatabase
+    g = Gedcom(stream=family_stream)
+    path = str(tmpdir.join("tree.db"))
+    GedcomDatabase.load(StringIO(family_stream), path, batch_size=3,
+                        transaction_size=5).close()
+    db = GedcomDatabase(path)
+    pointers = lambda found: [e.pointer for e in found]
+    assert sorted(db.as_dict) == sorted(g.as_dict)
+    assert len(db.as_dict) == len(g.as_dict)
+    assert '@I9@' not in db.as_dict
+    i5 = db.as_dict['@I5@']
+    assert unicode(i5) == unicode(g.as_dict['@I5@'])
+    assert [unicode(c) for c in i5.children] == \
+        [unicode(c) for c in g.as_dict['@I5@'].children]
+    for indi in ('@I1@', '@I3@', '@I5@'):
+        for kind in ("ALL", "NAT"):
+            assert pointers(db.get_parents(db.as_dict[indi], kind)) == \
+                pointers(g.get_parents(g.as_dict[indi], kind))
+            assert pointers(db.get_ancestors(db.as_dict[indi], kind)) == \
+                pointers(g.get_ancestors(g.as_dict[indi], kind))
+        assert pointers(db.families(db.as_dict[indi], "FAMC")) == \
+            pointers(g.families(g.as_dict[indi], "FAMC"))
+    assert pointers(db.get_ancestors(i5, max_generations=1)) == \
+        pointers(g.get_ancestors(g.as_dict['@I5@'], max_generations=1))
+    db.close()
+    # Loading again replaces what the database held.
+    db = GedcomDatabase.load(StringIO(b"0 @I1@ INDI\n1 NAME Solo /Cohen/"), path)
+    assert list(db.as_dict) == ['@I1@']
+    assert db.get_ancestors(db.as_dict['@I1@']) == []
+
+
+def test_write_round_trip():
+    for stream in (family_stream, family_stream.replace(b"\n", b"\r\n") + b"\r\n",
+                   codecs.BOM_UTF8 + u"0 HEAD\n1 NOTE אינה\n".encode('utf-8'),
+                   u"0 HEAD\r\n1 CHAR UNICODE".encode('utf-16')):
+        fd = StringIO()
+        Gedcom(stream=stream, detect="header").write(fd)
+        assert fd.getvalue() == stream
+        fd = StringIO()
+        write_records(iter_records(StringIO(stream)), fd)
+        assert Gedcom(stream=fd.getvalue()).as_list[-1].value == \
+            Gedcom(stream=stream).as_list[-1].value
+
+
+def test_write_canonical():
+    # Lines are written back from their fields, in canonical form.
+    for stream, written in (
+            (b"0 HEAD\n1 NOTE  spaced\n", b"0 HEAD\n1 NOTE spaced\n"),
+            (b"0 HEAD\n  1 NOTE a\n", b"0 HEAD\n1 NOTE a\n"),
+            (b"0 HEAD\r\n1 NOTE a\n0 TRLR\r\n", b"0 HEAD\r\n1 NOTE a\r\n0 TRLR\r\n"),
+            (b"0 HEAD\nnot a line\n1 NOTE a\n", b"0 HEAD\n1 NOTE a\n")):
+        fd = StringIO()
+        Gedcom(stream=stream).write(fd)
+        assert fd.getvalue() == written
+
+
+def test_write_split():
+    g = Gedcom(stream=b"0 @N1@ NOTE\n0 TRLR")
+    note = g.as_dict['@N1@']
+    note.value = u"first line\n" + u"ab " * 30 + u"\n\nend"
+    fd = StringIO()
+    g.write(fd, max_line=40)
+    lines = fd.getvalue().split(b"\n")
+    # CONC lines are not cut next to a space.
+    assert lines[:4] == [b"0 @N1@ NOTE first line",
+                         b"1 CONT ab ab ab ab ab ab ab ab ab ab a",
+                         b"1 CONC b ab ab ab ab ab ab ab ab ab a",
+                         b"1 CONC b ab ab ab ab ab ab ab ab ab "]
+    assert max(len(line) + 1 for line in lines) <= 40
+    assert lines[4:] == [b"1 CONT", b"1 CONT end", b"0 TRLR"]
+
+def test_lazy(tmpdir):
+    path = tmpdir.join("lazy.ged")
+    for stream in (family_stream, family_stream.replace(b"\n", b"\r\n")):
+        path.write(codecs.BOM_UTF8 + stream, mode="wb")
+        g = Gedcom(str(path), lazy=2)
+        plain = Gedcom(stream=stream)
+        assert g.record_index.tag(0) == "HEAD"
+        assert len(g.as_dict) == 7 and '@F2@' in g.as_dict
+        indi = g.as_dict['@I3@']
+        assert indi.name == ('Isaac', 'Cohen')
+        assert [c.value for c in indi.children] == ['Isaac /Cohen/', '@F1@', '@F2@']
+        assert indi.parent is g.top_element
+        assert g.as_dict['@I3@'] is indi
+        g.as_dict['@I1@'], g.as_dict['@I2@']
+        assert len(g.records_cache.items) == 2
+        assert g.as_dict['@I3@'] is not indi
+        assert ([(e.level, e.pointer, e.tag, e.value) for e in g.as_list] ==
+                [(e.level, e.pointer, e.tag, e.value) for e in plain.as_list])
+        with pytest.raises(KeyError):
+            g.as_dict['@I9@']
+    path.write(family_stream, mode="wb")
+    assert Gedcom(str(path), lazy=True).record_index.tag(0) == "HEAD"
+    # Level-0 lines may be indented, as for the other parsers.
+    stream = b"0 HEAD\n0 @I1@ INDI\n1 NAME A /B/\n  0 @I2@ INDI\n\t1 NAME C /D/\n0 TRLR\n"
+    path.write(stream, mode="wb")
+    g = Gedcom(str(path), lazy=True)
+    assert sorted(g.as_dict) == sorted(Gedcom(stream=stream).as_dict)
+    assert g.as_dict['@I2@'].name == ('C', 'D')
+
+
+def test_lazy_relationships(tmpdir):
+    path = tmpdir.join("lazy.ged")
+    path.write(family_stream, mode="wb")
+    g = Gedcom(str(path), lazy=2)
+    plain = Gedcom(stream=family_stream)
+    d = g.as_dict
+    grandson, grandfather = d['@I5@'], d['@I1@']
+    # Building the index and looking up other records evicts both.
+    g.relationships, d['@F1@'], d['@F2@']
+    assert grandson is not d['@I5@']
+    assert (g.relationship(grandson, grandfather).label ==
+            plain.relationship(plain.as_dict['@I5@'], plain.as_dict['@I1@']).label)
+    assert pointers(g.get_descendants(grandfather)) == ['@I3@', '@I5@']
+    out, expected = StringIO(), StringIO()
+    g.extract([grandson], out)
+    plain.extract([plain.as_dict['@I5@']], expected)
+    assert out.getvalue() == expected.getvalue()
+    assert len(g.records_cache.items) == 2
+
+def pointers(elements):
+    return [e.pointer for e in elements]
+
+def test_edit():
+    g = Gedcom(stream=family_stream)
+    d = g.as_dict
+    g.relationships, g.query_index, g.phonetic_index
+    changes = []
+    g.subscribe(changes.append)
+
+    child = Element(0, "@I9@", "INDI", "")
+    child.add_child(Element(0, "", "NAME", "Esau /Cohen/"))
+    child.add_child(Element(0, "", "FAMC", "@F2@"))
+    g.add(child)
+    assert child.children[0].level == 1
+    assert g.as_list[-1].tag == "TRLR" and d['@I9@'] is child
+    assert pointers(g.get_parents(child)) == ['@I3@', '@I4@']
+    assert pointers(g.get_family_members(d['@F2@'], "CHIL")) == ['@I5@', '@I9@']
+    assert pointers(g.search_names("Esau")) == ['@I9@']
+
+    g.remove(d['@I4@'])
+    assert '@I4@' not in d
+    assert pointers(g.get_parents(d['@I5@'])) == ['@I3@']
+    g.replace(d['@I1@'].children[0], Element(1, "", "NAME", "Abram /Kohn/"))
+    assert pointers(g.query(surname="Kohn")) == ['@I1@']
+    assert pointers(g.query(surname="Cohen")) == ['@I3@', '@I5@', '@I9@']
+    g.move(d['@F2@'].children[-1], d['@F1@'], 0)
+    assert pointers(g.get_family_members(d['@F1@'], "CHIL")) == ['@I9@', '@I3@']
+    assert [(c.action, pointers(c.records)) for c in changes] == [
+        ("add", ['@I9@']), ("remove", ['@I4@']), ("replace", ['@I1@']),
+        ("move", ['@F2@', '@F1@'])]
+    with pytest.raises(ValueError):
+        g.add(Element(0, "@I2@", "INDI", ""))
+    with pytest.raises(ValueError):
+        g.move(d['@F1@'], d['@F1@'].children[0])
+
+    out = StringIO()
+    g.write(out)
+    fresh = Gedcom(stream=out.getvalue())
+    assert ([(e.level, e.pointer, e.tag, e.value) for e in g.as_list] ==
+            [(e.level, e.pointer, e.tag, e.value) for e in fresh.as_list])
+    for pointer in fresh.as_dict:
+        for method in ("get_parents", "families", "get_family_members"):
+            record = fresh.as_dict[pointer]
+            if (method == "get_family_members") != record.is_family:
+                continue
+            assert (pointers(getattr(g, method)(d[pointer])) ==
+                    pointers(getattr(fresh, method)(record)))
+    assert pointers(g.search_names("Cohen")) == ['@I3@', '@I5@', '@I9@']
+
+
+def test_edit_in_place():
+    g = Gedcom(stream=family_stream)
+    d = g.as_dict
+    assert pointers(g.get_parents(d['@I5@'])) == ['@I3@', '@I4@']
+    assert pointers(g.search_names("Rebecca")) == ['@I4@']
+    # Indexes do not follow elements changed in place until invalidated.
+    d['@F2@'].children[1].value = '@I2@'
+    d['@I4@'].children[0].value = 'Rivka /Levi/'
+    assert pointers(g.get_parents(d['@I5@'])) == ['@I3@', '@I4@']
+    g.invalidate()
+    assert pointers(g.get_parents(d['@I5@'])) == ['@I3@', '@I2@']
+    assert [e.tag for e in g.referrers('@I2@')] == ['WIFE', 'WIFE']
+    assert g.search_names("Rebecca", fuzzy=False) == []
+    assert pointers(g.search_names("Rivka")) == ['@I4@']
+
+
+def test_synthetic_tree():
+    from gedcom.synthetic import generate
+    from gedcom.writer import MAX_LINE
+    out = StringIO()
+    pedigree = generate(out, individuals=300, generations=5, seed=3)
+    again = StringIO()
+    generate(again, individuals=300, generations=5, seed=3)
+    assert out.getvalue() == again.getvalue()
+    g = Gedcom(stream=out.getvalue(), detect="header")
+    individuals = [e for e in g.as_list if e.is_individual]
+    assert len(individuals) == 300 and g.encoding == "utf-8"
+    last = g.as_dict['@I300@']
+    assert len(g.get_ancestors(last, max_generations=4)) > 2
+    assert g.get_parents(last)[0].pointer == "@I{}@".format(
+        pedigree.husbands[pedigree.child_family[299]] + 1)
+    # Notes are continued on CONC lines, and the file is written back
+    # unchanged.
+    lines = out.getvalue().split(b"\n")
+    assert max(len(line) + 1 for line in lines) <= MAX_LINE
+    assert any(line.startswith(b"2 CONC ") for line in lines)
+    written = StringIO()
+    g.write(written)
+    assert written.getvalue() == out.getvalue()
+
+def test_benchmark_results():
+    from gedcom.benchmark import run_benchmarks, write_results, read_results, compare
+    results = run_benchmarks([200], repeat=1, label="test")
+    run = results["runs"][0]
+    assert run["individuals"] == 200
+    assert set(run["benchmarks"]) >= set(["parse", "get_ancestors",
+                                          "find_path_to_anc", "criteria_match"])
+    out = StringIO()
+    write_results(results, out)
+    stored = read_results(StringIO(out.getvalue()))
+    rows, regressions = compare(stored, results)
+    assert len(rows) == len(run["benchmarks"]) and regressions == []
+
+def test_parse_metrics():
+    ended = []
+    metrics = ParseMetrics(on_phase_end=lambda name, seconds: ended.append(name))
+    g = Gedcom(stream=family_stream, detect="header", metrics=metrics)
+    assert list(metrics.phases) == ["read", "detect", "decode", "match", "build"]
+    assert ended == list(metrics.phases)
+    assert metrics.bytes == len(family_stream)
+    assert metrics.lines == len(g.as_list) and metrics.records == 9
+    assert metrics.tags["INDI"] == 5 and metrics.tags["CHIL"] == 3
+    assert metrics.max_depth == 2
+
+    records = []
+    metrics = ParseMetrics(on_record=records.append)
+    assert len(list(iter_records(StringIO(family_stream), chunk_size=50,
+                                 metrics=metrics))) == 9
+    assert [r.pointer for r in records[1:3]] == ["@I1@", "@I2@"]
+    assert metrics.lines == len(g.as_list)
+    assert set(metrics.phases) == set(["read", "detect", "decode", "parse"])
+
+
+def test_parse_date():
+    from datetime import date
+    from gedcom.dates import parse_date, OPEN_START, OPEN_END
+
+    def day(*args):
+        return date(*args).toordinal()
+
+    assert parse_date("3 MAR 1901")[:3] == (day(1901, 3, 3), day(1901, 3, 3), "")
+    assert parse_date("Abt. mar 1901")[:3] == (day(1901, 3, 1), day(1901, 3, 31), "ABT")
+    assert parse_date("BEF 1850")[:2] == (OPEN_START, day(1849, 12, 31))
+    assert parse_date("AFT 1850")[:2] == (day(1851, 1, 1), OPEN_END)
+    bet = parse_date("BET 1840 AND 1850")
+    assert bet == (day(1840, 1, 1), day(1850, 12, 31), "BET", 1845)
+    assert parse_date("FROM 1840 TO 1850")[:2] == bet[:2]
+    assert parse_date("1699/00").year == 1700
+    assert parse_date("@#DJULIAN@ 5 OCT 1582").low == day(1582, 10, 15)
+    assert parse_date("@#DHEBREW@ 15 NSN 5784").low == day(2024, 4, 23)
+    assert parse_date("@#DHEBREW@ 14 ADS 5784").low == day(2024, 3, 24)
+    assert parse_date("@#DHEBREW@ 14 ADR 5783").low == day(2023, 3, 7)
+    assert parse_date("@#DFRENCH R@ 18 BRUM 8").low == day(1799, 11, 9)
+    assert parse_date("INT 1850 (about then)").qualifier == "INT"
+    assert parse_date("44 B.C.").year == -43
+    assert parse_date("5 MAR 5660").year == 1900
+    assert parse_date("(unknown)") is None
+    assert parse_date("sometime in 1850?").year == 1850
+    assert parse_date("(age 102)") is None
+    assert parse_date("ref 123456") is None
+    assert parse_date("@#DROMAN@ 12") is None
+
+    g = Gedcom(stream=b"""0 @I1@ INDI
+1 FAMS @F1@
+1 MARR
+2 DATE @#DHEBREW@ 1 TSH 5661
+0 @F1@ FAM
+1 HUSB @I1@
+1 MARR
+2 DATE ABT 1902
+0 TRLR
+""")
+    individual = g.as_dict["@I1@"]
+    assert individual.marriage_years == [1900]
+    assert g.marriage_years(individual) == [1902]
+
+
+def test_date_ranges():
+    numpy = pytest.importorskip("numpy")
+    from gedcom.dates import OPEN_START, OPEN_END
+    g = Gedcom(stream=b"""0 @I1@ INDI
+1 BIRT
+2 DATE 1850
+0 @I2@ INDI
+1 BIRT
+2 DATE BEF 1800
+0 @I3@ INDI
+0 TRLR
+""")
+    people, low, high = g.date_ranges("BIRT")
+    assert [e.pointer for e in people] == ["@I1@", "@I2@", "@I3@"]
+    assert low[0] < high[0] and high[1] < low[0]
+    assert low[2] == OPEN_START and high[2] == OPEN_END
+    assert list(numpy.nonzero(high < low[0])[0]) == [1]
+
+
+def test_find_duplicates():
+    from gedcom.linkage import find_duplicates
+    a = Gedcom(stream=b"""0 @I1@ INDI
+1 NAME Sarah /Cohen/
+1 SEX F
+1 BIRT
+2 DATE 3 MAR 1901
+1 FAMS @F1@
+0 @I2@ INDI
+1 NAME David /Levi/
+1 SEX M
+1 FAMS @F1@
+0 @I3@ INDI
+1 NAME Sara /Kohen/
+1 SEX F
+1 BIRT
+2 DATE ABT 1901
+0 @I4@ INDI
+1 NAME Sarah /Cohen/
+1 SEX M
+1 BIRT
+2 DATE 1901
+0 @F1@ FAM
+1 HUSB @I2@
+1 WIFE @I1@
+0 TRLR
+""")
+    b = Gedcom(stream=b"""0 @P1@ INDI
+1 NAME Sarah /Cohen/
+1 SEX F
+1 BIRT
+2 DATE 1901
+1 FAMS @F1@
+0 @P2@ INDI
+1 NAME David /Levy/
+1 SEX M
+1 FAMS @F1@
+0 @F1@ FAM
+1 HUSB @P2@
+1 WIFE @P1@
+0 TRLR
+""")
+    assert [m[:2] for m in find_duplicates(a, workers=1)] == [("@I1@", "@I3@")]
+    matches = find_duplicates(a, b, workers=1)
+    assert [m[:2] for m in matches] == [
+        ("@I1@", "@P1@"), ("@I2@", "@P2@"), ("@I3@", "@P1@")]
+    assert matches[0].score == 1.0
+    assert find_duplicates(a, b, workers=2) == matches
+    assert find_duplicates(a, b, workers=1, max_block=1) == matches
+
+    # I1 and I2 are parted when the Daitch-Mokotoff block they share with
+    # the Zohens is split, and are still scored in their Soundex block.
+    c = Gedcom(stream=b"""0 @I1@ INDI
+1 NAME Sarah Rachel /Cohen/
+1 SEX F
+1 BIRT
+2 DATE 1901
+0 @I2@ INDI
+1 NAME Sarah /Cohen/
+1 SEX F
+1 BIRT
+2 DATE 1901
+0 @I3@ INDI
+1 NAME Leah /Zohen/
+1 SEX F
+1 BIRT
+2 DATE 1901
+0 @I4@ INDI
+1 NAME Miriam /Zohen/
+1 SEX F
+1 BIRT
+2 DATE 1901
+0 TRLR
+""")
+    matches = find_duplicates(c, workers=1)
+    assert matches == [("@I1@", "@I2@", 1.0)]
+    assert find_duplicates(c, workers=1, max_block=3) == matches
+
+
+def test_references():
+    g = Gedcom(stream=b"""0 HEAD
+1 SUBM @U1@
+0 @U1@ SUBM
+0 @I1@ INDI
+1 FAMS @F1@
+1 FAMC @I2@
+1 BIRT
+2 DATE @#DJULIAN@ 1700
+2 SOUR @S1@
+0 @I2@ INDI
+1 FAMS @F1@
+0 @I3@ INDI
+0 @F1@ FAM
+1 HUSB @I1@
+1 WIFE @I2@
+1 CHIL @I9@
+0 @S1@ SOUR
+0 TRLR
+""")
+    d = g.as_dict
+    assert [e.parent.pointer for e in g.referrers("@F1@")] == ["@I1@", "@I2@"]
+    assert [e.tag for e in g.referrers("@I1@")] == ["HUSB"]
+    assert g.referrers("@S1@")[0].parent.tag == "BIRT"
+    assert g.referrers("@I3@") == []
+    report = g.check_references()
+    assert [e.value for e in report.dangling] == ["@I9@"]
+    assert pointers(report.orphaned) == ["@I3@"]
+    assert [(e.tag, e.value) for e in report.mismatched] == [("FAMC", "@I2@")]
+
+    g.remove(d["@I3@"])
+    g.remove(d["@F1@"].children[-1])
+    record = Element(0, "@F2@", "FAM", "")
+    record.add_child(Element(0, "", "CHIL", "@I1@"))
+    g.add(record)
+    assert [e.parent.pointer for e in g.referrers("@I1@")] == ["@F1@", "@F2@"]
+    assert g.referrers("@I9@") == []
+    report = g.check_references()
+    assert report.dangling == [] and pointers(report.orphaned) == ["@F2@"]